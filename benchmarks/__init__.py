@@ -0,0 +1,12 @@
+"""
+Benchmarks for momkhulu, run from the repository root as modules so that
+Django is set up before they import the app:
+
+    $ python -m benchmarks.bench_board_rows
+"""
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "momkhulu.settings.dev")
+django.setup()
@@ -0,0 +1,64 @@
+"""
+Measures the bytes sent for each board update, comparing the rendered
+table.html that used to be sent with the JSON board entries, with and without
+permessage-deflate compression.
+
+    $ python -m benchmarks.bench_board_payload
+"""
+
+import zlib
+
+from django.db import transaction
+from django.template import loader
+
+from cspatients.models import PatientEntry
+from cspatients.util import (
+    dump_board_message,
+    get_all_active_patient_entries,
+    get_board_snapshot,
+    rebuild_board_rows,
+    render_board_rows,
+)
+
+
+def deflated_size(content):
+    # permessage-deflate is a raw deflate stream
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return len(compressor.compress(content) + compressor.flush(zlib.Z_SYNC_FLUSH))
+
+
+def create_patient_entries(count):
+    PatientEntry.objects.bulk_create(
+        PatientEntry(
+            surname=f"Patient {i}",
+            location="Labour Ward",
+            indication="Fetal distress",
+            clinician="Dr Clinician",
+            urgency=i % 5 + 1,
+        )
+        for i in range(count)
+    )
+
+
+def main(sizes=(10, 50, 200)):
+    template = loader.get_template("cspatients/table.html")
+    print(
+        f"{'rows':>6} {'html':>9} {'html+deflate':>13} {'json':>9} {'json+deflate':>13}"
+    )
+    for size in sizes:
+        with transaction.atomic():
+            create_patient_entries(size)
+            rebuild_board_rows()
+            rows = render_board_rows(get_all_active_patient_entries())
+            html = template.render({"board_rows": rows}).encode()
+            content = dump_board_message(get_board_snapshot()).encode()
+            transaction.set_rollback(True)
+
+        print(
+            f"{size:>6} {len(html):>9} {deflated_size(html):>13} "
+            f"{len(content):>9} {deflated_size(content):>13}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Times rendering the board table rows with no cached rows, with every row
+cached, and with one changed row, for different board sizes.
+
+    $ python -m benchmarks.bench_board_rows
+"""
+import statistics
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from cspatients.models import PatientEntry
+from cspatients.util import (
+    get_all_active_patient_entries,
+    rebuild_board_rows,
+    render_board_rows,
+)
+
+
+def time_render(patient_entries, before=None, iterations=20):
+    times = []
+    for _ in range(iterations):
+        if before:
+            before()
+        start = time.perf_counter()
+        render_board_rows(patient_entries)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main(sizes=(50, 200, 1000)):
+    print(f"{'rows':>6} {'uncached':>10} {'cached':>10} {'one changed':>12}")
+    for size in sizes:
+        with transaction.atomic():
+            PatientEntry.objects.bulk_create(
+                PatientEntry(surname=f"Patient {i}", urgency=i % 5 + 1)
+                for i in range(size)
+            )
+            rebuild_board_rows()
+            patient_entries = get_all_active_patient_entries()
+            transaction.set_rollback(True)
+
+        def change_one():
+            patient_entries[0].updated_at = timezone.now()
+
+        uncached = time_render(patient_entries, before=cache.clear)
+        cached = time_render(patient_entries)
+        one_changed = time_render(patient_entries, before=change_one)
+
+        print(f"{size:>6} {uncached:>9.2f}ms {cached:>9.2f}ms {one_changed:>11.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Measures the database connection overhead per request, by timing a query on a
+new connection against the same query on a reused connection.
+
+    $ DATABASE_CONNECTION_MODE=persistent python -m benchmarks.bench_connections
+    $ DATABASE_CONNECTION_MODE=pooled python -m benchmarks.bench_connections
+"""
+import statistics
+import time
+
+from django.conf import settings
+from django.db import connection
+
+
+def time_query(reconnect):
+    if reconnect:
+        connection.close()
+
+    start = time.perf_counter()
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    return time.perf_counter() - start
+
+
+def main(iterations=500):
+    new = [time_query(reconnect=True) for _ in range(iterations)]
+    reused = [time_query(reconnect=False) for _ in range(iterations)]
+
+    new_ms = statistics.median(new) * 1000
+    reused_ms = statistics.median(reused) * 1000
+
+    print(f"connection mode:       {settings.DATABASE_CONNECTION_MODE}")
+    print(f"new connection:        {new_ms:.3f}ms")
+    print(f"reused connection:     {reused_ms:.3f}ms")
+    print(f"overhead per request:  {new_ms - reused_ms:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Measures the throughput of concurrent changes to one patient entry, with each
+thread changing its own field, and checks that no change was lost. Needs
+PostgreSQL, as SQLite locks the whole database.
+
+    $ python -m benchmarks.bench_entry_contention
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
+from cspatients.models import PatientEntry
+from cspatients.util import ConcurrentUpdateError, save_model_changes
+
+FIELDS = ["location", "clinician", "indication", "comorbid"]
+
+
+def change_field(patient_id, field, changes, use_version):
+    conflicts = 0
+    try:
+        for i in range(changes):
+            data = {"patient_id": str(patient_id), field: f"{field} {i}"}
+            while True:
+                if use_version:
+                    data["version"] = PatientEntry.objects.get(id=patient_id).version
+                try:
+                    save_model_changes(data)
+                    break
+                except ConcurrentUpdateError:
+                    conflicts += 1
+    finally:
+        connection.close()
+    return conflicts
+
+
+def run(use_version, changes=100):
+    entry = PatientEntry.objects.create(surname="Contention")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(FIELDS)) as executor:
+        conflicts = sum(
+            executor.map(
+                lambda field: change_field(entry.id, field, changes, use_version),
+                FIELDS,
+            )
+        )
+    elapsed = time.perf_counter() - start
+
+    entry.refresh_from_db()
+    lost = [f for f in FIELDS if getattr(entry, f) != f"{f} {changes - 1}"]
+    entry.delete()
+
+    total = changes * len(FIELDS)
+    print(
+        f"{'with version' if use_version else 'fields only':<14}"
+        f"{total / elapsed:>10.1f} changes/s {conflicts:>6} conflicts"
+        f"{'  lost: ' + ', '.join(lost) if lost else ''}"
+    )
+
+
+def main():
+    print(f"{len(FIELDS)} threads changing one entry")
+    run(use_version=False)
+    run(use_version=True)
+
+
+if __name__ == "__main__":
+    main()
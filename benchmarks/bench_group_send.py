@@ -0,0 +1,56 @@
+"""
+Measures the latency of broadcasting to a channel group, from group_send until
+every member has received the message, for each channel layer backend. The
+redis backend is skipped if REDIS_URL can't be reached.
+
+    $ python -m benchmarks.bench_group_send
+    $ REDIS_URL=redis://redis:6379 python -m benchmarks.bench_group_send
+"""
+import asyncio
+import statistics
+import time
+
+from channels.layers import InMemoryChannelLayer
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+
+GROUP = "board-bench"
+MESSAGE = {"type": "view.update", "content": "x" * 2000}
+
+
+async def time_group_send(layer, members, iterations):
+    channels = [await layer.new_channel() for _ in range(members)]
+    for channel in channels:
+        await layer.group_add(GROUP, channel)
+
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await layer.group_send(GROUP, MESSAGE)
+        await asyncio.gather(*(layer.receive(channel) for channel in channels))
+        timings.append(time.perf_counter() - start)
+
+    for channel in channels:
+        await layer.group_discard(GROUP, channel)
+    return statistics.median(timings) * 1000
+
+
+def main(members=20, iterations=200):
+    layers = [
+        ("memory", InMemoryChannelLayer()),
+        ("redis", RedisChannelLayer(hosts=[settings.REDIS_URL])),
+    ]
+    loop = asyncio.get_event_loop()
+
+    print(f"group of {members} clients, median of {iterations} broadcasts")
+    for name, layer in layers:
+        try:
+            ms = loop.run_until_complete(time_group_send(layer, members, iterations))
+        except OSError as e:
+            print(f"{name:8} skipped: {e}")
+            continue
+        print(f"{name:8} {ms:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Times parsing a RapidPro webhook payload of about 100 KB, with a long flow
+history and many results, and extracting the results each endpoint needs.
+
+    $ python -m benchmarks.bench_rp_payload
+"""
+import json
+import statistics
+import time
+
+from cspatients.util import get_rp_dict
+
+
+def make_payload(size=100 * 1024):
+    """
+    A webhook payload like the ones RapidPro sends, padded with earlier flow
+    steps and results until it is about `size` bytes.
+    """
+    payload = {
+        "contact": {"uuid": "contact-uuid", "name": "Nurse", "urn": "whatsapp:2782"},
+        "flow": {"uuid": "flow-uuid", "name": "Status update"},
+        "path": [],
+        "results": {
+            "patient_id": {"category": "All Responses", "value": "1"},
+            "option": {"category": "Delivery", "value": "3"},
+            "foetus": {"category": "All Responses", "value": "2"},
+            "baby_number": {"category": "All Responses", "value": "1"},
+            "delivery_time": {
+                "category": "All Responses",
+                "value": "2019-05-12 10:22+00:00",
+            },
+            "change_category": {"category": "surname", "value": "1"},
+            "new_value": {"category": "All Responses", "value": "Nyasha"},
+        },
+    }
+    i = 0
+    while len(json.dumps(payload)) < size:
+        payload["path"].append(
+            {
+                "node": f"node-{i}",
+                "time": "2019-05-12T10:22:00.000000Z",
+                "exit_uuid": f"exit-{i}",
+            }
+        )
+        payload["results"][f"earlier_result_{i}"] = {
+            "category": "All Responses",
+            "value": f"An earlier answer {i}",
+            "input": f"An earlier answer {i}",
+            "node_uuid": f"node-{i}",
+            "created_on": "2019-05-12T10:22:00.000000Z",
+        }
+        i += 1
+    return json.dumps(payload)
+
+
+def time_call(fn, iterations=200):
+    times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def main():
+    body = make_payload()
+    data = json.loads(body)
+
+    print(f"payload: {len(body) / 1024:.0f} KB, {len(data['results'])} results")
+    print(f"{'json parse':<24} {time_call(lambda: json.loads(body)):.3f}ms")
+    for context in (None, "newentry", "entrystatus", "entrychanges", "patient"):
+        ms = time_call(lambda: get_rp_dict(data, context=context))
+        print(f"{'get_rp_dict ' + str(context):<24} {ms:.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Measures the cold start of each process type, as the time to start Python, set
+up Django and import what the process serves, and the number of modules that
+were imported along the way.
+
+    $ python benchmarks/bench_startup.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUPS = [
+    ("asgi", "web", "import momkhulu.asgi"),
+    ("wsgi", "web", "import momkhulu.wsgi"),
+    ("worker as web", "web", "import django; django.setup(); import cspatients.tasks"),
+    ("worker", "worker", "import django; django.setup(); import cspatients.tasks"),
+]
+
+
+def start(code, role):
+    env = dict(
+        os.environ,
+        PROCESS_ROLE=role,
+        DJANGO_SETTINGS_MODULE=os.environ.get(
+            "DJANGO_SETTINGS_MODULE", "momkhulu.settings.dev"
+        ),
+    )
+    code = f"{code}; import sys, json; print(json.dumps(len(sys.modules)))"
+
+    begin = time.perf_counter()
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT, env=env)
+    return time.perf_counter() - begin, json.loads(output.splitlines()[-1])
+
+
+def main(iterations=10):
+    print(f"{'process':<16} {'role':<8} {'startup':>10} {'modules':>8}")
+    for name, role, code in STARTUPS:
+        results = [start(code, role) for _ in range(iterations)]
+        ms = statistics.median(t for t, _ in results) * 1000
+        print(f"{name:<16} {role:<8} {ms:>8.0f}ms {results[0][1]:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+"""
+Runs the benchmark suite against a test database seeded with a configurable
+number of patient entries and babies, and writes the results as JSON. The
+channel layer is in memory and outbound HTTP is stubbed, so no backing
+services other than the database are needed.
+
+    $ python -m benchmarks.run --entries 200 --output results.json
+    $ python -m benchmarks.run --compare results.json
+
+Each benchmark is run once to warm up, which is discarded, and then --repeats
+times. The median of the runs is reported with its noise, the interquartile
+range of the runs as a fraction of the median. With --compare, exits with an
+error if the median latency of any benchmark regressed by more than
+--threshold plus the noise of both results, up to twice --threshold.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import responses
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from cspatients.models import Baby, Board, PatientEntry
+from cspatients.tests.constants import rp_results
+from cspatients.util import rebuild_board_rows, send_consumers_table
+
+STAND_INS = override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}},
+    CELERY_ALWAYS_EAGER=True,
+    WRITE_QUEUE_PATH=os.path.join(tempfile.mkdtemp(), "write-queue.jsonl"),
+)
+
+
+def seed(entries, babies):
+    """
+    Adds `entries` patient entries, a fifth of them completed, each with up to
+    `babies` babies.
+    """
+    now = timezone.now()
+    board = Board.get_default()
+    PatientEntry.objects.bulk_create(
+        PatientEntry(
+            board=board,
+            surname=f"Patient {i}",
+            urgency=i % 5 + 1,
+            indication="Fetal distress",
+            location="Theatre 1",
+            clinician="Dr Test",
+            foetus=babies,
+            decision_time=now - timezone.timedelta(minutes=i),
+            completion_time=now if i % 5 == 0 else None,
+        )
+        for i in range(entries)
+    )
+    Baby.objects.bulk_create(
+        Baby(patiententry=entry, baby_number=number, delivery_time=now)
+        for entry in PatientEntry.objects.filter(completion_time__isnull=False)
+        for number in range(1, babies + 1)
+    )
+    rebuild_board_rows()
+
+
+def measure(fn, iterations):
+    timings = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        begin = time.perf_counter()
+        fn(i)
+        timings.append(time.perf_counter() - begin)
+    elapsed = time.perf_counter() - start
+
+    timings.sort()
+    return {
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] * 1000,
+        "per_second": iterations / elapsed,
+    }
+
+
+def check_status(response, expected):
+    if response.status_code != expected:
+        raise AssertionError(f"{response.status_code} != {expected}")
+
+
+def bench_board_view(user, iterations):
+    client = Client()
+    client.force_login(user)
+    return measure(
+        lambda i: check_status(client.get(reverse("cspatient_view")), 200), iterations
+    )
+
+
+def bench_patient_list(api_client, iterations):
+    return measure(
+        lambda i: check_status(api_client.get(reverse("rp_patient_list")), 200),
+        iterations,
+    )
+
+
+def bench_status_update(api_client, iterations):
+    ids = list(
+        PatientEntry.objects.filter(completion_time__isnull=True).values_list(
+            "id", flat=True
+        )
+    )
+
+    def update(i):
+        data = rp_results(
+            "Delivery",
+            patient_id=ids[i % len(ids)],
+            foetus=2,
+            baby_number=1,
+            delivery_time="2019-05-12 10:22+00:00",
+        )
+        response = api_client.post(
+            reverse("rp_entrystatus_update"), data, format="json"
+        )
+        check_status(response, 200)
+
+    return measure(update, iterations)
+
+
+def bench_whatsapp_events(iterations):
+    client = APIClient()
+
+    def event(i):
+        data = {
+            "messages": [{"id": f"message-{time.time()}-{i}", "type": "text"}],
+            "contacts": [{"wa_id": "27820001001"}],
+        }
+        response = client.post(reverse("whatsapp-events"), data, format="json")
+        check_status(response, 200)
+
+    return measure(event, iterations)
+
+
+def bench_fan_out(clients, iterations):
+    """
+    From building and sending the board snapshot until every client in the
+    board's group has received it.
+    """
+    from asgiref.sync import async_to_sync, sync_to_async
+    from channels.layers import get_channel_layer
+
+    layer = get_channel_layer()
+    group = Board.get_default().get_group_name()
+    channels = [async_to_sync(layer.new_channel)() for _ in range(clients)]
+    for channel in channels:
+        async_to_sync(layer.group_add)(group, channel)
+
+    async def broadcast():
+        await sync_to_async(send_consumers_table)()
+        await asyncio.gather(*(layer.receive(channel) for channel in channels))
+
+    try:
+        return measure(lambda i: async_to_sync(broadcast)(), iterations)
+    finally:
+        for channel in channels:
+            async_to_sync(layer.group_discard)(group, channel)
+
+
+def get_quantile(values, fraction):
+    """
+    The value at `fraction` of the way through the sorted values, interpolated
+    between the two nearest values.
+    """
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def get_iqr(values):
+    """
+    The interquartile range of the values, which unlike their range isn't
+    thrown by a single outlying run.
+    """
+    values = sorted(values)
+    return get_quantile(values, 0.75) - get_quantile(values, 0.25)
+
+
+def summarise(runs):
+    """
+    The median of each measure over the runs of a benchmark, and the noise in
+    its median latency.
+    """
+    summary = {key: statistics.median([run[key] for run in runs]) for key in runs[0]}
+    summary["noise"] = get_iqr([run["p50_ms"] for run in runs]) / summary["p50_ms"]
+    return summary
+
+
+def run(args):
+    user = User.objects.create_user("benchmark")
+    api_client = APIClient()
+    api_client.credentials(
+        HTTP_AUTHORIZATION="Token {}".format(Token.objects.create(user=user).key)
+    )
+
+    seed(args.entries, args.babies)
+    iterations = args.iterations
+    benchmarks = {
+        "board_view": lambda: bench_board_view(user, iterations),
+        "rp_patient_list": lambda: bench_patient_list(api_client, iterations),
+        "rp_entry_status_update": lambda: bench_status_update(api_client, iterations),
+        "whatsapp_events": lambda: bench_whatsapp_events(iterations),
+        "websocket_fan_out": lambda: bench_fan_out(args.clients, iterations),
+    }
+    # Warms up the caches, connections and code paths, and is discarded
+    for benchmark in benchmarks.values():
+        benchmark()
+
+    runs = {name: [] for name in benchmarks}
+    for _ in range(args.repeats):
+        for name, benchmark in benchmarks.items():
+            runs[name].append(benchmark())
+    return {name: summarise(runs[name]) for name in benchmarks}
+
+
+def get_commit():
+    try:
+        return (
+            subprocess.check_output(["git", "rev-parse", "--short", "HEAD"])
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the benchmarks whose median latency regressed by more than the
+    threshold plus the noise of both results, as a fraction of the baseline.
+    The noise can at most double the threshold, so that noisy runs still
+    catch large regressions.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        noise = result["noise"] + before.get("noise", 0.0)
+        allowed = min(threshold + noise, 2 * threshold)
+        if result["p50_ms"] > before["p50_ms"] * (1 + allowed):
+            regressions.append(
+                f"{name}: {before['p50_ms']:.2f}ms -> {result['p50_ms']:.2f}ms, "
+                f"more than {allowed:.0%}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--entries", type=int, default=200)
+    parser.add_argument("--babies", type=int, default=2)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--output", help="write the results to this file")
+    parser.add_argument("--compare", help="results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    # Stand-ins for RapidPro and Turn
+    http = responses.RequestsMock(assert_all_requests_are_fired=False)
+    http.add(responses.POST, settings.RAPIDPRO_CHANNEL_URL, json={})
+    http.add(responses.POST, settings.TURN_URL + "v1/messages", json={})
+
+    # SQLite's in memory test database is locked against the broadcast threads
+    # while a request writes, so there the broadcasts run in the request
+    broadcast = "celery" if connection.vendor == "sqlite" else "direct"
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        with STAND_INS, override_settings(BOARD_BROADCAST=broadcast), http:
+            results = run(args)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+    report = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "database": connection.vendor,
+        "broadcast": broadcast,
+        "params": {
+            "entries": args.entries,
+            "babies": args.babies,
+            "clients": args.clients,
+            "iterations": args.iterations,
+            "repeats": args.repeats,
+        },
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        if regressions:
+            print("Regressions:\n" + "\n".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 
-from .models import PatientEntry, Profile
+from .models import ArchivedPatientEntry, Board, PatientEntry, Profile, RequestProfile
 
 
 class PatientEntryAdmin(admin.TabularInline):
@@ -19,6 +19,26 @@ class UserAdmin(BaseUserAdmin):
     inlines = (ProfileInline,)
 
 
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = (
+        "created_at",
+        "method",
+        "path",
+        "status_code",
+        "total_ms",
+        "sql_count",
+        "sql_ms",
+        "template_ms",
+    )
+    readonly_fields = list_display + ("queries", "profile")
+
+    def has_add_permission(self, request):
+        return False
+
+
 admin.site.register(PatientEntry)
+admin.site.register(ArchivedPatientEntry)
+admin.site.register(Board)
+admin.site.register(RequestProfile, RequestProfileAdmin)
 admin.site.unregister(User)
 admin.site.register(User, UserAdmin)
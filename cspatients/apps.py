@@ -0,0 +1,23 @@
+from celery.signals import task_postrun, task_prerun
+from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+
+
+class CspatientsConfig(AppConfig):
+    name = "cspatients"
+
+    def ready(self):
+        from .connections import check_connections, count_connection
+        from .models import Baby, PatientEntry
+        from .signals import delete_board_row, save_board_row, touch_patient_entry
+
+        request_started.connect(check_connections)
+        task_prerun.connect(check_connections)
+        task_postrun.connect(check_connections)
+        connection_created.connect(count_connection)
+        post_save.connect(touch_patient_entry, sender=Baby)
+        post_delete.connect(touch_patient_entry, sender=Baby)
+        post_save.connect(save_board_row, sender=PatientEntry)
+        post_delete.connect(delete_board_row, sender=PatientEntry)
@@ -0,0 +1,45 @@
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from rest_framework import authentication, exceptions
+from rest_framework.authtoken.models import Token
+
+from .writequeue import DATABASE_UNAVAILABLE
+
+
+class DatabaseUnavailable(exceptions.APIException):
+    status_code = 503
+    default_detail = "The database is unavailable, try again later."
+    default_code = "database_unavailable"
+
+
+def get_token_cache_key(key):
+    return "auth-token-{}".format(hashlib.sha256(key.encode()).hexdigest())
+
+
+class TokenAuthentication(authentication.TokenAuthentication):
+    """
+    Token authentication that remembers the tokens it has checked in the cache,
+    so that writes can still be queued while the database is down. A token that
+    isn't in the cache then is rejected as unavailable, rather than failing with
+    a server error.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = get_token_cache_key(key)
+        try:
+            user, token = super().authenticate_credentials(key)
+        except exceptions.AuthenticationFailed:
+            cache.delete(cache_key)
+            raise
+        except DATABASE_UNAVAILABLE:
+            user_id = cache.get(cache_key)
+            if user_id is None:
+                raise DatabaseUnavailable()
+            user = User(id=user_id, is_active=True)
+            return user, Token(key=key, user=user)
+
+        cache.set(cache_key, user.pk, settings.TOKEN_CACHE_TIMEOUT)
+        return user, token
@@ -0,0 +1,112 @@
+"""
+PostgreSQL backend that shares a pool of connections between the threads of a
+process. Django still "closes" the connection at the end of each request, but
+the connection goes back into the pool instead of being disconnected.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.db.backends.postgresql import base
+from psycopg2 import pool
+
+from cspatients.metrics import db_connection_checks_failed, db_pool_checkout_duration
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class BoundedConnectionPool(pool.ThreadedConnectionPool):
+    """
+    A pool that waits up to `timeout` seconds for a connection to be returned
+    when all of them are in use, instead of raising PoolError straight away.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, *args, **kwargs):
+        super(BoundedConnectionPool, self).__init__(minconn, maxconn, *args, **kwargs)
+        self.timeout = timeout
+        self.available = threading.BoundedSemaphore(maxconn)
+
+    def getconn(self, key=None):
+        if not self.available.acquire(timeout=self.timeout):
+            raise base.Database.OperationalError(
+                f"no database connection became free within {self.timeout}s"
+            )
+        try:
+            return super(BoundedConnectionPool, self).getconn(key)
+        except Exception:
+            self.available.release()
+            raise
+
+    def putconn(self, conn, key=None, close=False):
+        try:
+            super(BoundedConnectionPool, self).putconn(conn, key, close)
+        finally:
+            self.available.release()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Connections are checked as they leave the pool, so check_connections
+    # doesn't need to check them again
+    checked_on_checkout = True
+
+    def get_pool(self):
+        with _pools_lock:
+            if self.alias not in _pools:
+                _pools[self.alias] = BoundedConnectionPool(
+                    self.settings_dict.get("POOL_MIN_SIZE", 1),
+                    self.settings_dict.get("POOL_MAX_SIZE", 20),
+                    self.settings_dict.get("POOL_TIMEOUT", 10),
+                    **self.get_connection_params(),
+                )
+            return _pools[self.alias]
+
+    def checkout(self):
+        """
+        Takes a connection out of the pool, replacing it if it has stopped
+        working while it was idle.
+        """
+        connection_pool = self.get_pool()
+        connection = connection_pool.getconn()
+        if not settings.DATABASE_HEALTH_CHECKS:
+            return connection
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+        except base.Database.Error:
+            db_connection_checks_failed.labels(self.alias).inc()
+            connection_pool.putconn(connection, close=True)
+            connection = connection_pool.getconn()
+        return connection
+
+    def get_new_connection(self, conn_params):
+        start = time.time()
+        connection = self.checkout()
+        db_pool_checkout_duration.labels(self.alias).observe(time.time() - start)
+
+        options = self.settings_dict["OPTIONS"]
+        try:
+            self.isolation_level = options["isolation_level"]
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+
+        with self.wrap_database_errors:
+            discard = bool(self.connection.closed)
+            if not discard:
+                try:
+                    # Never hand a connection with an open transaction back
+                    self.connection.rollback()
+                except base.Database.Error:
+                    discard = True
+            self.get_pool().putconn(self.connection, close=discard)
@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.db import connections
+
+from .metrics import db_connection_checks_failed, db_connections_opened
+
+
+def check_connections(**kwargs):
+    """
+    Closes database connections that have outlived CONN_MAX_AGE or have stopped
+    working, so that a persistent connection is never handed to a request or a
+    task after the database has gone away.
+    """
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+
+        check = settings.DATABASE_HEALTH_CHECKS and not getattr(
+            connection, "checked_on_checkout", False
+        )
+        if check and not connection.is_usable():
+            db_connection_checks_failed.labels(connection.alias).inc()
+            connection.close()
+            continue
+
+        connection.close_if_unusable_or_obsolete()
+
+
+def count_connection(sender, connection, **kwargs):
+    db_connections_opened.labels(connection.alias).inc()
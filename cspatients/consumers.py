@@ -1,11 +1,46 @@
+import json
+
 from asgiref.sync import async_to_sync
 from channels.generic.websocket import WebsocketConsumer
 
+from .db import use_replica
+from .metrics import board_websocket_connections
+from .util import dump_board_message, get_board_update, get_user_board
+
 
 class ViewConsumer(WebsocketConsumer):
     def connect(self):
-        async_to_sync(self.channel_layer.group_add)("view", self.channel_name)
+        # Each site's board clients are in their own group
+        self.board = get_user_board(self.scope.get("user"))
+        self.group_name = self.board.get_group_name()
+        async_to_sync(self.channel_layer.group_add)(self.group_name, self.channel_name)
+        # Counted before the client hears it is connected, so that a client
+        # can't disconnect before it has been counted
+        board_websocket_connections.labels(self.board.slug).inc()
+        self.counted = True
         self.accept()
 
+    def disconnect(self, code):
+        async_to_sync(self.channel_layer.group_discard)(
+            self.group_name, self.channel_name
+        )
+        if getattr(self, "counted", False):
+            board_websocket_connections.labels(self.board.slug).dec()
+
+    def receive(self, text_data=None, bytes_data=None):
+        """
+        A (re)connecting client sends the board version it last saw, and is
+        sent only what it needs to catch up.
+        """
+        try:
+            version = json.loads(text_data)["version"]
+        except (KeyError, TypeError, ValueError):
+            return
+
+        with use_replica():
+            update = get_board_update(version, self.board)
+        if update is not None:
+            self.send(text_data=dump_board_message(update))
+
     def view_update(self, event):
         self.send(text_data=event["content"])
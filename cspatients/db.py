@@ -0,0 +1,114 @@
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+
+_state = threading.local()
+
+# Set on browsers that have written, so that their reads go to the primary
+PRIMARY_COOKIE = "momkhulu_primary"
+
+
+@contextmanager
+def use_replica(enabled=True):
+    """
+    Sends the reads made inside the block to the read replica, if there is one.
+    Once something is written inside the block, the rest of the reads go to the
+    primary so that we always read our own writes.
+    """
+    previous = (getattr(_state, "use_replica", False), getattr(_state, "wrote", False))
+    _state.use_replica, _state.wrote = enabled, False
+    try:
+        yield
+    finally:
+        _state.use_replica, _state.wrote = previous
+
+
+class ReplicaRouter(object):
+    """
+    Routes reads to settings.REPLICA_DATABASE inside a `use_replica` block, and
+    everything else to the default database.
+    """
+
+    def db_for_read(self, model, **hints):
+        if (
+            settings.REPLICA_DATABASE
+            and getattr(_state, "use_replica", False)
+            and not getattr(_state, "wrote", False)
+        ):
+            return settings.REPLICA_DATABASE
+        return "default"
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == "default"
+
+
+def get_primary_key(request):
+    """
+    The cache key that marks an API client as having written, or None for
+    clients that don't send an Authorization header.
+    """
+    authorization = request.META.get("HTTP_AUTHORIZATION")
+    if authorization:
+        digest = hashlib.sha256(authorization.encode()).hexdigest()
+        return "replica-primary:{}".format(digest)
+    return None
+
+
+def wrote_recently(request):
+    """
+    Whether the client wrote in the last REPLICA_STICKY_SECONDS, in which case
+    the replica may not have its write yet.
+    """
+    key = get_primary_key(request)
+    if key is not None:
+        return bool(cache.get(key))
+    return PRIMARY_COOKIE in request.COOKIES
+
+
+def stick_to_primary(request, response):
+    key = get_primary_key(request)
+    if key is not None:
+        cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+    else:
+        response.set_cookie(
+            PRIMARY_COOKIE, "1", max_age=settings.REPLICA_STICKY_SECONDS, httponly=True
+        )
+
+
+class ReplicaMiddleware(object):
+    """
+    Uses the read replica for the views named in settings.REPLICA_READ_URL_NAMES.
+    A client that writes reads from the primary for the next
+    REPLICA_STICKY_SECONDS, remembered with a cookie for browsers and in the
+    cache for API clients, so that it always reads its own writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with use_replica(enabled=False):
+            response = self.get_response(request)
+            wrote = getattr(_state, "wrote", False)
+
+        if wrote and settings.REPLICA_DATABASE:
+            stick_to_primary(request, response)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            settings.REPLICA_DATABASE
+            and request.resolver_match.url_name in settings.REPLICA_READ_URL_NAMES
+            and not wrote_recently(request)
+        ):
+            _state.use_replica = True
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from cspatients import writequeue
+from cspatients.views import apply_queued_write
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays the queued RapidPro writes that failed when they were replayed, "
+        "once the cause of the failure has been fixed"
+    )
+
+    def handle(self, *args, **options):
+        moved = writequeue.requeue_failed()
+        writequeue.replay(apply_queued_write)
+        self.stdout.write(
+            "Replayed {} failed write(s), {} failed again, {} still queued".format(
+                moved, writequeue.get_failed_count(), writequeue.get_pending_count()
+            )
+        )
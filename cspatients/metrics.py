@@ -0,0 +1,78 @@
+from prometheus_client import Counter, Gauge, Histogram
+
+wa_group_queue_depth = Gauge(
+    "momkhulu_wa_group_message_queue_depth",
+    "Number of WhatsApp group messages waiting to be sent",
+)
+wa_group_throttled = Counter(
+    "momkhulu_wa_group_message_throttled_total",
+    "Number of times sending WhatsApp group messages was delayed by the rate limit",
+)
+wa_group_digest_size = Histogram(
+    "momkhulu_wa_group_message_digest_size",
+    "Number of messages combined into each WhatsApp group message sent",
+    buckets=(1, 2, 5, 10, 20, 50),
+)
+
+db_connections_opened = Counter(
+    "momkhulu_db_connections_opened_total",
+    "Number of database connections opened, or checked out of the pool",
+    ["alias"],
+)
+db_connection_checks_failed = Counter(
+    "momkhulu_db_connection_checks_failed_total",
+    "Number of reused database connections that were found to be broken",
+    ["alias"],
+)
+db_pool_checkout_duration = Histogram(
+    "momkhulu_db_pool_checkout_seconds",
+    "Time taken to check a working connection out of the connection pool",
+    ["alias"],
+)
+
+board_broadcast_size = Histogram(
+    "momkhulu_board_broadcast_bytes",
+    "Size of each board update sent to the board websocket group",
+    buckets=(1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000),
+)
+board_broadcast_render_duration = Histogram(
+    "momkhulu_board_broadcast_render_seconds",
+    "Time taken to build and serialise each board update sent to the board group",
+)
+board_broadcast_send_duration = Histogram(
+    "momkhulu_board_broadcast_send_seconds",
+    "Time taken to send each board update to the board websocket group",
+)
+board_rows = Gauge(
+    "momkhulu_board_rows",
+    "Number of rows on the board, as of its last board update",
+    ["board"],
+)
+board_websocket_connections = Gauge(
+    "momkhulu_board_websocket_connections",
+    "Number of board websocket clients connected to this process",
+    ["board"],
+)
+
+write_queue_pending = Gauge(
+    "momkhulu_write_queue_pending",
+    "Number of RapidPro writes on this node waiting to be saved to the database",
+)
+write_queue_failed = Gauge(
+    "momkhulu_write_queue_failed",
+    "Number of queued RapidPro writes on this node that failed when they were "
+    "replayed, and need replay_failed_writes",
+)
+
+rapidpro_results_duration = Histogram(
+    "momkhulu_rapidpro_results_seconds",
+    "Time taken to read the RapidPro flow results of each request",
+    ["endpoint"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
+rapidpro_serialise_duration = Histogram(
+    "momkhulu_rapidpro_serialise_seconds",
+    "Time taken to serialise the patient entries returned to RapidPro",
+    ["endpoint"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+)
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.2 on 2019-07-22 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0025_patiententry_starvation_hours")]
+
+    operations = [
+        migrations.CreateModel(
+            name="GroupMessage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("body", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("sent_at", models.DateTimeField(null=True)),
+            ],
+        )
+    ]
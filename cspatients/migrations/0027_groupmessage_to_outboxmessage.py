@@ -0,0 +1,58 @@
+# Generated by Django 2.2.2 on 2019-07-24 11:02
+
+import json
+
+from django.db import migrations, models
+
+
+def wrap_group_message_bodies(apps, schema_editor):
+    OutboxMessage = apps.get_model("cspatients", "OutboxMessage")
+    for message in OutboxMessage.objects.all():
+        message.payload = json.dumps({"body": message.payload})
+        message.save(update_fields=["payload"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0026_groupmessage")]
+
+    operations = [
+        migrations.RenameModel(old_name="GroupMessage", new_name="OutboxMessage"),
+        migrations.RenameField(
+            model_name="outboxmessage", old_name="body", new_name="payload"
+        ),
+        migrations.RenameField(
+            model_name="outboxmessage", old_name="sent_at", new_name="dispatched_at"
+        ),
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="message_type",
+            field=models.CharField(
+                choices=[
+                    ("wa_group", "WhatsApp group message"),
+                    ("rapidpro_event", "RapidPro event"),
+                ],
+                default="wa_group",
+                max_length=30,
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="idempotency_key",
+            field=models.CharField(max_length=255, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="attempts",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="outboxmessage",
+            index=models.Index(
+                fields=["message_type", "dispatched_at"],
+                name="cspatients_outbox_pending_idx",
+            ),
+        ),
+        migrations.RunPython(wrap_group_message_bodies, migrations.RunPython.noop),
+    ]
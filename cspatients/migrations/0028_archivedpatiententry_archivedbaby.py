@@ -0,0 +1,76 @@
+# Generated by Django 2.2.2 on 2019-07-29 13:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0027_groupmessage_to_outboxmessage")]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedPatientEntry",
+            fields=[
+                ("surname", models.CharField(max_length=255)),
+                ("age", models.IntegerField(null=True)),
+                ("operation", models.CharField(default="CS", max_length=255)),
+                ("parity", models.IntegerField(null=True)),
+                ("gravidity", models.IntegerField(null=True)),
+                ("comorbid", models.CharField(max_length=255, null=True)),
+                ("indication", models.CharField(max_length=255, null=True)),
+                (
+                    "decision_time",
+                    models.DateTimeField(default=django.utils.timezone.now),
+                ),
+                ("completion_time", models.DateTimeField(null=True)),
+                (
+                    "urgency",
+                    models.IntegerField(
+                        choices=[
+                            (5, "Elective"),
+                            (4, "Cold"),
+                            (3, "Warm"),
+                            (2, "Hot"),
+                            (1, "Immediate"),
+                        ],
+                        default=4,
+                    ),
+                ),
+                ("location", models.CharField(max_length=255, null=True)),
+                ("outstanding_data", models.CharField(max_length=255, null=True)),
+                ("clinician", models.CharField(max_length=255, null=True)),
+                ("foetus", models.IntegerField(null=True)),
+                ("operation_cancelled", models.BooleanField(default=False)),
+                ("anesthetic_time", models.DateTimeField(null=True)),
+                ("starvation_hours", models.IntegerField(null=True)),
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("created_at", models.DateTimeField()),
+                ("updated_at", models.DateTimeField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+            ],
+            options={"abstract": False},
+        ),
+        migrations.CreateModel(
+            name="ArchivedBaby",
+            fields=[
+                ("baby_number", models.IntegerField()),
+                ("delivery_time", models.DateTimeField()),
+                ("apgar_1", models.IntegerField(null=True)),
+                ("apgar_5", models.IntegerField(null=True)),
+                ("baby_weight_grams", models.IntegerField(null=True)),
+                ("nicu", models.BooleanField(null=True)),
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                (
+                    "patiententry",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="entry_babies",
+                        to="cspatients.ArchivedPatientEntry",
+                    ),
+                ),
+            ],
+            options={"unique_together": {("patiententry", "baby_number")}},
+        ),
+    ]
@@ -0,0 +1,16 @@
+# Generated by Django 2.2.2 on 2019-08-01 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0028_archivedpatiententry_archivedbaby")]
+
+    operations = [
+        migrations.AlterField(
+            model_name="patiententry",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        )
+    ]
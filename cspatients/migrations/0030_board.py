@@ -0,0 +1,52 @@
+# Generated by Django 2.2.2 on 2019-08-02 09:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_default_board(apps, schema_editor):
+    Board = apps.get_model("cspatients", "Board")
+    Board.objects.get_or_create(
+        slug=settings.DEFAULT_BOARD, defaults={"name": "Mowbray Maternity Hospital"}
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0029_patiententry_updated_at_index")]
+
+    operations = [
+        migrations.CreateModel(
+            name="Board",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("slug", models.SlugField(unique=True)),
+                ("name", models.CharField(max_length=255)),
+                (
+                    "rollover_hour",
+                    models.IntegerField(
+                        default=7,
+                        help_text="Hour of the day, in local time, completed entries leave",
+                    ),
+                ),
+                ("visible_from", models.DateTimeField(editable=False, null=True)),
+            ],
+        ),
+        migrations.RunPython(create_default_board, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="patiententry",
+            index=models.Index(
+                condition=models.Q(operation_cancelled=False),
+                fields=["completion_time"],
+                name="cspatients_board_window_idx",
+            ),
+        ),
+    ]
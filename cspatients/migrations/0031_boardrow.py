@@ -0,0 +1,65 @@
+# Generated by Django 2.2.2 on 2019-08-05 10:02
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import Q
+from django.utils import timezone
+
+
+def create_board_rows(apps, schema_editor):
+    PatientEntry = apps.get_model("cspatients", "PatientEntry")
+    BoardRow = apps.get_model("cspatients", "BoardRow")
+
+    # Rows completed before the last rollover are removed by the
+    # update_board_rollovers task
+    entries = PatientEntry.objects.filter(operation_cancelled=False).filter(
+        Q(completion_time__isnull=True)
+        | Q(completion_time__gte=timezone.now() - timedelta(days=1))
+    )
+    BoardRow.objects.bulk_create(
+        BoardRow(
+            id=entry.id,
+            surname=entry.surname,
+            operation=entry.operation,
+            location=entry.location,
+            indication=entry.indication,
+            decision_time=entry.decision_time,
+            clinician=entry.clinician,
+            urgency=entry.urgency,
+            completion_time=entry.completion_time,
+            updated_at=entry.updated_at,
+            sort_key="{:d}{:d}{:%Y%m%d%H%M%S%f}".format(
+                entry.completion_time is not None,
+                entry.urgency,
+                entry.decision_time.astimezone(timezone.utc),
+            ),
+        )
+        for entry in entries
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0030_board")]
+
+    operations = [
+        migrations.CreateModel(
+            name="BoardRow",
+            fields=[
+                ("id", models.IntegerField(primary_key=True, serialize=False)),
+                ("surname", models.CharField(max_length=255)),
+                ("operation", models.CharField(max_length=255)),
+                ("location", models.CharField(max_length=255, null=True)),
+                ("indication", models.CharField(max_length=255, null=True)),
+                ("decision_time", models.DateTimeField()),
+                ("clinician", models.CharField(max_length=255, null=True)),
+                ("urgency", models.IntegerField()),
+                ("completion_time", models.DateTimeField(null=True)),
+                ("updated_at", models.DateTimeField()),
+                ("sort_key", models.CharField(db_index=True, max_length=30)),
+            ],
+            options={"ordering": ["sort_key"]},
+        ),
+        migrations.RunPython(create_board_rows, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,128 @@
+# Generated by Django 2.2.2 on 2019-08-06 11:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+import cspatients.models
+
+
+def set_default_board(apps, schema_editor):
+    Board = apps.get_model("cspatients", "Board")
+    board, _ = Board.objects.get_or_create(
+        slug=settings.DEFAULT_BOARD, defaults={"name": settings.DEFAULT_BOARD}
+    )
+    for model in ("PatientEntry", "ArchivedPatientEntry", "BoardRow"):
+        apps.get_model("cspatients", model).objects.update(board=board)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0031_boardrow")]
+
+    operations = [
+        migrations.AddField(
+            model_name="board",
+            name="wa_group_id",
+            field=models.CharField(
+                blank=True,
+                help_text="WhatsApp group for new patients, if not the default group",
+                max_length=255,
+            ),
+        ),
+        migrations.AddField(
+            model_name="profile",
+            name="board",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="The board the user works on, if not the default board",
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                to="cspatients.Board",
+            ),
+        ),
+        migrations.AddField(
+            model_name="patiententry",
+            name="board",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="patient_entries",
+                to="cspatients.Board",
+            ),
+        ),
+        migrations.AddField(
+            model_name="archivedpatiententry",
+            name="board",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="archived_patient_entries",
+                to="cspatients.Board",
+            ),
+        ),
+        migrations.AddField(
+            model_name="boardrow",
+            name="board",
+            field=models.ForeignKey(
+                db_index=False,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="rows",
+                to="cspatients.Board",
+            ),
+        ),
+        migrations.RunPython(set_default_board, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="patiententry",
+            name="board",
+            field=models.ForeignKey(
+                default=cspatients.models.get_default_board_id,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="patient_entries",
+                to="cspatients.Board",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="archivedpatiententry",
+            name="board",
+            field=models.ForeignKey(
+                default=cspatients.models.get_default_board_id,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="archived_patient_entries",
+                to="cspatients.Board",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="boardrow",
+            name="board",
+            field=models.ForeignKey(
+                db_index=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="rows",
+                to="cspatients.Board",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="boardrow",
+            name="sort_key",
+            field=models.CharField(max_length=30),
+        ),
+        migrations.AddIndex(
+            model_name="boardrow",
+            index=models.Index(
+                fields=["board", "sort_key"], name="cspatients_boardrow_order_idx"
+            ),
+        ),
+        migrations.RemoveIndex(
+            model_name="patiententry", name="cspatients_board_window_idx"
+        ),
+        migrations.AddIndex(
+            model_name="patiententry",
+            index=models.Index(
+                condition=models.Q(operation_cancelled=False),
+                fields=["board", "completion_time"],
+                name="cspatients_board_window_idx",
+            ),
+        ),
+    ]
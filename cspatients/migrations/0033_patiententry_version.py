@@ -0,0 +1,21 @@
+# Generated by Django 2.2.2 on 2019-08-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0032_board_sites")]
+
+    operations = [
+        migrations.AddField(
+            model_name="patiententry",
+            name="version",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="archivedpatiententry",
+            name="version",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.2 on 2019-08-26 10:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0033_patiententry_version")]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReplayedWrite",
+            fields=[
+                (
+                    "id",
+                    models.CharField(max_length=32, primary_key=True, serialize=False),
+                ),
+                ("replayed_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        )
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.2 on 2019-08-28 14:05
+
+from django.db import migrations, models
+
+URGENCY_COLORS = {1: "Red", 2: "Orange", 3: "Yellow", 4: "Green", 5: "Blue"}
+
+
+def set_rp_list_lines(apps, schema_editor):
+    BoardRow = apps.get_model("cspatients", "BoardRow")
+
+    for row in BoardRow.objects.all():
+        row.rp_list_line = "{} {} {} {}".format(
+            row.surname, row.operation, row.indication, URGENCY_COLORS[row.urgency]
+        )
+        row.save(update_fields=["rp_list_line"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0034_replayedwrite")]
+
+    operations = [
+        migrations.AddField(
+            model_name="boardrow",
+            name="rp_list_line",
+            field=models.CharField(default="", max_length=1024),
+        ),
+        migrations.RunPython(set_rp_list_lines, migrations.RunPython.noop),
+    ]
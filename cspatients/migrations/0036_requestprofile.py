@@ -0,0 +1,35 @@
+# Generated by Django 2.2.2 on 2019-08-29 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0035_boardrow_rp_list_line")]
+
+    operations = [
+        migrations.CreateModel(
+            name="RequestProfile",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("method", models.CharField(max_length=10)),
+                ("path", models.CharField(max_length=1024)),
+                ("status_code", models.IntegerField()),
+                ("total_ms", models.FloatField()),
+                ("sql_count", models.IntegerField()),
+                ("sql_ms", models.FloatField()),
+                ("template_ms", models.FloatField()),
+                ("queries", models.TextField()),
+                ("profile", models.TextField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        )
+    ]
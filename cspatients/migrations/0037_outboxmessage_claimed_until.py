@@ -0,0 +1,16 @@
+# Generated by Django 2.2.2 on 2019-08-30 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0036_requestprofile")]
+
+    operations = [
+        migrations.AddField(
+            model_name="outboxmessage",
+            name="claimed_until",
+            field=models.DateTimeField(null=True),
+        )
+    ]
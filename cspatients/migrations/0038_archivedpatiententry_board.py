@@ -0,0 +1,21 @@
+# Generated by Django 2.2.2 on 2019-08-30 10:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0037_outboxmessage_claimed_until")]
+
+    operations = [
+        migrations.AlterField(
+            model_name="archivedpatiententry",
+            name="board",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="archived_patient_entries",
+                to="cspatients.Board",
+            ),
+        )
+    ]
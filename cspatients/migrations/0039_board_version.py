@@ -0,0 +1,21 @@
+# Generated by Django 2.2.2 on 2019-08-30 11:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("cspatients", "0038_archivedpatiententry_board")]
+
+    operations = [
+        migrations.AddField(
+            model_name="board",
+            name="version",
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="boardrow",
+            name="version",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -1,9 +1,13 @@
+import json
+
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
 
-class PatientEntry(models.Model):
+class AbstractPatientEntry(models.Model):
     ELECTIVE = 5
     COLD = 4
     WARM_YELLOW = 3
@@ -35,11 +39,12 @@ class PatientEntry(models.Model):
     clinician = models.CharField(max_length=255, null=True)
     foetus = models.IntegerField(null=True)
     operation_cancelled = models.BooleanField(default=False)
-    created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
     anesthetic_time = models.DateTimeField(null=True)
     starvation_hours = models.IntegerField(null=True)
 
+    class Meta:
+        abstract = True
+
     @property
     def gravpar(self):
         gravidity = "-"
@@ -57,10 +62,155 @@ class PatientEntry(models.Model):
         return "{} having {}".format(self.surname, self.operation)
 
 
-class Baby(models.Model):
-    patiententry = models.ForeignKey(
-        PatientEntry, related_name="entry_babies", on_delete=models.CASCADE
+class Board(models.Model):
+    """
+    A triage board, one for each site. Completed entries stay on the board
+    until the next rollover, at rollover_hour local time each day.
+    """
+
+    slug = models.SlugField(unique=True)
+    name = models.CharField(max_length=255)
+    rollover_hour = models.IntegerField(
+        default=7, help_text="Hour of the day, in local time, completed entries leave"
+    )
+    wa_group_id = models.CharField(
+        max_length=255,
+        blank=True,
+        help_text="WhatsApp group for new patients, if not the default group",
+    )
+    # Kept up to date by the update_board_windows task
+    visible_from = models.DateTimeField(null=True, editable=False)
+    # Incremented in the transaction of every change to the board's rows, so
+    # that versions are in commit order
+    version = models.BigIntegerField(default=0, editable=False)
+
+    @classmethod
+    def get_default(cls):
+        # Looked up first, as get_or_create always reads from the primary, which
+        # would stop the rest of the request reading from the replica
+        board = cls.objects.filter(slug=settings.DEFAULT_BOARD).first()
+        if board is None:
+            board, _ = cls.objects.get_or_create(
+                slug=settings.DEFAULT_BOARD, defaults={"name": settings.DEFAULT_BOARD}
+            )
+        return board
+
+    def get_group_name(self):
+        """
+        The channel group of the board's websocket clients.
+        """
+        return "board-{}".format(self.slug)
+
+    def get_wa_group_id(self):
+        return self.wa_group_id or settings.MOMKHULU_WA_GROUP_ID
+
+    def get_last_rollover(self):
+        now = timezone.localtime()
+        rollover = now.replace(
+            hour=self.rollover_hour, minute=0, second=0, microsecond=0
+        )
+        if now < rollover:
+            rollover -= timezone.timedelta(days=1)
+        return rollover
+
+    def __str__(self):
+        return self.name
+
+
+def get_default_board_id():
+    # Only the id is read if the board exists, as migrations also call this,
+    # before the columns added to Board since exist
+    board_id = (
+        Board.objects.filter(slug=settings.DEFAULT_BOARD)
+        .values_list("id", flat=True)
+        .first()
+    )
+    return board_id or Board.get_default().id
+
+
+class PatientEntry(AbstractPatientEntry):
+    board = models.ForeignKey(
+        Board,
+        related_name="patient_entries",
+        on_delete=models.PROTECT,
+        default=get_default_board_id,
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Incremented on every change, so that a client can tell if the entry has
+    # changed since it last saw it
+    version = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # For the entries on a board, the ones not completed and the ones
+            # completed since the last rollover
+            models.Index(
+                fields=["board", "completion_time"],
+                name="cspatients_board_window_idx",
+                condition=Q(operation_cancelled=False),
+            )
+        ]
+
+
+class BoardRow(models.Model):
+    """
+    The columns the board shows for each patient entry on it, kept up to date
+    from PatientEntry, with the id of its patient entry.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    board = models.ForeignKey(
+        Board, related_name="rows", on_delete=models.CASCADE, db_index=False
+    )
+    surname = models.CharField(max_length=255)
+    operation = models.CharField(max_length=255)
+    location = models.CharField(max_length=255, null=True)
+    indication = models.CharField(max_length=255, null=True)
+    decision_time = models.DateTimeField()
+    clinician = models.CharField(max_length=255, null=True)
+    urgency = models.IntegerField()
+    completion_time = models.DateTimeField(null=True)
+    updated_at = models.DateTimeField()
+    # Oldest most urgent first, completed last
+    sort_key = models.CharField(max_length=30)
+    # The entry as listed in RapidPro flows, without its number
+    rp_list_line = models.CharField(max_length=1024, default="")
+    # The version of the board the row was last changed in
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        ordering = ["sort_key"]
+        indexes = [
+            models.Index(
+                fields=["board", "sort_key"], name="cspatients_boardrow_order_idx"
+            )
+        ]
+
+    def get_urgency_color(self):
+        return PatientEntry.URGENCY_COLORS[self.urgency]
+
+    def __str__(self):
+        return "{} having {}".format(self.surname, self.operation)
+
+
+class ArchivedPatientEntry(AbstractPatientEntry):
+    """
+    A completed or cancelled patient entry that has been moved out of
+    PatientEntry by the archive_patient_entries task, keeping its id.
+    """
+
+    id = models.IntegerField(primary_key=True)
+    board = models.ForeignKey(
+        Board, related_name="archived_patient_entries", on_delete=models.PROTECT
     )
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    version = models.IntegerField(default=0)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+class AbstractBaby(models.Model):
     baby_number = models.IntegerField()
     delivery_time = models.DateTimeField()
     apgar_1 = models.IntegerField(null=True)
@@ -68,6 +218,25 @@ class Baby(models.Model):
     baby_weight_grams = models.IntegerField(null=True)
     nicu = models.BooleanField(null=True)
 
+    class Meta:
+        abstract = True
+
+
+class Baby(AbstractBaby):
+    patiententry = models.ForeignKey(
+        PatientEntry, related_name="entry_babies", on_delete=models.CASCADE
+    )
+
+    class Meta:
+        unique_together = ("patiententry", "baby_number")
+
+
+class ArchivedBaby(AbstractBaby):
+    id = models.IntegerField(primary_key=True)
+    patiententry = models.ForeignKey(
+        ArchivedPatientEntry, related_name="entry_babies", on_delete=models.CASCADE
+    )
+
     class Meta:
         unique_together = ("patiententry", "baby_number")
 
@@ -75,6 +244,90 @@ class Baby(models.Model):
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     msisdn = models.CharField("MSISDN(+country code)", max_length=30, blank=True)
+    board = models.ForeignKey(
+        Board,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        help_text="The board the user works on, if not the default board",
+    )
 
     def __str__(self):
         return "{}: {}".format(self.user.username, self.msisdn)
+
+
+class OutboxMessage(models.Model):
+    """
+    An outbound message, written in the same transaction as the change that
+    caused it and sent afterwards by the outbox dispatcher tasks.
+    """
+
+    WA_GROUP = "wa_group"
+    RAPIDPRO_EVENT = "rapidpro_event"
+
+    MESSAGE_TYPE_CHOICES = (
+        (WA_GROUP, "WhatsApp group message"),
+        (RAPIDPRO_EVENT, "RapidPro event"),
+    )
+
+    message_type = models.CharField(max_length=30, choices=MESSAGE_TYPE_CHOICES)
+    idempotency_key = models.CharField(max_length=255, unique=True, null=True)
+    payload = models.TextField()
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True)
+    # Set while a dispatcher is sending the message, so that no other
+    # dispatcher sends it. Expires in case the dispatcher dies.
+    claimed_until = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["message_type", "dispatched_at"],
+                name="cspatients_outbox_pending_idx",
+            )
+        ]
+
+    def get_payload(self):
+        return json.loads(self.payload)
+
+    def __str__(self):
+        return "{} created at {}".format(
+            self.get_message_type_display(), self.created_at
+        )
+
+
+class ReplayedWrite(models.Model):
+    """
+    A write from the local write queue that has been applied, so that it is
+    never applied twice.
+    """
+
+    id = models.CharField(max_length=32, primary_key=True)
+    replayed_at = models.DateTimeField(auto_now_add=True)
+
+
+class RequestProfile(models.Model):
+    """
+    The profile of a request, recorded on demand by ProfilingMiddleware. Only
+    the newest PROFILING_KEEP are kept.
+    """
+
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=1024)
+    status_code = models.IntegerField()
+    total_ms = models.FloatField()
+    sql_count = models.IntegerField()
+    sql_ms = models.FloatField()
+    template_ms = models.FloatField()
+    # JSON list of the queries, with their database and duration
+    queries = models.TextField()
+    # The functions with the most cumulative time, as printed by pstats
+    profile = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def get_queries(self):
+        return json.loads(self.queries)
+
+    def __str__(self):
+        return "{} {} at {}".format(self.method, self.path, self.created_at)
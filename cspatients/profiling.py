@@ -0,0 +1,148 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+from django.template.base import Template
+
+from .models import RequestProfile
+
+PROFILE_HEADER = "HTTP_X_MOMKHULU_PROFILE"
+PROFILE_SALT = "cspatients.profiling"
+
+
+def get_profile_header():
+    """
+    A value for the X-Momkhulu-Profile header that lets anyone holding it
+    profile requests, until it expires after PROFILING_SIGNATURE_MAX_AGE.
+    """
+    return signing.TimestampSigner(salt=PROFILE_SALT).sign("profile")
+
+
+def should_profile(request):
+    """
+    Only requests with the header are profiled, and only if it is signed or
+    the user is staff.
+    """
+    value = request.META.get(PROFILE_HEADER)
+    if not settings.REQUEST_PROFILING or not value:
+        return False
+
+    try:
+        signing.TimestampSigner(salt=PROFILE_SALT).unsign(
+            value, max_age=settings.PROFILING_SIGNATURE_MAX_AGE
+        )
+        return True
+    except signing.BadSignature:
+        user = getattr(request, "user", None)
+        return bool(user and user.is_staff)
+
+
+class QueryRecorder(object):
+    """
+    A database execute wrapper that records each query and how long it took.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {
+                    "alias": context["connection"].alias,
+                    "sql": sql,
+                    "ms": (time.perf_counter() - start) * 1000,
+                }
+            )
+
+
+def get_template_time(stats):
+    """
+    The time spent rendering templates, from the cumulative time of
+    Template.render, which only counts the outermost of nested renders.
+    """
+    code = Template.render.__code__
+    for (filename, lineno, name), stat in stats.stats.items():
+        if (filename, lineno, name) == (
+            code.co_filename,
+            code.co_firstlineno,
+            code.co_name,
+        ):
+            return stat[3] * 1000
+    return 0.0
+
+
+def get_top_functions(stats):
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats("cumulative").print_stats(settings.PROFILING_TOP_N)
+    return output.getvalue()
+
+
+def save_profile(request, response, total, queries, stats):
+    profile = RequestProfile.objects.create(
+        method=request.method,
+        path=request.get_full_path()[:1024],
+        status_code=response.status_code,
+        total_ms=total,
+        sql_count=len(queries),
+        sql_ms=sum(query["ms"] for query in queries),
+        template_ms=get_template_time(stats),
+        queries=json.dumps(queries),
+        profile=get_top_functions(stats),
+    )
+    keep = settings.PROFILING_KEEP
+    newest = RequestProfile.objects.order_by("-id").values_list("id", flat=True)
+    stale = list(newest[keep:])
+    RequestProfile.objects.filter(id__in=stale).delete()
+    return profile
+
+
+class ProfilingMiddleware(object):
+    """
+    Profiles one request on demand, recording its SQL timings, template render
+    time and the functions it spent the most time in. The summary is returned
+    in the Server-Timing header, and the full profile is kept for the admin.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            total = (time.perf_counter() - start) * 1000
+
+        profile = save_profile(
+            request, response, total, recorder.queries, pstats.Stats(profiler)
+        )
+        response["Server-Timing"] = ", ".join(
+            [
+                f"total;dur={profile.total_ms:.1f}",
+                f'sql;dur={profile.sql_ms:.1f};desc="{profile.sql_count} queries"',
+                f"templates;dur={profile.template_ms:.1f}",
+            ]
+        )
+        response["X-Momkhulu-Profile-Id"] = str(profile.id)
+        return response
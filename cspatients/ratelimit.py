@@ -0,0 +1,63 @@
+import time
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+# How long a process may hold a bucket's lock, in case it dies holding it
+LOCK_TIMEOUT = 5
+
+
+class TokenBucket(object):
+    """
+    A token bucket rate limiter. The state is kept in the Django cache, so that
+    all the processes sharing a cache also share the limit. Updates to the
+    state are serialised by a lock taken with the cache's atomic add.
+    """
+
+    def __init__(self, key, rate, capacity):
+        self.key = "ratelimit:{}".format(key)
+        self.lock_key = "{}:lock".format(self.key)
+        self.rate = rate
+        self.capacity = capacity
+
+    @contextmanager
+    def locked(self):
+        """
+        Yields whether the lock was taken, waiting up to LOCK_TIMEOUT for it.
+        """
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        acquired = cache.add(self.lock_key, 1, LOCK_TIMEOUT)
+        while not acquired and time.monotonic() < deadline:
+            time.sleep(0.01)
+            acquired = cache.add(self.lock_key, 1, LOCK_TIMEOUT)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                cache.delete(self.lock_key)
+
+    def consume(self, tokens=1):
+        """
+        Takes tokens out of the bucket. Returns 0 if there were enough tokens,
+        otherwise the number of seconds until there will be.
+        """
+        with self.locked() as acquired:
+            if not acquired:
+                # Too busy to tell, so try again once a token has been added
+                return 1 / self.rate
+
+            now = time.time()
+            state = cache.get(self.key) or {"tokens": self.capacity, "timestamp": now}
+
+            available = min(
+                self.capacity, state["tokens"] + (now - state["timestamp"]) * self.rate
+            )
+
+            wait = 0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait = (tokens - available) / self.rate
+
+            cache.set(self.key, {"tokens": available, "timestamp": now}, None)
+            return wait
@@ -10,7 +10,8 @@ class PatientEntrySerializer(serializers.ModelSerializer):
 
     class Meta:
         model = PatientEntry
-        exclude = ("created_at", "updated_at", "id")
+        exclude = ("board", "created_at", "updated_at", "id")
+        read_only_fields = ("version",)
 
     def __init__(self, *args, **kwargs):
         super(PatientEntrySerializer, self).__init__(*args, **kwargs)
@@ -0,0 +1,22 @@
+from django.utils import timezone
+
+from .models import BoardRow, PatientEntry
+from .util import delete_board_rows, update_board_row
+
+
+def touch_patient_entry(sender, instance, **kwargs):
+    """
+    Babies are shown as part of their patient entry, so a change to a baby
+    counts as a change to the entry.
+    """
+    PatientEntry.objects.filter(id=instance.patiententry_id).update(
+        updated_at=timezone.now()
+    )
+
+
+def save_board_row(sender, instance, **kwargs):
+    update_board_row(instance.id)
+
+
+def delete_board_row(sender, instance, **kwargs):
+    delete_board_rows(BoardRow.objects.filter(id=instance.id))
@@ -1,4 +1,9 @@
 import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from urllib.parse import urljoin
 
 import requests
@@ -6,11 +11,34 @@ from celery.exceptions import SoftTimeLimitExceeded
 from celery.task import Task
 from celery.utils.log import get_task_logger
 from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
 from requests import RequestException
 
 from momkhulu.celery import app
 
-from .util import send_consumers_table
+from . import writequeue
+from .metrics import wa_group_digest_size, wa_group_queue_depth, wa_group_throttled
+from .models import Board, OutboxMessage
+from .ratelimit import TokenBucket
+from .util import (
+    archive_patient_entries,
+    build_digest_message,
+    claim_outbox_messages,
+    get_board_rollover,
+    release_outbox_messages,
+    renew_outbox_claim,
+    send_consumers_table,
+    sent_board_versions,
+    serialise_board_version,
+    update_board_windows,
+)
+
+logger = logging.getLogger(__name__)
+
+# Shared so that outbound requests reuse pooled keep-alive connections
+session = requests.Session()
 
 
 class PostPatientUpdate(Task):
@@ -21,13 +49,93 @@ class PostPatientUpdate(Task):
     name = "cspatients.tasks.post_patient_update"
     log = get_task_logger(__name__)
 
-    def run(self, **kwargs):
-        send_consumers_table()
+    def run(self, board_id=None, **kwargs):
+        send_consumers_table(board_id)
 
 
 post_patient_update = PostPatientUpdate()
 
 
+# Runs direct board broadcasts off the request thread
+broadcast_executor = ThreadPoolExecutor(
+    max_workers=settings.BOARD_BROADCAST_THREADS, thread_name_prefix="broadcast"
+)
+
+
+def send_board_update(board_id=None):
+    """
+    Sends the board to its websocket clients, falling back to the Celery task
+    if it can't be sent from here and the channel layer isn't in memory.
+    """
+    try:
+        send_consumers_table(board_id)
+    except Exception:
+        if settings.CHANNEL_LAYER_BACKEND == "memory":
+            # No worker can reach this process's channel layer, the board
+            # watcher tries again
+            logger.exception("Direct board broadcast failed")
+        else:
+            logger.exception("Direct board broadcast failed, queueing it instead")
+            post_patient_update.delay(board_id=board_id)
+    finally:
+        # The executor's threads aren't covered by the request cycle cleanup
+        close_old_connections()
+
+
+def schedule_board_update(board_id=None):
+    if settings.BOARD_BROADCAST == "direct":
+        try:
+            return broadcast_executor.submit(send_board_update, board_id)
+        except RuntimeError:
+            # The executor has been shut down
+            pass
+    post_patient_update.delay(board_id=board_id)
+
+
+def send_changed_boards():
+    """
+    Sends the boards that changed since this process last sent them, for
+    example in a worker or at a rollover.
+    """
+    for board in Board.objects.all():
+        version = serialise_board_version(
+            {"version": board.version, "rollover": get_board_rollover(board)}
+        )
+        if sent_board_versions.get(board.id) != version:
+            send_consumers_table(board.id)
+
+
+def watch_boards():
+    while True:
+        time.sleep(settings.BOARD_WATCH_SECONDS)
+        try:
+            send_changed_boards()
+        except Exception:
+            logger.exception("Sending the changed boards failed")
+        finally:
+            close_old_connections()
+
+
+def start_board_watcher():
+    """
+    Sends board changes that workers make from the web process, every
+    BOARD_WATCH_SECONDS, for the in-memory channel layer that only the web
+    process can reach.
+    """
+    watcher = threading.Thread(target=watch_boards, name="board-watcher", daemon=True)
+    watcher.start()
+    return watcher
+
+
+def broadcast_board_update(board_id=None):
+    """
+    Sends the board to its websocket clients once the current transaction
+    commits, either from a thread pool in this process or from a worker,
+    depending on BOARD_BROADCAST.
+    """
+    transaction.on_commit(lambda: schedule_board_update(board_id))
+
+
 @app.task(
     autoretry_for=(RequestException, SoftTimeLimitExceeded),
     retry_backoff=True,
@@ -37,19 +145,20 @@ post_patient_update = PostPatientUpdate()
     time_limit=15,
     ignore_result=True,
 )
-def send_wa_group_message(message):
+def send_wa_group_message(message, group_id=None):
     headers = {
         "Authorization": "Bearer {}".format(settings.TURN_TOKEN),
         "Content-Type": "application/json",
     }
 
-    response = requests.post(
+    response = session.post(
         urljoin(settings.TURN_URL, "v1/messages"),
         headers=headers,
+        timeout=settings.OUTBOUND_REQUEST_TIMEOUT,
         data=json.dumps(
             {
                 "recipient_type": "group",
-                "to": settings.MOMKHULU_WA_GROUP_ID,
+                "to": group_id or settings.MOMKHULU_WA_GROUP_ID,
                 "render_mentions": False,
                 "type": "text",
                 "text": {"body": message},
@@ -60,6 +169,73 @@ def send_wa_group_message(message):
     return response
 
 
+def get_turn_rate_limiter():
+    return TokenBucket(
+        "turn-group-messages",
+        settings.TURN_GROUP_MESSAGES_PER_MINUTE / 60.0,
+        settings.TURN_GROUP_MESSAGE_BURST,
+    )
+
+
+def get_message_group_id(message):
+    return message.get_payload().get("group_id") or settings.MOMKHULU_WA_GROUP_ID
+
+
+@app.task(
+    bind=True,
+    autoretry_for=(RequestException, SoftTimeLimitExceeded),
+    retry_backoff=True,
+    max_retries=15,
+    acks_late=True,
+    soft_time_limit=10,
+    time_limit=15,
+    ignore_result=True,
+)
+def send_wa_group_digest(self):
+    """
+    Sends all the group messages in the outbox to their WhatsApp groups, as soon
+    as the rate limit allows. If more than one message has queued up for a
+    group, for example while sending was throttled, they are combined into a
+    single digest message.
+    """
+    pending = OutboxMessage.objects.filter(
+        message_type=OutboxMessage.WA_GROUP, dispatched_at__isnull=True
+    ).order_by("id")
+
+    while True:
+        depth = pending.count()
+        wa_group_queue_depth.set(depth)
+        if depth == 0:
+            return
+
+        wait = get_turn_rate_limiter().consume()
+        if wait:
+            wa_group_throttled.inc()
+            raise self.retry(countdown=wait)
+
+        messages = claim_outbox_messages(pending)
+        if not messages:
+            return
+
+        # One group at a time, starting with the oldest message
+        group_id = get_message_group_id(messages[0])
+        others = [m for m in messages if get_message_group_id(m) != group_id]
+        messages = [m for m in messages if get_message_group_id(m) == group_id]
+        release_outbox_messages(others)
+
+        try:
+            send_wa_group_message(
+                build_digest_message([m.get_payload()["body"] for m in messages]),
+                group_id,
+            )
+        except RequestException:
+            release_outbox_messages(messages, attempts=F("attempts") + 1)
+            raise
+        release_outbox_messages(messages, dispatched_at=timezone.now())
+
+        wa_group_digest_size.observe(len(messages))
+
+
 @app.task(
     autoretry_for=(RequestException, SoftTimeLimitExceeded),
     retry_backoff=True,
@@ -72,8 +248,101 @@ def send_wa_group_message(message):
 def send_rapidpro_event(payload):
     headers = {"Content-Type": "application/json"}
 
-    response = requests.post(
-        settings.RAPIDPRO_CHANNEL_URL, json=payload, headers=headers
+    response = session.post(
+        settings.RAPIDPRO_CHANNEL_URL,
+        json=payload,
+        headers=headers,
+        timeout=settings.OUTBOUND_REQUEST_TIMEOUT,
     )
     response.raise_for_status()
     return response
+
+
+@app.task(
+    autoretry_for=(RequestException, SoftTimeLimitExceeded),
+    retry_backoff=True,
+    max_retries=15,
+    acks_late=True,
+    soft_time_limit=60,
+    time_limit=90,
+    ignore_result=True,
+)
+def dispatch_rapidpro_events():
+    """
+    Drains the RapidPro events in the outbox, in order and in batches. Each
+    batch is claimed before it is sent, so an event is never sent by two
+    dispatchers or out of order, and marked as dispatched as it is sent. The
+    claim on the rest of the batch is renewed before each event is sent, as a
+    batch can take longer to send than the claim lasts.
+    """
+    pending = OutboxMessage.objects.filter(
+        message_type=OutboxMessage.RAPIDPRO_EVENT, dispatched_at__isnull=True
+    )
+
+    while True:
+        batch = claim_outbox_messages(
+            pending, settings.OUTBOX_BATCH_SIZE, in_order=True
+        )
+        if not batch:
+            return
+
+        for i, message in enumerate(batch):
+            if not renew_outbox_claim(batch[i:]):
+                # Another dispatcher took over the rest of the batch
+                return
+            try:
+                send_rapidpro_event(message.get_payload())
+            except RequestException:
+                # Stop at the first failure to keep the events in order
+                unsent = batch[i:]
+                release_outbox_messages(unsent[:1], attempts=F("attempts") + 1)
+                release_outbox_messages(unsent[1:])
+                raise
+            release_outbox_messages([message], dispatched_at=timezone.now())
+
+
+@app.task(ignore_result=True)
+def dispatch_outbox():
+    """
+    Periodic sweep that picks up anything left in the outbox, for example if
+    the broker was unavailable when the message was written.
+    """
+    pending = OutboxMessage.objects.filter(dispatched_at__isnull=True)
+
+    if pending.filter(message_type=OutboxMessage.WA_GROUP).exists():
+        send_wa_group_digest.delay()
+    if pending.filter(message_type=OutboxMessage.RAPIDPRO_EVENT).exists():
+        dispatch_rapidpro_events.delay()
+
+
+@app.task(ignore_result=True)
+def archive_old_patient_entries():
+    """
+    Keeps the PatientEntry table small by moving old completed and cancelled
+    entries into the archive.
+    """
+    archive_patient_entries(
+        timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+    )
+
+
+@app.task(ignore_result=True)
+def update_board_rollovers():
+    """
+    Runs every hour, on the hour, to move each board on to its new day at its
+    rollover hour.
+    """
+    for board in update_board_windows():
+        send_consumers_table(board.id)
+
+
+@app.task(ignore_result=True)
+def replay_queued_writes():
+    """
+    Saves the RapidPro writes queued while the database was unavailable, even
+    if no new write arrives to replay them.
+    """
+    # The views import this module
+    from .views import apply_queued_write
+
+    writequeue.replay(apply_queued_write)
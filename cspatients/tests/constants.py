@@ -191,3 +191,17 @@ SAMPLE_RP_UPDATE_BAD_OPTION_DATA = {
 
 SAMPLE_RP_CHECKLIST_DATA = {"contact": {"urn": "whatsapp:12065550109"}}
 SAMPLE_RP_CHECKLIST_DATA_INACTIVE = {"contact": {"urn": "whatsapp:12065550108"}}
+
+
+def rp_results(option=None, **values):
+    """
+    A RapidPro webhook payload with the given results, and the option chosen
+    in the flow.
+    """
+    results = {
+        key: {"category": "All Responses", "value": str(value)}
+        for key, value in values.items()
+    }
+    if option is not None:
+        results["option"] = {"category": option, "value": "1"}
+    return {"results": results}
@@ -0,0 +1,107 @@
+import threading
+
+import psycopg2
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import MagicMock, patch
+from psycopg2 import extensions
+
+from cspatients.backends.postgresql_pool.base import DatabaseWrapper
+
+
+@patch.dict("cspatients.backends.postgresql_pool.base._pools", clear=True)
+@patch("psycopg2.pool.psycopg2.connect")
+class PooledDatabaseWrapperTest(TestCase):
+    def get_wrapper(self, **settings):
+        settings_dict = {
+            "NAME": "momkhulu",
+            "USER": "",
+            "PASSWORD": "",
+            "HOST": "",
+            "PORT": "",
+            "OPTIONS": {},
+            "POOL_MIN_SIZE": 1,
+            "POOL_MAX_SIZE": 2,
+            "POOL_TIMEOUT": 0.01,
+        }
+        settings_dict.update(settings)
+        return DatabaseWrapper(settings_dict, "pooled")
+
+    def get_connection(self, broken=False):
+        connection = MagicMock(closed=0)
+        connection.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+        if broken:
+            cursor = connection.cursor.return_value.__enter__.return_value
+            cursor.execute.side_effect = psycopg2.OperationalError
+        return connection
+
+    def test_checkout(self, mock_connect):
+        connection = self.get_connection()
+        mock_connect.return_value = connection
+        wrapper = self.get_wrapper()
+
+        self.assertIs(wrapper.get_new_connection({}), connection)
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.execute.assert_called_once_with("SELECT 1")
+        mock_connect.assert_called_once_with(database="momkhulu")
+
+    @override_settings(DATABASE_HEALTH_CHECKS=False)
+    def test_checkout_without_health_checks(self, mock_connect):
+        connection = self.get_connection()
+        mock_connect.return_value = connection
+
+        self.assertIs(self.get_wrapper().get_new_connection({}), connection)
+        connection.cursor.assert_not_called()
+
+    def test_broken_connection_discarded(self, mock_connect):
+        broken, working = self.get_connection(broken=True), self.get_connection()
+        mock_connect.side_effect = [broken, working]
+        wrapper = self.get_wrapper()
+
+        self.assertIs(wrapper.get_new_connection({}), working)
+        broken.close.assert_called_once_with()
+        self.assertEqual(wrapper.get_pool()._pool, [])
+
+    def test_rollback_on_return(self, mock_connect):
+        connection = self.get_connection()
+        mock_connect.return_value = connection
+        wrapper = self.get_wrapper()
+        wrapper.connection = wrapper.get_new_connection({})
+        connection.rollback.reset_mock()
+
+        wrapper._close()
+
+        connection.rollback.assert_called_once_with()
+        connection.close.assert_not_called()
+        self.assertEqual(wrapper.get_pool()._pool, [connection])
+
+    def test_connection_discarded_if_rollback_fails(self, mock_connect):
+        connection = self.get_connection()
+        mock_connect.return_value = connection
+        wrapper = self.get_wrapper()
+        wrapper.connection = wrapper.get_new_connection({})
+        connection.rollback.side_effect = psycopg2.InterfaceError
+
+        wrapper._close()
+
+        connection.close.assert_called_once_with()
+        self.assertEqual(wrapper.get_pool()._pool, [])
+
+    def test_waits_for_a_free_connection(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: self.get_connection()
+        wrapper = self.get_wrapper(POOL_MAX_SIZE=1, POOL_TIMEOUT=5)
+        connection_pool = wrapper.get_pool()
+        connection = connection_pool.getconn()
+
+        timer = threading.Timer(0.05, connection_pool.putconn, [connection])
+        timer.start()
+        self.assertIs(connection_pool.getconn(), connection)
+        timer.join()
+
+    def test_times_out_when_exhausted(self, mock_connect):
+        mock_connect.side_effect = lambda **kwargs: self.get_connection()
+        wrapper = self.get_wrapper(POOL_MAX_SIZE=1)
+        wrapper.get_new_connection({})
+
+        with self.assertRaises(psycopg2.OperationalError):
+            wrapper.get_new_connection({})
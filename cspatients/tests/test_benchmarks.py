@@ -0,0 +1,28 @@
+from django.test import SimpleTestCase
+
+from benchmarks.run import compare, summarise
+
+
+class CompareTest(SimpleTestCase):
+    def result(self, *latencies):
+        return summarise([{"p50_ms": latency} for latency in latencies])
+
+    def test_noise_ignores_outlier(self):
+        self.assertEqual(self.result(10, 10, 10, 10, 50)["noise"], 0.0)
+        self.assertEqual(self.result(9, 10, 10, 11, 11)["noise"], 0.1)
+
+    def test_doubled_median_flagged(self):
+        baseline = {"board_view": self.result(10, 10, 10, 10, 10)}
+        results = {"board_view": self.result(20, 20, 20, 20, 20)}
+        self.assertEqual(len(compare(results, baseline, 0.1)), 1)
+
+    def test_doubled_median_flagged_despite_noise(self):
+        baseline = {"board_view": self.result(2, 4, 10, 18, 20)}
+        results = {"board_view": self.result(4, 8, 20, 36, 40)}
+        self.assertGreater(results["board_view"]["noise"], 1)
+        self.assertEqual(len(compare(results, baseline, 0.1)), 1)
+
+    def test_change_within_noise_allowed(self):
+        baseline = {"board_view": self.result(9, 10, 10, 11, 11)}
+        results = {"board_view": self.result(10, 11, 11, 12, 12)}
+        self.assertEqual(compare(results, baseline, 0.1), [])
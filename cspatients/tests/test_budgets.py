@@ -0,0 +1,210 @@
+import time
+from collections import namedtuple
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from cspatients import urls
+from cspatients.models import Baby, Board, PatientEntry, Profile
+from cspatients.util import rebuild_board_rows
+
+from .constants import SAMPLE_RP_POST_DATA, rp_results
+
+# The most queries, rendered bytes and milliseconds each endpoint may take
+# with the seeded data and a cold cache. The query budgets are below the
+# number of seeded entries, so a query per entry can't fit in them. The times
+# depend on the machine, so they are reported against their budget but not
+# enforced.
+Budget = namedtuple("Budget", ["queries", "bytes", "ms"])
+
+SEEDED_ENTRIES = 30
+
+BUDGETS = {
+    "root": Budget(12, 64 * 1024, 2000),
+    "cspatient_view": Budget(12, 64 * 1024, 2000),
+    "cspatient_form": Budget(6, 16 * 1024, 1000),
+    "cspatient_patient": Budget(8, 16 * 1024, 1000),
+    "rp_newpatiententry": Budget(20, 4 * 1024, 1000),
+    "rp_patientexits": Budget(8, 4 * 1024, 1000),
+    "rp_entrychanges": Budget(16, 4 * 1024, 1000),
+    "rp_entrychanges_bulk": Budget(20, 8 * 1024, 1000),
+    "rp_entrystatus_update": Budget(20, 1024, 1000),
+    "rp_entrystatus_update_bulk": Budget(20, 1024, 1000),
+    "rp_whitelist_check": Budget(8, 4 * 1024, 1000),
+    "rp_patient_list": Budget(8, 8 * 1024, 1000),
+    "rp_patient_select": Budget(4, 1024, 1000),
+    "rp_multiselect": Budget(4, 1024, 1000),
+    "whatsapp-events": Budget(6, 1024, 1000),
+    "health": Budget(0, 1024, 1000),
+    "detailed-health": Budget(0, 1024, 1000),
+}
+
+
+@override_settings(RABBITMQ_MANAGEMENT_INTERFACE="")
+class EndpointBudgetTest(TestCase):
+    """
+    Requests every endpoint in cspatients.urls against a seeded board, and
+    checks each stays within its budget.
+    """
+
+    report = []
+
+    @classmethod
+    def tearDownClass(cls):
+        super(EndpointBudgetTest, cls).tearDownClass()
+        if cls.report:
+            print("\n{:<28} {:>12} {:>16} {:>14}".format(*Budget._fields + ("",)))
+            for name, used, budget in cls.report:
+                print(
+                    "{:<28} {:>12} {:>16} {:>14}".format(
+                        name,
+                        f"{used.queries}/{budget.queries}",
+                        f"{used.bytes}/{budget.bytes}",
+                        f"{used.ms:.0f}/{budget.ms}",
+                    )
+                )
+
+    def setUp(self):
+        self.user = User.objects.create_user("budget", password="budget")
+        Profile.objects.create(user=self.user, msisdn="+27820001001")
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.api_client = APIClient()
+        self.api_client.credentials(
+            HTTP_AUTHORIZATION="Token {}".format(Token.objects.create(user=self.user))
+        )
+
+        now = timezone.now()
+        PatientEntry.objects.bulk_create(
+            PatientEntry(
+                board=Board.get_default(),
+                surname=f"Patient {i}",
+                urgency=i % 5 + 1,
+                location="Theatre 1",
+                clinician="Dr Test",
+                foetus=2,
+                decision_time=now - timezone.timedelta(minutes=i),
+                completion_time=now if i % 5 == 0 else None,
+            )
+            for i in range(SEEDED_ENTRIES)
+        )
+        completed = PatientEntry.objects.filter(completion_time__isnull=False)
+        Baby.objects.bulk_create(
+            Baby(patiententry=entry, baby_number=number, delivery_time=now)
+            for entry in completed
+            for number in (1, 2)
+        )
+        rebuild_board_rows()
+
+        self.entry_id = PatientEntry.objects.filter(
+            completion_time__isnull=True
+        ).values_list("id", flat=True)[0]
+
+    def get_request(self, name):
+        """
+        The client, method, path and data of a typical request to the endpoint.
+        """
+        entry_id = self.entry_id
+        delivery = [
+            rp_results(
+                "Delivery",
+                patient_id=entry_id,
+                foetus=2,
+                baby_number=number,
+                delivery_time="2019-05-12 10:22+00:00",
+            )
+            for number in (1, 2)
+        ]
+        change = rp_results(
+            "Patient Entry",
+            patient_id=entry_id,
+            change_category="location",
+            new_value="Theatre 2",
+        )
+        requests = {
+            "root": (self.client, "get", {}),
+            "cspatient_view": (self.client, "get", {}),
+            "cspatient_form": (self.client, "get", {}),
+            "cspatient_patient": (self.client, "get", {}),
+            "rp_newpatiententry": (self.api_client, "post", SAMPLE_RP_POST_DATA),
+            "rp_patientexits": (
+                self.api_client,
+                "post",
+                rp_results(patient_id=entry_id),
+            ),
+            "rp_entrychanges": (self.api_client, "post", change),
+            "rp_entrychanges_bulk": (
+                self.api_client,
+                "post",
+                {"changes": [change, change]},
+            ),
+            "rp_entrystatus_update": (self.api_client, "post", delivery[0]),
+            "rp_entrystatus_update_bulk": (
+                self.api_client,
+                "post",
+                {"updates": delivery},
+            ),
+            "rp_whitelist_check": (
+                self.api_client,
+                "post",
+                {"contact": {"urn": "tel:+27820001001"}},
+            ),
+            "rp_patient_list": (self.api_client, "get", {}),
+            "rp_patient_select": (
+                self.api_client,
+                "get",
+                {"patient_ids": f"1={entry_id}", "option": "1"},
+            ),
+            "rp_multiselect": (
+                self.api_client,
+                "get",
+                {"selections": "1,2", "options": "One|Two"},
+            ),
+            "whatsapp-events": (
+                APIClient(),
+                "post",
+                {
+                    "messages": [{"id": "message-1", "type": "text"}],
+                    "contacts": [{"wa_id": "27820001001"}],
+                },
+            ),
+            "health": (Client(), "get", {}),
+            "detailed-health": (Client(), "get", {}),
+        }
+        client, method, data = requests[name]
+        kwargs = {"patient_id": entry_id} if name == "cspatient_patient" else {}
+        return client, method, reverse(name, kwargs=kwargs), data
+
+    def measure(self, name):
+        client, method, path, data = self.get_request(name)
+        kwargs = {"format": "json"} if method == "post" else {}
+        cache.clear()
+
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(path, data, **kwargs)
+            ms = (time.perf_counter() - start) * 1000
+
+        self.assertLess(response.status_code, 300, name)
+        return Budget(len(queries), len(response.content), ms)
+
+    def test_every_endpoint_has_a_budget(self):
+        self.assertEqual(
+            {pattern.name for pattern in urls.urlpatterns}, set(BUDGETS.keys())
+        )
+
+    def test_endpoints_within_budget(self):
+        for name, budget in sorted(BUDGETS.items()):
+            with self.subTest(endpoint=name):
+                used = self.measure(name)
+                self.report.append((name, used, budget))
+
+                self.assertLessEqual(used.queries, budget.queries, "queries")
+                self.assertLessEqual(used.bytes, budget.bytes, "bytes")
@@ -0,0 +1,63 @@
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import Mock, patch
+
+from cspatients.connections import check_connections
+
+
+@patch("cspatients.connections.connections")
+class CheckConnectionsTest(TestCase):
+    def get_connection(self, usable=True, in_atomic_block=False, pooled=False):
+        return Mock(
+            alias="default",
+            in_atomic_block=in_atomic_block,
+            checked_on_checkout=pooled,
+            **{"is_usable.return_value": usable}
+        )
+
+    def test_broken_connection_closed(self, mock_connections):
+        connection = self.get_connection(usable=False)
+        mock_connections.all.return_value = [connection]
+
+        check_connections()
+
+        connection.close.assert_called_once_with()
+        connection.close_if_unusable_or_obsolete.assert_not_called()
+
+    def test_working_connection_reused(self, mock_connections):
+        connection = self.get_connection()
+        mock_connections.all.return_value = [connection]
+
+        check_connections()
+
+        connection.close.assert_not_called()
+        connection.close_if_unusable_or_obsolete.assert_called_once_with()
+
+    @override_settings(DATABASE_HEALTH_CHECKS=False)
+    def test_health_checks_disabled(self, mock_connections):
+        connection = self.get_connection(usable=False)
+        mock_connections.all.return_value = [connection]
+
+        check_connections()
+
+        connection.is_usable.assert_not_called()
+        connection.close_if_unusable_or_obsolete.assert_called_once_with()
+
+    def test_pooled_connection_not_checked_again(self, mock_connections):
+        connection = self.get_connection(pooled=True)
+        mock_connections.all.return_value = [connection]
+
+        check_connections()
+
+        connection.is_usable.assert_not_called()
+        connection.close_if_unusable_or_obsolete.assert_called_once_with()
+
+    def test_connection_in_transaction_left_alone(self, mock_connections):
+        connection = self.get_connection(in_atomic_block=True)
+        mock_connections.all.return_value = [connection]
+
+        check_connections()
+
+        connection.is_usable.assert_not_called()
+        connection.close.assert_not_called()
+        connection.close_if_unusable_or_obsolete.assert_not_called()
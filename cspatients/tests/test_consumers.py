@@ -1,11 +1,16 @@
+import json
+
 import pytest
 from channels.layers import get_channel_layer
 from channels.testing import WebsocketCommunicator
+from prometheus_client import REGISTRY
 
 from cspatients.consumers import ViewConsumer
+from cspatients.util import get_board_version, serialise_board_version
 
 
 @pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
 async def test_view_consumer():
     communicator = WebsocketCommunicator(ViewConsumer, "/ws/cspatients/viewsocket/")
 
@@ -14,10 +19,44 @@ async def test_view_consumer():
 
     channel_layer = get_channel_layer()
     await channel_layer.group_send(
-        "view", {"type": "view.update", "content": "Testing"}
+        "board-default", {"type": "view.update", "content": "Testing"}
     )
 
     response = await communicator.receive_from()
     assert response == "Testing"
 
     await communicator.disconnect()
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_view_consumer_resume():
+    communicator = WebsocketCommunicator(ViewConsumer, "/ws/cspatients/viewsocket/")
+    await communicator.connect()
+
+    await communicator.send_to(text_data=json.dumps({"version": None}))
+    response = json.loads(await communicator.receive_from())
+    assert response["type"] == "snapshot"
+
+    version = serialise_board_version(get_board_version())
+    await communicator.send_to(text_data=json.dumps({"version": version}))
+    assert await communicator.receive_nothing()
+
+    await communicator.disconnect()
+
+
+def get_connections():
+    return REGISTRY.get_sample_value(
+        "momkhulu_board_websocket_connections", {"board": "default"}
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_view_consumer_connections_counted():
+    communicator = WebsocketCommunicator(ViewConsumer, "/ws/cspatients/viewsocket/")
+    await communicator.connect()
+    connections = get_connections()
+
+    await communicator.disconnect()
+    assert get_connections() == connections - 1
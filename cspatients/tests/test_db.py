@@ -0,0 +1,193 @@
+import os
+import tempfile
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+from django.urls import resolve, reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from cspatients.db import PRIMARY_COOKIE, ReplicaMiddleware, ReplicaRouter, use_replica
+from cspatients.models import Board, PatientEntry
+
+from .constants import SAMPLE_RP_POST_DATA
+
+
+@override_settings(REPLICA_DATABASE="replica")
+class ReplicaRouterTest(TestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_reads_from_default_outside_block(self):
+        self.assertEqual(self.router.db_for_read(PatientEntry), "default")
+
+    def test_reads_from_replica_inside_block(self):
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(PatientEntry), "replica")
+
+        self.assertEqual(self.router.db_for_read(PatientEntry), "default")
+
+    def test_reads_own_writes(self):
+        with use_replica():
+            self.assertEqual(self.router.db_for_write(PatientEntry), "default")
+            self.assertEqual(self.router.db_for_read(PatientEntry), "default")
+
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(PatientEntry), "replica")
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_no_replica_configured(self):
+        with use_replica():
+            self.assertEqual(self.router.db_for_read(PatientEntry), "default")
+
+    def test_only_migrates_default(self):
+        self.assertTrue(self.router.allow_migrate("default", "cspatients"))
+        self.assertFalse(self.router.allow_migrate("replica", "cspatients"))
+
+
+@override_settings(REPLICA_DATABASE="replica")
+class ReplicaMiddlewareTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def get_routed_database(self, url, **extra):
+        request = RequestFactory().get(url, **extra)
+        request.resolver_match = resolve(url)
+        routed = []
+
+        def get_response(request):
+            middleware.process_view(request, None, (), {})
+            routed.append(ReplicaRouter().db_for_read(PatientEntry))
+            return HttpResponse()
+
+        middleware = ReplicaMiddleware(get_response)
+        middleware(request)
+
+        return routed[0]
+
+    def write(self, url, **extra):
+        request = RequestFactory().post(url, **extra)
+        request.resolver_match = resolve(url)
+
+        def get_response(request):
+            ReplicaRouter().db_for_write(PatientEntry)
+            return HttpResponse()
+
+        return ReplicaMiddleware(get_response)(request)
+
+    def test_read_only_view(self):
+        self.assertEqual(self.get_routed_database(reverse("cspatient_view")), "replica")
+        self.assertEqual(
+            self.get_routed_database(reverse("rp_patient_list")), "replica"
+        )
+
+    def test_other_view(self):
+        self.assertEqual(self.get_routed_database(reverse("cspatient_form")), "default")
+        self.assertEqual(
+            self.get_routed_database(reverse("rp_entrychanges")), "default"
+        )
+
+    def test_browser_reads_own_writes(self):
+        response = self.write(reverse("cspatient_form"))
+        cookie = response.cookies[PRIMARY_COOKIE]
+        self.assertEqual(cookie["max-age"], 30)
+
+        self.assertEqual(
+            self.get_routed_database(
+                reverse("cspatient_view"), HTTP_COOKIE=f"{PRIMARY_COOKIE}=1"
+            ),
+            "default",
+        )
+
+    def test_api_client_reads_own_writes(self):
+        self.write(reverse("rp_newpatiententry"), HTTP_AUTHORIZATION="Token abc")
+
+        self.assertEqual(
+            self.get_routed_database(
+                reverse("rp_patientexits"), HTTP_AUTHORIZATION="Token abc"
+            ),
+            "default",
+        )
+        self.assertEqual(
+            self.get_routed_database(
+                reverse("rp_patientexits"), HTTP_AUTHORIZATION="Token other"
+            ),
+            "replica",
+        )
+
+    @override_settings(REPLICA_DATABASE=None)
+    def test_no_cookie_without_replica(self):
+        response = self.write(reverse("cspatient_form"))
+        self.assertNotIn(PRIMARY_COOKIE, response.cookies)
+
+
+@override_settings(REPLICA_DATABASE="replica")
+class ReplicaDatabaseTest(TestCase):
+    """
+    Routes requests between two SQLite databases, with the replica never
+    catching up with the primary, to show which database each read is from.
+    """
+
+    databases = {"default", "replica"}
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.databases["replica"] = {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.path.join(cls.directory.name, "replica.sqlite3"),
+        }
+        connections.ensure_defaults("replica")
+        connections.prepare_test_settings("replica")
+        with connections["replica"].schema_editor() as editor:
+            for model in apps.get_models():
+                if model._meta.managed and not model._meta.proxy:
+                    editor.create_model(model)
+        super(ReplicaDatabaseTest, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(ReplicaDatabaseTest, cls).tearDownClass()
+        connections["replica"].close()
+        del connections["replica"]
+        del connections.databases["replica"]
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user("rapidpro")
+        token = Token.objects.create(user=user)
+        # The replica has the user and the board, but none of the patient entries
+        user.save(using="replica")
+        token.save(using="replica")
+        Board.get_default().save(using="replica")
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION="Token {}".format(token.key))
+
+    def patient_exists(self, patient_id):
+        data = {
+            "results": {
+                "patient_id": {"category": "All Responses", "value": str(patient_id)}
+            }
+        }
+        return self.client.post(reverse("rp_patientexits"), data, format="json")
+
+    def test_reads_from_replica(self):
+        entry = PatientEntry.objects.create(surname="Jane")
+
+        self.assertEqual(self.patient_exists(entry.id).status_code, 404)
+
+    def test_reads_own_writes(self):
+        response = self.client.post(
+            reverse("rp_newpatiententry"), SAMPLE_RP_POST_DATA, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+
+        entry = PatientEntry.objects.get()
+        self.assertEqual(self.patient_exists(entry.id).status_code, 200)
@@ -1,7 +1,8 @@
 from django.contrib.auth.models import User
 from django.test import TestCase
 
-from cspatients.models import Profile
+from cspatients.models import ArchivedPatientEntry, Board, PatientEntry, Profile
+from cspatients.util import get_field_values
 
 
 class TestModels(TestCase):
@@ -12,3 +13,12 @@ class TestModels(TestCase):
         profile = Profile.objects.create(**{"user": new_user, "msisdn": "+12065550109"})
 
         self.assertEqual(str(profile), "test_user: +12065550109")
+
+    def test_patient_entry_with_board(self):
+        # The default board is only looked up for entries created without one
+        board = Board.get_default()
+        entry = PatientEntry.objects.create(surname="Jane", board=board)
+
+        with self.assertNumQueries(0):
+            PatientEntry(surname="John", board=board)
+            ArchivedPatientEntry(**get_field_values(entry))
@@ -0,0 +1,79 @@
+from django.contrib.auth.models import User
+from django.test import Client, TestCase
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from cspatients.models import PatientEntry, RequestProfile
+from cspatients.profiling import get_profile_header
+
+
+@override_settings(REQUEST_PROFILING=True)
+class ProfilingMiddlewareTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user("profiled")
+        self.client.force_login(self.user)
+        PatientEntry.objects.create(surname="Jane")
+
+    def test_not_profiled_without_header(self):
+        response = self.client.get(reverse("cspatient_view"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("Server-Timing", response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_profiled_with_signed_header(self):
+        response = self.client.get(
+            reverse("cspatient_view"), HTTP_X_MOMKHULU_PROFILE=get_profile_header()
+        )
+
+        self.assertEqual(response.status_code, 200)
+        [profile] = RequestProfile.objects.all()
+        self.assertEqual(response["X-Momkhulu-Profile-Id"], str(profile.id))
+        self.assertIn("total;dur=", response["Server-Timing"])
+        self.assertIn(f'"{profile.sql_count} queries"', response["Server-Timing"])
+
+        self.assertEqual((profile.method, profile.path), ("GET", "/view"))
+        self.assertGreater(profile.sql_count, 0)
+        self.assertEqual(len(profile.get_queries()), profile.sql_count)
+        self.assertGreater(profile.template_ms, 0)
+        self.assertIn("cumulative", profile.profile)
+
+    def test_not_profiled_with_bad_signature(self):
+        response = self.client.get(
+            reverse("cspatient_view"), HTTP_X_MOMKHULU_PROFILE="profile:forged"
+        )
+
+        self.assertNotIn("Server-Timing", response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_staff_profiled_without_signature(self):
+        self.user.is_staff = True
+        self.user.save()
+
+        response = self.client.get(
+            reverse("cspatient_view"), HTTP_X_MOMKHULU_PROFILE="1"
+        )
+
+        self.assertIn("Server-Timing", response)
+        self.assertEqual(RequestProfile.objects.count(), 1)
+
+    @override_settings(REQUEST_PROFILING=False)
+    def test_disabled(self):
+        response = self.client.get(
+            reverse("cspatient_view"), HTTP_X_MOMKHULU_PROFILE=get_profile_header()
+        )
+
+        self.assertNotIn("Server-Timing", response)
+
+    @override_settings(PROFILING_KEEP=2)
+    def test_keeps_newest_profiles(self):
+        ids = [
+            self.client.get(
+                reverse("health"), HTTP_X_MOMKHULU_PROFILE=get_profile_header()
+            )["X-Momkhulu-Profile-Id"]
+            for _ in range(3)
+        ]
+
+        kept = RequestProfile.objects.values_list("id", flat=True)
+        self.assertEqual({str(i) for i in kept}, set(ids[1:]))
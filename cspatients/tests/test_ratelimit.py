@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.test import TestCase
+from freezegun import freeze_time
+from mock import patch
+
+from cspatients.ratelimit import TokenBucket
+
+
+class TokenBucketTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_consume_until_empty(self):
+        bucket = TokenBucket("test", rate=1, capacity=2)
+
+        with freeze_time("2019-01-01 08:00:00"):
+            self.assertEqual(bucket.consume(), 0)
+            self.assertEqual(bucket.consume(), 0)
+            self.assertEqual(bucket.consume(), 1)
+
+    def test_refills_over_time(self):
+        bucket = TokenBucket("test", rate=0.5, capacity=1)
+
+        with freeze_time("2019-01-01 08:00:00"):
+            self.assertEqual(bucket.consume(), 0)
+            self.assertEqual(bucket.consume(), 2)
+
+        with freeze_time("2019-01-01 08:00:01"):
+            self.assertEqual(bucket.consume(), 1)
+
+        with freeze_time("2019-01-01 08:00:02"):
+            self.assertEqual(bucket.consume(), 0)
+
+    @patch("cspatients.ratelimit.LOCK_TIMEOUT", 0)
+    def test_locked_bucket(self):
+        bucket = TokenBucket("test", rate=0.5, capacity=1)
+        cache.add(bucket.lock_key, 1)
+
+        self.assertEqual(bucket.consume(), 2)
+
+        cache.delete(bucket.lock_key)
+        self.assertEqual(bucket.consume(), 0)
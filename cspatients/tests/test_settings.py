@@ -0,0 +1,87 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# Imports the task modules, and the modules the tasks import when they run, as
+# a Celery worker would, and lists the tasks that were registered
+WORKER_IMPORTS = """
+import django, importlib, json
+django.setup()
+from django.conf import settings
+from momkhulu.celery import app
+for module in settings.CELERY_IMPORTS + ("cspatients.views",):
+    importlib.import_module(module)
+print(json.dumps(sorted(app.tasks)))
+"""
+
+WORKER_SETTINGS = """
+import json
+from django.conf import settings
+print(json.dumps([settings.INSTALLED_APPS, settings.MIDDLEWARE]))
+"""
+
+LOAD_SETTINGS = """
+from django.conf import settings
+print(settings.REPLICA_DATABASE)
+"""
+
+
+def run_with_settings(code, **env):
+    """
+    Runs code in a new Python process, with the settings loaded from the
+    environment variables `env`. Returns its output.
+    """
+    env = dict(
+        os.environ,
+        DJANGO_SETTINGS_MODULE=os.environ.get(
+            "DJANGO_SETTINGS_MODULE", "momkhulu.settings.dev"
+        ),
+        **env,
+    )
+    return subprocess.check_output(
+        [sys.executable, "-c", code],
+        cwd=settings.BASE_DIR,
+        env=env,
+        stderr=subprocess.STDOUT,
+    )
+
+
+class WorkerRoleTest(SimpleTestCase):
+    def test_task_modules_import(self):
+        output = run_with_settings(WORKER_IMPORTS, PROCESS_ROLE="worker")
+        tasks = json.loads(output.splitlines()[-1])
+
+        for entry in settings.CELERYBEAT_SCHEDULE.values():
+            self.assertIn(entry["task"], tasks)
+        self.assertIn("cspatients.tasks.post_patient_update", tasks)
+
+    def test_web_only_apps_dropped(self):
+        output = run_with_settings(WORKER_SETTINGS, PROCESS_ROLE="worker")
+        apps, middleware = json.loads(output.splitlines()[-1])
+
+        self.assertFalse(set(apps) & set(settings.WEB_ONLY_APPS))
+        self.assertIn("cspatients", apps)
+        self.assertEqual(middleware, [])
+
+
+class ReplicaCacheTest(SimpleTestCase):
+    def test_local_cache_refused(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            run_with_settings(
+                LOAD_SETTINGS,
+                REPLICA_DATABASE_URL="sqlite:////tmp/replica.db",
+                CACHE_URL="locmemcache://",
+            )
+        self.assertIn(b"CACHE_URL", cm.exception.output)
+
+    def test_shared_cache(self):
+        output = run_with_settings(
+            LOAD_SETTINGS,
+            REPLICA_DATABASE_URL="sqlite:////tmp/replica.db",
+            CACHE_URL="dbcache://momkhulu_cache",
+        )
+        self.assertEqual(output.splitlines()[-1], b"replica")
@@ -1,9 +1,45 @@
 import json
+import os
+import socket
+import tempfile
+from datetime import timedelta
+from urllib.request import urlopen
 
 import responses
-from django.test import TestCase
+from celery.exceptions import Retry
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+from freezegun import freeze_time
+from mock import Mock, patch
+from requests import RequestException
 
-from cspatients.tasks import send_wa_group_message
+from cspatients import writequeue
+from cspatients.models import Board, OutboxMessage, PatientEntry
+from cspatients.tasks import (
+    broadcast_board_update,
+    dispatch_outbox,
+    dispatch_rapidpro_events,
+    replay_queued_writes,
+    schedule_board_update,
+    send_changed_boards,
+    send_wa_group_digest,
+    send_wa_group_message,
+    session,
+    update_board_rollovers,
+)
+from cspatients.util import (
+    claim_outbox_messages,
+    create_outbox_message,
+    send_consumers_table,
+    sent_board_versions,
+    update_board_row,
+)
+from momkhulu.celery import export_pool_process_metrics, export_worker_metrics
 
 
 class SendGroupMessageTest(TestCase):
@@ -38,3 +74,406 @@ class SendGroupMessageTest(TestCase):
         headers = wa_call.request.headers
         self.assertEqual(headers["Authorization"], "Bearer 123456")
         self.assertEqual(headers["Content-Type"], "application/json")
+
+
+class SendGroupDigestTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def mock_send_message(self):
+        responses.add(
+            responses.POST,
+            "https://fakewhatsapp/v1/messages",
+            json={},
+            status=200,
+            match_querystring=True,
+        )
+
+    def get_sent_body(self, call):
+        return json.loads(call.request.body)["text"]["body"]
+
+    def queue_message(self, body, group_id=None):
+        return create_outbox_message(
+            OutboxMessage.WA_GROUP, {"body": body, "group_id": group_id}
+        )
+
+    @responses.activate
+    def test_single_message_sent_as_is(self):
+        self.mock_send_message()
+        message = self.queue_message("Patient 1")
+
+        send_wa_group_digest()
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(self.get_sent_body(responses.calls[0]), "Patient 1")
+
+        message.refresh_from_db()
+        self.assertIsNotNone(message.dispatched_at)
+
+    @responses.activate
+    def test_multiple_messages_combined(self):
+        self.mock_send_message()
+        self.queue_message("Patient 1")
+        self.queue_message("Patient 2")
+
+        send_wa_group_digest()
+
+        self.assertEqual(len(responses.calls), 1)
+        self.assertEqual(
+            self.get_sent_body(responses.calls[0]),
+            "2 patients have been added to the Momkhulu Triage Board.\n\n"
+            "Patient 1\n\nPatient 2",
+        )
+        self.assertFalse(
+            OutboxMessage.objects.filter(dispatched_at__isnull=True).exists()
+        )
+
+    @responses.activate
+    def test_digest_for_each_group(self):
+        self.mock_send_message()
+        self.queue_message("Patient 1")
+        self.queue_message("Patient 2", "other-group")
+        self.queue_message("Patient 3")
+
+        send_wa_group_digest()
+
+        self.assertEqual(
+            [json.loads(call.request.body)["to"] for call in responses.calls],
+            ["the-group-id", "other-group"],
+        )
+        self.assertEqual(self.get_sent_body(responses.calls[1]), "Patient 2")
+        self.assertFalse(
+            OutboxMessage.objects.filter(dispatched_at__isnull=True).exists()
+        )
+
+    @responses.activate
+    def test_nothing_queued(self):
+        send_wa_group_digest()
+
+        self.assertEqual(len(responses.calls), 0)
+
+    @responses.activate
+    @override_settings(TURN_GROUP_MESSAGE_BURST=1)
+    def test_rate_limited(self):
+        self.mock_send_message()
+        self.queue_message("Patient 1")
+        send_wa_group_digest()
+
+        message = self.queue_message("Patient 2")
+        with patch.object(send_wa_group_digest, "retry") as mock_retry:
+            mock_retry.return_value = Retry()
+            with self.assertRaises(Retry):
+                send_wa_group_digest()
+
+        [(_, kwargs)] = mock_retry.call_args_list
+        self.assertGreater(kwargs["countdown"], 0)
+
+        self.assertEqual(len(responses.calls), 1)
+        message.refresh_from_db()
+        self.assertIsNone(message.dispatched_at)
+
+    @responses.activate
+    def test_claimed_messages_not_sent(self):
+        self.mock_send_message()
+        self.queue_message("Patient 1")
+        claim_outbox_messages(OutboxMessage.objects.all())
+
+        send_wa_group_digest()
+
+        self.assertEqual(len(responses.calls), 0)
+
+    @responses.activate
+    def test_sent_with_timeout(self):
+        self.mock_send_message()
+        self.queue_message("Patient 1")
+
+        with patch("cspatients.tasks.session.post", wraps=session.post) as mock_post:
+            send_wa_group_digest()
+
+        [(_, kwargs)] = mock_post.call_args_list
+        self.assertEqual(kwargs["timeout"], settings.OUTBOUND_REQUEST_TIMEOUT)
+
+    @responses.activate
+    def test_failed_send_stays_in_outbox(self):
+        responses.add(
+            responses.POST, "https://fakewhatsapp/v1/messages", json={}, status=500
+        )
+        message = self.queue_message("Patient 1")
+
+        with self.assertRaises(RequestException):
+            send_wa_group_digest()
+
+        message.refresh_from_db()
+        self.assertIsNone(message.dispatched_at)
+        self.assertIsNone(message.claimed_until)
+        self.assertEqual(message.attempts, 1)
+
+
+class DispatchRapidProEventsTest(TestCase):
+    def queue_event(self, event_id):
+        return create_outbox_message(
+            OutboxMessage.RAPIDPRO_EVENT, {"messages": [{"id": event_id}]}
+        )
+
+    def get_sent_ids(self):
+        return [
+            json.loads(call.request.body)["messages"][0]["id"]
+            for call in responses.calls
+        ]
+
+    @responses.activate
+    @override_settings(OUTBOX_BATCH_SIZE=2)
+    def test_drains_outbox_in_batches(self):
+        responses.add(responses.POST, settings.RAPIDPRO_CHANNEL_URL, json={})
+        for i in range(5):
+            self.queue_event(f"message_id{i}")
+
+        dispatch_rapidpro_events()
+
+        self.assertEqual(self.get_sent_ids(), [f"message_id{i}" for i in range(5)])
+        self.assertFalse(
+            OutboxMessage.objects.filter(dispatched_at__isnull=True).exists()
+        )
+
+    @responses.activate
+    def test_dispatch_is_idempotent(self):
+        responses.add(responses.POST, settings.RAPIDPRO_CHANNEL_URL, json={})
+        self.queue_event("message_id1")
+
+        dispatch_rapidpro_events()
+        dispatch_rapidpro_events()
+
+        self.assertEqual(self.get_sent_ids(), ["message_id1"])
+
+    @responses.activate
+    def test_stops_at_first_failure(self):
+        responses.add(responses.POST, settings.RAPIDPRO_CHANNEL_URL, status=500)
+        first = self.queue_event("message_id1")
+        second = self.queue_event("message_id2")
+
+        with self.assertRaises(RequestException):
+            dispatch_rapidpro_events()
+
+        self.assertEqual(self.get_sent_ids(), ["message_id1"])
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.attempts, second.attempts), (1, 0))
+        self.assertIsNone(first.dispatched_at)
+        self.assertEqual((first.claimed_until, second.claimed_until), (None, None))
+
+    def test_claim_renewed_through_batch(self):
+        for i in range(3):
+            self.queue_event(f"message_id{i}")
+        sent, competing = [], []
+
+        with freeze_time(timezone.now()) as frozen:
+
+            def send(payload):
+                # The batch takes longer to send than the claim lasts
+                frozen.tick(timedelta(seconds=settings.OUTBOX_CLAIM_SECONDS * 2 / 3))
+                sent.append(payload["messages"][0]["id"])
+                pending = OutboxMessage.objects.filter(dispatched_at__isnull=True)
+                competing.extend(claim_outbox_messages(pending, in_order=True))
+
+            with patch("cspatients.tasks.send_rapidpro_event", side_effect=send):
+                dispatch_rapidpro_events()
+
+        self.assertEqual(sent, ["message_id0", "message_id1", "message_id2"])
+        self.assertEqual(competing, [])
+
+    def test_stops_when_claim_taken(self):
+        for i in range(3):
+            self.queue_event(f"message_id{i}")
+        sent = []
+
+        def send(payload):
+            sent.append(payload["messages"][0]["id"])
+            if len(sent) == 1:
+                # The claim expires, and another dispatcher claims the rest
+                OutboxMessage.objects.exclude(payload__contains="message_id0").update(
+                    claimed_until=None
+                )
+                claim_outbox_messages(
+                    OutboxMessage.objects.exclude(payload__contains="message_id0")
+                )
+
+        with patch("cspatients.tasks.send_rapidpro_event", side_effect=send):
+            dispatch_rapidpro_events()
+
+        self.assertEqual(sent, ["message_id0"])
+        self.assertEqual(
+            OutboxMessage.objects.filter(
+                dispatched_at__isnull=True, claimed_until__isnull=False
+            ).count(),
+            2,
+        )
+
+    @responses.activate
+    def test_not_sent_while_oldest_claimed(self):
+        responses.add(responses.POST, settings.RAPIDPRO_CHANNEL_URL, json={})
+        first = self.queue_event("message_id1")
+        self.queue_event("message_id2")
+        claim_outbox_messages(OutboxMessage.objects.filter(id=first.id))
+
+        dispatch_rapidpro_events()
+
+        self.assertEqual(self.get_sent_ids(), [])
+
+
+class DispatchOutboxTest(TestCase):
+    @patch("cspatients.tasks.dispatch_rapidpro_events.delay")
+    @patch("cspatients.tasks.send_wa_group_digest.delay")
+    def test_dispatches_pending_messages(self, mock_digest, mock_events):
+        create_outbox_message(OutboxMessage.RAPIDPRO_EVENT, {})
+
+        dispatch_outbox()
+
+        mock_digest.assert_not_called()
+        mock_events.assert_called_once_with()
+
+
+class UpdateBoardRolloversTest(TestCase):
+    def setUp(self):
+        self.board = Board.get_default()
+
+    @patch("cspatients.tasks.send_consumers_table")
+    def test_board_updated_on_rollover(self, mock_send):
+        update_board_rollovers()
+        mock_send.assert_called_once_with(self.board.id)
+
+        mock_send.reset_mock()
+        update_board_rollovers()
+        mock_send.assert_not_called()
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class SendChangedBoardsTest(TestCase):
+    def setUp(self):
+        self.board = Board.get_default()
+        sent_board_versions.clear()
+
+    @patch("cspatients.tasks.send_consumers_table", wraps=send_consumers_table)
+    def test_only_changed_boards_sent(self, mock_send):
+        other = Board.objects.create(name="Other", slug="other")
+        send_changed_boards()
+        self.assertEqual(
+            sorted(call[0][0] for call in mock_send.call_args_list),
+            sorted([self.board.id, other.id]),
+        )
+
+        mock_send.reset_mock()
+        send_changed_boards()
+        mock_send.assert_not_called()
+
+        # A write made in a worker, which couldn't send the board itself
+        with override_settings(CHANNEL_LAYER_BACKEND="memory", PROCESS_ROLE="worker"):
+            entry = PatientEntry.objects.create(surname="Jane", board=other)
+            update_board_row(entry.id)
+            send_consumers_table(other.id)
+        send_changed_boards()
+        mock_send.assert_called_once_with(other.id)
+
+
+class BroadcastBoardUpdateTest(TestCase):
+    @override_settings(BOARD_BROADCAST="direct")
+    @patch("cspatients.tasks.post_patient_update.delay")
+    @patch("cspatients.tasks.send_consumers_table")
+    def test_direct(self, mock_send, mock_delay):
+        schedule_board_update(1).result()
+        mock_send.assert_called_once_with(1)
+        mock_delay.assert_not_called()
+
+    @override_settings(BOARD_BROADCAST="direct", CHANNEL_LAYER_BACKEND="redis")
+    @patch("cspatients.tasks.post_patient_update.delay")
+    @patch("cspatients.tasks.send_consumers_table")
+    def test_direct_falls_back_to_celery(self, mock_send, mock_delay):
+        mock_send.side_effect = OSError()
+        schedule_board_update(1).result()
+        mock_delay.assert_called_once_with(board_id=1)
+
+    @override_settings(BOARD_BROADCAST="direct", CHANNEL_LAYER_BACKEND="memory")
+    @patch("cspatients.tasks.post_patient_update.delay")
+    @patch("cspatients.tasks.send_consumers_table")
+    def test_no_celery_fallback_for_memory_layer(self, mock_send, mock_delay):
+        mock_send.side_effect = OSError()
+        schedule_board_update(1).result()
+        mock_delay.assert_not_called()
+
+    @override_settings(BOARD_BROADCAST="celery")
+    @patch("cspatients.tasks.post_patient_update.delay")
+    @patch("cspatients.tasks.send_consumers_table")
+    def test_celery(self, mock_send, mock_delay):
+        schedule_board_update(1)
+        mock_delay.assert_called_once_with(board_id=1)
+        mock_send.assert_not_called()
+
+
+class BroadcastOnCommitTest(TransactionTestCase):
+    @patch("cspatients.tasks.schedule_board_update")
+    def test_sent_after_commit(self, mock_schedule):
+        with transaction.atomic():
+            broadcast_board_update(1)
+            mock_schedule.assert_not_called()
+        mock_schedule.assert_called_once_with(1)
+
+
+class ReplayQueuedWritesTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            WRITE_QUEUE_PATH=os.path.join(directory.name, "queue.jsonl")
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    @patch("cspatients.views.broadcast_board_update")
+    def test_replay_queued_writes(self, mock_broadcast):
+        user = User.objects.create_user("rapidpro")
+        writequeue.enqueue(
+            "newentry",
+            {"surname": "Jane", "decision_time": "2019-05-12 12:22+02:00"},
+            user_id=user.pk,
+            board_url="http://testserver/",
+        )
+
+        replay_queued_writes()
+
+        self.assertEqual(writequeue.get_pending_count(), 0)
+        self.assertEqual(
+            list(PatientEntry.objects.values_list("surname", flat=True)), ["Jane"]
+        )
+
+
+class WorkerMetricsTest(TestCase):
+    def get_free_port(self):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            return s.getsockname()[1]
+
+    def test_metrics_exported(self):
+        port = self.get_free_port()
+        with override_settings(
+            WORKER_METRICS_PORTS=str(port), WORKER_METRICS_ADDRESS="127.0.0.1"
+        ):
+            export_worker_metrics(sender=Mock(pool_cls="solo"))
+        create_outbox_message(OutboxMessage.WA_GROUP, {"body": "Patient 1"})
+
+        with patch("cspatients.tasks.claim_outbox_messages", return_value=[]):
+            send_wa_group_digest()
+
+        with urlopen("http://127.0.0.1:{}/".format(port)) as response:
+            metrics = response.read().decode()
+        self.assertIn("momkhulu_wa_group_message_queue_depth 1.0", metrics)
+
+    def test_prefork_main_process_not_exported(self):
+        with override_settings(WORKER_METRICS_PORTS="9101"), patch(
+            "momkhulu.celery.SetupPrometheusEndpointOnPortRange"
+        ) as mock_setup:
+            export_worker_metrics(sender=Mock(pool_cls="prefork"))
+            mock_setup.assert_not_called()
+
+            export_pool_process_metrics()
+            mock_setup.assert_called_once_with(range(9101, 9102), "")
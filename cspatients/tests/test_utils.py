@@ -1,13 +1,41 @@
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.utils import timezone
 from freezegun import freeze_time
-
-from cspatients.models import PatientEntry
+from prometheus_client import REGISTRY
+
+from cspatients.models import (
+    ArchivedBaby,
+    ArchivedPatientEntry,
+    Baby,
+    Board,
+    BoardRow,
+    PatientEntry,
+    Profile,
+)
 from cspatients.util import (
+    ConcurrentUpdateError,
+    archive_patient_entries,
     get_all_active_patient_entries,
+    get_all_patient_entry_values,
+    get_board_rollover,
+    get_board_update,
+    get_board_version,
+    get_patient_entry,
     get_rp_dict,
+    get_user_board,
+    rebuild_board_rows,
+    render_board_rows,
     save_model,
     save_model_changes,
+    send_consumers_table,
+    serialise_board_entry,
+    serialise_board_version,
+    update_board_windows,
 )
 
 from .constants import SAMPLE_RP_POST_DATA, SAMPLE_RP_UPDATE_DATA
@@ -15,6 +43,8 @@ from .constants import SAMPLE_RP_POST_DATA, SAMPLE_RP_UPDATE_DATA
 
 class ViewAllContextTest(TestCase):
     def setUp(self):
+        self.board = Board.get_default()
+
         self.patient_one_data = {"surname": "Urgency COLD", "age": 20}
 
         self.patient_two_data = {
@@ -31,7 +61,12 @@ class ViewAllContextTest(TestCase):
             "urgency": 1,
         }
 
-        self.patient_five_data = {"surname": "Completed OLD", "age": 23, "urgency": 1}
+        self.patient_five_data = {
+            "surname": "Completed Decided Yesterday",
+            "age": 23,
+            "urgency": 1,
+        }
+        self.patient_seven_data = {"surname": "Completed OLD", "age": 20}
         self.patient_six_data = {"surname": "Cancel", "operation_cancelled": True}
 
     def test_context_when_no_patients(self):
@@ -56,16 +91,21 @@ class ViewAllContextTest(TestCase):
         entry5.decision_time = timezone.now() - timezone.timedelta(days=1)
         entry5.save()
 
+        entry7, _ = save_model(self.patient_seven_data)
+        entry7.completion_time = timezone.now() - timezone.timedelta(days=1)
+        entry7.save()
+
         patient_entries = get_all_active_patient_entries()
 
-        # Check that it returns 4 objects
-        self.assertEqual(len(patient_entries), 4)
+        # Check that it returns 5 objects
+        self.assertEqual(len(patient_entries), 5)
 
         # Check that the results are sorted by the urgency
         self.assertEqual(patient_entries[0].surname, "Urgency Immediate")
         self.assertEqual(patient_entries[1].surname, "Urgency Immediate NEW")
         self.assertEqual(patient_entries[2].surname, "Urgency COLD")
-        self.assertEqual(patient_entries[3].surname, "John Completed")
+        self.assertEqual(patient_entries[3].surname, "Completed Decided Yesterday")
+        self.assertEqual(patient_entries[4].surname, "John Completed")
 
     @freeze_time("04:30")
     def test_get_all_active_patient_entries_before_5_utc(self):
@@ -95,9 +135,51 @@ class ViewAllContextTest(TestCase):
         self.assertEqual(patient_entries[0].surname, "Urgency Immediate")
         self.assertEqual(patient_entries[1].surname, "Urgency Immediate NEW")
         self.assertEqual(patient_entries[2].surname, "Urgency COLD")
-        self.assertEqual(patient_entries[3].surname, "Completed OLD")
+        self.assertEqual(patient_entries[3].surname, "Completed Decided Yesterday")
         self.assertEqual(patient_entries[4].surname, "John Completed")
 
+    @freeze_time("2019-08-01 08:00")
+    def test_get_all_active_patient_entries_rollover_hour(self):
+        entry, _ = save_model(self.patient_three_data)
+        entry.completion_time = timezone.now() - timezone.timedelta(hours=2)
+        entry.save()
+
+        # Completed at 08:00 SAST, after the default 07:00 rollover
+        self.assertEqual(len(get_all_active_patient_entries()), 1)
+
+        Board.objects.filter(slug="default").update(rollover_hour=9)
+        self.assertFalse(get_all_active_patient_entries())
+
+        Board.objects.filter(slug="default").update(rollover_hour=11)
+        self.assertEqual(len(get_all_active_patient_entries()), 1)
+
+    @freeze_time("2019-08-01 08:00")
+    def test_update_board_windows(self):
+        board = self.board
+        self.assertIsNone(board.visible_from)
+
+        self.assertEqual(update_board_windows(), [board])
+        self.assertEqual(update_board_windows(), [])
+
+        board.refresh_from_db()
+        self.assertEqual(board.visible_from, board.get_last_rollover())
+        self.assertEqual(
+            board.visible_from, timezone.make_aware(datetime(2019, 8, 1, 7))
+        )
+
+    @freeze_time("2019-08-01 08:00")
+    def test_stale_board_window(self):
+        # The task last ran a week ago
+        Board.objects.update(visible_from=timezone.now() - timezone.timedelta(days=7))
+        entry, _ = save_model(self.patient_three_data)
+        entry.completion_time = timezone.now() - timezone.timedelta(days=2)
+        entry.save()
+
+        self.assertEqual(
+            get_board_rollover(), timezone.make_aware(datetime(2019, 8, 1, 7))
+        )
+        self.assertFalse(get_all_active_patient_entries())
+
     def test_get_all_active_patient_entries_filter(self):
         save_model(self.patient_one_data)
         save_model(self.patient_two_data)
@@ -207,6 +289,33 @@ class SaveModelChangesTest(TestCase):
         self.patient_entry.refresh_from_db()
         self.assertEqual(self.patient_entry.urgency, result.urgency)
 
+    def test_only_changed_fields_written(self):
+        # Changed by someone else since the entry was read
+        PatientEntry.objects.filter(id=self.patient_entry.id).update(location="A")
+
+        save_model_changes({"patient_id": str(self.patient_entry.id), "surname": "Moe"})
+
+        self.patient_entry.refresh_from_db()
+        self.assertEqual(
+            (self.patient_entry.surname, self.patient_entry.location), ("Moe", "A")
+        )
+        self.assertEqual(self.patient_entry.version, 1)
+
+    def test_version_conflict(self):
+        changes_dict = {
+            "patient_id": str(self.patient_entry.id),
+            "surname": "Moe",
+            "version": "0",
+        }
+        save_model_changes(changes_dict)
+
+        changes_dict["surname"] = "Roe"
+        with self.assertRaises(ConcurrentUpdateError):
+            save_model_changes(changes_dict)
+
+        self.patient_entry.refresh_from_db()
+        self.assertEqual(self.patient_entry.surname, "Moe")
+
 
 class GetRPDictTest(TestCase):
 
@@ -240,3 +349,330 @@ class GetRPDictTest(TestCase):
 
         self.assertEqual(changes_dict["surname"], "Nyasha")
         self.assertEqual(changes_dict["patient_id"], "1")
+
+    def test_context_only_needed_results(self):
+        data = {
+            "results": {
+                "patient_id": {"category": "All Responses", "value": "1"},
+                "option": {"category": "Completed", "value": "4"},
+                "favourite_colour": {"category": "All Responses", "value": "Blue"},
+            }
+        }
+
+        self.assertEqual(
+            get_rp_dict(data, context="entrystatus"),
+            {"patient_id": "1", "option": "Completed"},
+        )
+        self.assertEqual(get_rp_dict(data, context="patient"), {"patient_id": "1"})
+
+
+class ArchivePatientEntriesTest(TestCase):
+    def create_patient_entry(self, surname, days_old, babies=0, **kwargs):
+        entry = PatientEntry.objects.create(surname=surname, **kwargs)
+        for number in range(1, babies + 1):
+            Baby.objects.create(
+                patiententry=entry, baby_number=number, delivery_time=timezone.now()
+            )
+        # Saving a baby touches its entry, so the entry is backdated afterwards
+        PatientEntry.objects.filter(id=entry.id).update(
+            updated_at=timezone.now() - timezone.timedelta(days=days_old)
+        )
+        return entry
+
+    def test_archive_patient_entries(self):
+        completed = self.create_patient_entry(
+            "Completed", 40, babies=1, completion_time=timezone.now()
+        )
+        cancelled = self.create_patient_entry("Cancelled", 40, operation_cancelled=True)
+        active = self.create_patient_entry("Active", 40)
+        recent = self.create_patient_entry("Recent", 1, completion_time=timezone.now())
+
+        archived = archive_patient_entries(
+            timezone.now() - timezone.timedelta(days=30), batch_size=1
+        )
+
+        self.assertEqual(archived, 2)
+        self.assertEqual(
+            set(PatientEntry.objects.values_list("id", flat=True)),
+            {active.id, recent.id},
+        )
+        self.assertEqual(
+            set(ArchivedPatientEntry.objects.values_list("id", flat=True)),
+            {completed.id, cancelled.id},
+        )
+        self.assertFalse(Baby.objects.exists())
+
+        archived_entry = ArchivedPatientEntry.objects.get(id=completed.id)
+        self.assertEqual(archived_entry.surname, "Completed")
+        self.assertEqual(archived_entry.created_at, completed.created_at)
+        self.assertEqual(
+            list(archived_entry.entry_babies.values_list("baby_number", flat=True)), [1]
+        )
+        self.assertEqual(ArchivedBaby.objects.count(), 1)
+
+    def test_get_patient_entry(self):
+        completed = self.create_patient_entry(
+            "Completed", 40, completion_time=timezone.now()
+        )
+        active = self.create_patient_entry("Active", 40)
+        archive_patient_entries(timezone.now())
+
+        self.assertIsInstance(get_patient_entry(active.id), PatientEntry)
+        self.assertIsInstance(get_patient_entry(completed.id), ArchivedPatientEntry)
+        with self.assertRaises(PatientEntry.DoesNotExist):
+            get_patient_entry(completed.id + active.id)
+
+    def test_get_all_patient_entry_values(self):
+        self.create_patient_entry("Completed", 40, completion_time=timezone.now())
+        self.create_patient_entry("Active", 40)
+        archive_patient_entries(timezone.now())
+
+        self.assertEqual(
+            sorted(v["surname"] for v in get_all_patient_entry_values("surname")),
+            ["Active", "Completed"],
+        )
+
+
+class GetBoardUpdateTest(TestCase):
+    def setUp(self):
+        self.first = PatientEntry.objects.create(surname="First", urgency=2)
+        self.second = PatientEntry.objects.create(surname="Second", urgency=3)
+
+    def get_version(self):
+        return serialise_board_version(get_board_version())
+
+    def test_current_version(self):
+        self.assertIsNone(get_board_update(self.get_version()))
+
+    def test_no_version(self):
+        old_version = {"last_updated": None, "rollover": self.get_version()["rollover"]}
+        for version in (None, {}, {"version": "latest", "rollover": ""}, old_version):
+            update = get_board_update(version)
+            self.assertEqual(update["type"], "snapshot")
+            self.assertEqual(update["version"], self.get_version())
+            self.assertEqual(
+                [entry["surname"] for entry in update["entries"]], ["First", "Second"]
+            )
+
+    def test_delta(self):
+        version = self.get_version()
+
+        self.second.urgency = 1
+        self.second.save()
+        update = get_board_update(version)
+
+        self.assertEqual(update["type"], "delta")
+        self.assertEqual(update["version"], self.get_version())
+        self.assertEqual([entry["id"] for entry in update["entries"]], [self.second.id])
+        self.assertEqual(update["entries"][0]["urgency"], 1)
+        self.assertEqual(update["order"], [self.second.id, self.first.id])
+
+    def test_delta_removed_row(self):
+        version = self.get_version()
+        self.first.delete()
+        update = get_board_update(version)
+
+        self.assertEqual(update["type"], "delta")
+        self.assertEqual(update["entries"], [])
+        self.assertEqual(update["order"], [self.second.id])
+
+    def test_delta_change_stamped_earlier(self):
+        version = self.get_version()
+
+        # Stamped before the newest row, but saved after it, as a write that
+        # took a while to commit would be
+        with freeze_time(timezone.now() - timezone.timedelta(minutes=1)):
+            self.first.urgency = 1
+            self.first.save()
+        self.assertNotEqual(self.get_version(), version)
+        update = get_board_update(version)
+
+        self.assertEqual(update["type"], "delta")
+        self.assertEqual([entry["id"] for entry in update["entries"]], [self.first.id])
+
+    def test_rollover_since_version(self):
+        with freeze_time(timezone.now() - timezone.timedelta(days=1)):
+            version = self.get_version()
+
+        self.assertEqual(get_board_update(version)["type"], "snapshot")
+
+
+class SerialiseBoardEntryTest(TestCase):
+    @freeze_time("2019-08-01 08:00")
+    def test_serialise_board_entry(self):
+        entry = PatientEntry.objects.create(
+            surname="Jane",
+            location="Labour Ward",
+            urgency=2,
+            decision_time=timezone.now(),
+            completion_time=timezone.now(),
+        )
+
+        self.assertEqual(
+            serialise_board_entry(entry),
+            {
+                "id": entry.id,
+                "surname": "Jane",
+                "operation": "CS",
+                "location": "Labour Ward",
+                "indication": None,
+                "decision_time": timezone.localtime().strftime("%H:%M"),
+                "clinician": None,
+                "urgency": 2,
+                "completed": True,
+            },
+        )
+
+
+class RenderBoardRowsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_render_board_rows(self):
+        first = PatientEntry.objects.create(surname="First")
+        second = PatientEntry.objects.create(surname="Second")
+
+        rows = render_board_rows([second, first])
+        self.assertLess(rows.index("Second"), rows.index("First"))
+        self.assertIn('data-id="{}"'.format(first.id), rows)
+
+    def test_unchanged_rows_not_rendered_again(self):
+        entry = PatientEntry.objects.create(surname="Jane")
+        render_board_rows([entry])
+
+        # update() doesn't change updated_at, so the cached row is used
+        PatientEntry.objects.filter(id=entry.id).update(surname="Changed")
+        entry.refresh_from_db()
+        self.assertIn("Jane", render_board_rows([entry]))
+
+        entry.save()
+        self.assertIn("Changed", render_board_rows([entry]))
+
+
+class BoardRowTest(TestCase):
+    def get_row(self, entry):
+        return BoardRow.objects.filter(id=entry.id).first()
+
+    def test_board_row_follows_patient_entry(self):
+        entry, _ = save_model({"surname": "Jane", "urgency": "2"})
+        row = self.get_row(entry)
+        self.assertEqual((row.surname, row.urgency), ("Jane", 2))
+
+        save_model_changes({"patient_id": entry.id, "surname": "Janet"})
+        self.assertEqual(self.get_row(entry).surname, "Janet")
+
+        entry.refresh_from_db()
+        entry.operation_cancelled = True
+        entry.save()
+        self.assertIsNone(self.get_row(entry))
+
+        entry.operation_cancelled = False
+        entry.save()
+        entry.delete()
+        self.assertFalse(BoardRow.objects.exists())
+
+    def test_board_row_order(self):
+        completed = PatientEntry.objects.create(
+            surname="Completed", urgency=1, completion_time=timezone.now()
+        )
+        cold = PatientEntry.objects.create(surname="Cold", urgency=4)
+        first = PatientEntry.objects.create(
+            surname="First",
+            urgency=1,
+            decision_time=timezone.now() - timezone.timedelta(hours=1),
+        )
+        second = PatientEntry.objects.create(surname="Second", urgency=1)
+
+        self.assertEqual(
+            list(BoardRow.objects.values_list("id", flat=True)),
+            [first.id, second.id, cold.id, completed.id],
+        )
+
+    @freeze_time("2019-08-01 08:00")
+    def test_completed_rows_removed_at_rollover(self):
+        entry = PatientEntry.objects.create(
+            surname="Jane", completion_time=timezone.now()
+        )
+
+        with freeze_time("2019-08-02 08:00"):
+            update_board_windows()
+        self.assertIsNone(self.get_row(entry))
+
+    def test_rebuild_board_rows(self):
+        PatientEntry.objects.bulk_create(
+            [
+                PatientEntry(surname="Jane"),
+                PatientEntry(surname="Cancelled", operation_cancelled=True),
+            ]
+        )
+        self.assertFalse(BoardRow.objects.exists())
+
+        rebuild_board_rows()
+        self.assertEqual(
+            list(BoardRow.objects.values_list("surname", flat=True)), ["Jane"]
+        )
+
+
+class BoardSitesTest(TestCase):
+    def setUp(self):
+        self.board = Board.objects.create(slug="other", name="Other site")
+
+    def test_entries_only_on_their_board(self):
+        entry, _ = save_model({"surname": "Jane"})
+        other, _ = save_model({"surname": "Other"}, self.board)
+
+        self.assertEqual(
+            [row.id for row in get_all_active_patient_entries()], [entry.id]
+        )
+        self.assertEqual(
+            [row.id for row in get_all_active_patient_entries(board=self.board)],
+            [other.id],
+        )
+
+        version = get_board_version(self.board)
+        save_model({"surname": "Janet"})
+        self.assertEqual(get_board_version(self.board), version)
+
+    def test_get_user_board(self):
+        user = User.objects.create_user("nurse")
+        self.assertEqual(get_user_board(user), Board.get_default())
+
+        Profile.objects.create(user=user, board=self.board)
+        self.assertEqual(get_user_board(user), self.board)
+        self.assertEqual(self.board.get_group_name(), "board-other")
+
+
+@override_settings(
+    CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+)
+class SendConsumersTableMetricsTest(TestCase):
+    def get_count(self, name):
+        return REGISTRY.get_sample_value(name) or 0
+
+    def test_broadcast_metrics(self):
+        PatientEntry.objects.create(surname="Jane")
+        PatientEntry.objects.create(surname="John")
+        renders = self.get_count("momkhulu_board_broadcast_render_seconds_count")
+        sends = self.get_count("momkhulu_board_broadcast_send_seconds_count")
+
+        send_consumers_table()
+
+        self.assertEqual(
+            self.get_count("momkhulu_board_broadcast_render_seconds_count"), renders + 1
+        )
+        self.assertEqual(
+            self.get_count("momkhulu_board_broadcast_send_seconds_count"), sends + 1
+        )
+        self.assertEqual(
+            REGISTRY.get_sample_value("momkhulu_board_rows", {"board": "default"}), 2
+        )
+
+    @override_settings(CHANNEL_LAYER_BACKEND="memory", PROCESS_ROLE="worker")
+    def test_not_sent_from_worker_with_memory_layer(self):
+        sends = self.get_count("momkhulu_board_broadcast_send_seconds_count")
+
+        send_consumers_table()
+
+        self.assertEqual(
+            self.get_count("momkhulu_board_broadcast_send_seconds_count"), sends
+        )
@@ -1,20 +1,38 @@
 import json
+import os
+import tempfile
+from io import StringIO
 from os import environ
 
 import responses
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.test import Client, TestCase
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import Client, TestCase, TransactionTestCase
 from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 from freezegun import freeze_time
 from mock import patch
+from prometheus_client import REGISTRY
 from rest_framework import status
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient, APITestCase
 
-from cspatients.models import Baby, PatientEntry, Profile
+from cspatients import writequeue
+from cspatients.models import (
+    ArchivedPatientEntry,
+    Baby,
+    Board,
+    BoardRow,
+    OutboxMessage,
+    PatientEntry,
+    Profile,
+)
+from cspatients.tasks import dispatch_rapidpro_events
+from cspatients.views import apply_queued_write
 
 from .constants import (
     SAMPLE_RP_CHECKLIST_DATA,
@@ -32,6 +50,7 @@ from .constants import (
     SAMPLE_RP_UPDATE_INVALID_DATA,
     SAMPLE_RP_UPDATE_NONDELIVERY_DATA,
     SAMPLE_RP_UPDATE_URGENCY_DATA,
+    rp_results,
 )
 
 
@@ -144,11 +163,65 @@ class ViewTest(TestCase):
         )
         self.assertTemplateUsed(response=response, template_name="cspatients/view.html")
 
-        mock_get_patients.assert_called_with("1234", "1")
+        mock_get_patients.assert_called_with("1234", "1", Board.get_default())
+
+    def test_get_view_not_modified(self):
+        """
+            A conditional request for an unchanged board isn't rendered again
+        """
+        PatientEntry.objects.create(surname="Jane")
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("cspatient_view"))
+        self.assertTrue(response.has_header("ETag"))
+        self.assertIn("private", response["Cache-Control"])
+
+        with patch("cspatients.util.get_all_active_patient_entries") as mock_get:
+            response = self.client.get(
+                reverse("cspatient_view"), HTTP_IF_NONE_MATCH=response["ETag"]
+            )
+        self.assertEqual(response.status_code, 304)
+        mock_get.assert_not_called()
+
+    def test_get_view_modified(self):
+        """
+            Changing or removing an entry on the board changes the ETag
+        """
+        entry = PatientEntry.objects.create(surname="Jane")
+        self.client.force_login(self.user)
+        etag = self.client.get(reverse("cspatient_view"))["ETag"]
+
+        entry.urgency = 1
+        entry.save()
+        response = self.client.get(reverse("cspatient_view"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        etag = response["ETag"]
+        entry.delete()
+        response = self.client.get(reverse("cspatient_view"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_get_view_modified_by_earlier_change(self):
+        """
+            A change stamped before the newest entry, but saved after it,
+            changes the ETag
+        """
+        entry = PatientEntry.objects.create(surname="Jane")
+        PatientEntry.objects.create(surname="Janet")
+        self.client.force_login(self.user)
+        etag = self.client.get(reverse("cspatient_view"))["ETag"]
+
+        with freeze_time(timezone.now() - timezone.timedelta(minutes=1)):
+            entry.urgency = 1
+            entry.save()
+        response = self.client.get(reverse("cspatient_view"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
 
 
 class PatientViewTest(TestCase):
     def setUp(self):
+        cache.clear()
+        self.board = Board.get_default()
         self.client = Client()
         self.user = User.objects.create_user(username="Itai")
         self.client.force_login(self.user)
@@ -177,6 +250,67 @@ class PatientViewTest(TestCase):
         )
         self.assertInHTML("Jane", str(response.content))
 
+    def test_view_archived_patiententry(self):
+        ArchivedPatientEntry.objects.create(
+            id=7,
+            board=Board.get_default(),
+            surname="Jane",
+            completion_time=timezone.now(),
+            created_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
+
+        response = self.client.get(
+            reverse("cspatient_patient", kwargs={"patient_id": 7})
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertInHTML("Jane", str(response.content))
+
+    def test_view_patiententry_queries(self):
+        jane = PatientEntry.objects.create(surname="Jane")
+        Baby.objects.create(
+            patiententry=jane, baby_number=1, delivery_time=timezone.now()
+        )
+        url = reverse("cspatient_patient", kwargs={"patient_id": jane.id})
+
+        # Session, user, the user's board and the default board, version,
+        # patient entry and babies
+        with self.assertNumQueries(7):
+            self.client.get(url)
+        # The details are cached until the patient entry changes
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertContains(response, "Baby 1")
+
+    def test_view_non_existing_patient_queries(self):
+        # Session, user, the user's board and the default board, and the
+        # current and archived patient entries
+        with self.assertNumQueries(6):
+            self.client.get(reverse("cspatient_patient", kwargs={"patient_id": "123"}))
+
+    def test_view_patiententry_baby_added(self):
+        jane = PatientEntry.objects.create(surname="Jane")
+        url = reverse("cspatient_patient", kwargs={"patient_id": jane.id})
+        self.assertNotContains(self.client.get(url), "Baby 1")
+
+        Baby.objects.create(
+            patiententry=jane, baby_number=1, delivery_time=timezone.now()
+        )
+        self.assertContains(self.client.get(url), "Baby 1")
+
+    def test_view_patiententry_not_modified(self):
+        jane = PatientEntry.objects.create(surname="Jane")
+        url = reverse("cspatient_patient", kwargs={"patient_id": jane.id})
+        etag = self.client.get(url)["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        jane.urgency = 1
+        jane.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
 
 # API Tests
 class AuthenticatedAPITestCase(TestCase):
@@ -200,8 +334,7 @@ class AuthenticatedAPITestCase(TestCase):
 
 
 class NewPatientAPITestCase(AuthenticatedAPITestCase):
-    @patch("cspatients.tasks.send_wa_group_message.delay")
-    def test_new_patient_entry_saves_minimum_data(self, mock_group_send):
+    def test_new_patient_entry_saves_minimum_data(self):
         response = self.normalclient.post(
             reverse("rp_newpatiententry"), SAMPLE_RP_POST_DATA, format="json"
         )
@@ -229,10 +362,14 @@ class NewPatientAPITestCase(AuthenticatedAPITestCase):
             "You can now view her entry here: http://testserver/"
         )
 
-        mock_group_send.assert_called_with(message)
+        outbox_message = OutboxMessage.objects.get()
+        self.assertEqual(outbox_message.message_type, OutboxMessage.WA_GROUP)
+        self.assertEqual(
+            outbox_message.get_payload(), {"body": message, "group_id": "the-group-id"}
+        )
+        self.assertEqual(outbox_message.idempotency_key, f"new-patient-{entry.id}")
 
-    @patch("cspatients.tasks.send_wa_group_message.delay")
-    def test_new_patient_entry_no_consent(self, mock_group_send):
+    def test_new_patient_entry_no_consent(self):
         response = self.normalclient.post(
             reverse("rp_newpatiententry"), SAMPLE_RP_POST_NO_CONSENT_DATA, format="json"
         )
@@ -257,7 +394,12 @@ class NewPatientAPITestCase(AuthenticatedAPITestCase):
             "You can now view her entry here: http://testserver/"
         )
 
-        mock_group_send.assert_called_with(message)
+        outbox_message = OutboxMessage.objects.get()
+        self.assertEqual(outbox_message.message_type, OutboxMessage.WA_GROUP)
+        self.assertEqual(
+            outbox_message.get_payload(), {"body": message, "group_id": "the-group-id"}
+        )
+        self.assertEqual(outbox_message.idempotency_key, f"new-patient-{entry.id}")
 
     def test_new_patient_entry_without_auth(self):
         response = self.client.post(
@@ -275,6 +417,23 @@ class NewPatientAPITestCase(AuthenticatedAPITestCase):
         self.assertEqual(response.json()["errors"], "Surname is required")
 
 
+class NewPatientMessageTest(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user("rapidpro"))
+
+    @patch("cspatients.views.broadcast_board_update")
+    @patch("cspatients.views.send_wa_group_digest")
+    def test_message_sent_without_waiting(self, mock_digest, mock_broadcast):
+        response = self.client.post(
+            reverse("rp_newpatiententry"), SAMPLE_RP_POST_DATA, format="json"
+        )
+
+        self.assertEqual(response.status_code, 201)
+        mock_digest.delay.assert_called_once_with()
+        mock_digest.apply_async.assert_not_called()
+
+
 class CheckPatientExistsAPITestCase(AuthenticatedAPITestCase):
     @freeze_time("2019-01-01")
     def setUp(self):
@@ -313,9 +472,31 @@ class CheckPatientExistsAPITestCase(AuthenticatedAPITestCase):
                 "operation_cancelled": False,
                 "anesthetic_time": None,
                 "starvation_hours": None,
+                "version": 0,
             },
         )
 
+    def test_patient_exists_timed(self):
+        labels = {"endpoint": "rp_patientexits"}
+        names = (
+            "momkhulu_rapidpro_results_seconds_count",
+            "momkhulu_rapidpro_serialise_seconds_count",
+        )
+        before = [REGISTRY.get_sample_value(name, labels) or 0 for name in names]
+
+        SAMPLE_RP_POST_DATA["results"]["patient_id"] = {
+            "category": "All Responses",
+            "value": str(self.patient_entry.id),
+        }
+        self.normalclient.post(
+            reverse("rp_patientexits"), SAMPLE_RP_POST_DATA, format="json"
+        )
+
+        self.assertEqual(
+            [REGISTRY.get_sample_value(name, labels) for name in names],
+            [count + 1 for count in before],
+        )
+
     def test_patient_exists_not_found(self):
         response = self.normalclient.post(
             reverse("rp_patientexits"), SAMPLE_RP_POST_DATA_NON_EXISTING, format="json"
@@ -379,6 +560,20 @@ class UpdatePatientEntryAPITestCase(AuthenticatedAPITestCase):
         self.patiententry.refresh_from_db()
         self.assertEqual(self.patiententry.urgency, 1)
 
+    def test_update_patient_conflict(self):
+        data = rp_results(
+            patient_id=self.patiententry.id, new_value="Nyasha", version="3"
+        )
+        data["results"]["change_category"] = {"category": "surname", "value": "1"}
+
+        response = self.normalclient.post(
+            reverse("rp_entrychanges"), data, format="json"
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.patiententry.refresh_from_db()
+        self.assertEqual(self.patiententry.surname, "Doe")
+
     def test_update_patient_invalid_data(self):
         response = self.normalclient.post(
             reverse("rp_entrychanges"), SAMPLE_RP_UPDATE_INVALID_DATA, format="json"
@@ -642,6 +837,391 @@ class EntryStatusUpdateTestCase(AuthenticatedAPITestCase):
         self.assertEqual(response.status_code, 401)
 
 
+class BulkEntryStatusUpdateTestCase(AuthenticatedAPITestCase):
+    def setUp(self):
+        super(BulkEntryStatusUpdateTestCase, self).setUp()
+        self.patient_entry = PatientEntry.objects.create(surname="Jane Doe", age=20)
+
+    def delivery(self, baby_number, **values):
+        return rp_results(
+            "Delivery",
+            patient_id=self.patient_entry.id,
+            foetus=2,
+            baby_number=baby_number,
+            delivery_time="2019-05-12 10:22+00:00",
+            **values,
+        )
+
+    @patch("cspatients.views.broadcast_board_update")
+    def test_twins_delivered(self, mock_broadcast):
+        Baby.objects.create(
+            patiententry=self.patient_entry, baby_number=1, delivery_time=timezone.now()
+        )
+
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update_bulk"),
+            {"updates": [self.delivery(1, apgar_1=7), self.delivery(2, nicu="Yes")]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        mock_broadcast.assert_called_once_with(self.patient_entry.board_id)
+
+        self.patient_entry.refresh_from_db()
+        self.assertEqual(self.patient_entry.foetus, 2)
+        self.assertIsNotNone(self.patient_entry.completion_time)
+        self.assertEqual(
+            list(
+                self.patient_entry.entry_babies.order_by("baby_number").values_list(
+                    "baby_number", "apgar_1", "nicu"
+                )
+            ),
+            [(1, 7, None), (2, None, True)],
+        )
+        self.assertEqual(
+            BoardRow.objects.get(id=self.patient_entry.id).completion_time,
+            self.patient_entry.completion_time,
+        )
+
+    def test_several_patients(self):
+        other = PatientEntry.objects.create(surname="Mary Doe", age=30)
+
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update_bulk"),
+            {
+                "updates": [
+                    rp_results("ChangeOrCancel", patient_id=self.patient_entry.id),
+                    rp_results(
+                        "Completed",
+                        patient_id=other.id,
+                        completion_time="2019-05-12 10:22+00:00",
+                    ),
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.patient_entry.refresh_from_db()
+        other.refresh_from_db()
+        self.assertTrue(self.patient_entry.operation_cancelled)
+        self.assertEqual(
+            other.completion_time,
+            timezone.datetime(2019, 5, 12, 10, 22, tzinfo=timezone.utc),
+        )
+
+    def test_nothing_saved_if_a_patient_does_not_exist(self):
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update_bulk"),
+            {"updates": [self.delivery(1), rp_results("ChangeOrCancel", patient_id=0)]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Baby.objects.exists())
+
+    def test_version_conflict(self):
+        self.patient_entry.version = 1
+        self.patient_entry.save()
+
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update_bulk"),
+            {"updates": [self.delivery(1, version=1), self.delivery(2, version=0)]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Baby.objects.exists())
+
+    def test_bad_option(self):
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update_bulk"),
+            {"updates": [rp_results("GobbledyGook", patient_id=self.patient_entry.id)]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+class BulkUpdatePatientEntryTestCase(AuthenticatedAPITestCase):
+    def change(self, patient_entry, category, value):
+        data = rp_results(patient_id=patient_entry.id, new_value=value)
+        data["results"]["change_category"] = {"category": category, "value": "1"}
+        return data
+
+    @patch("cspatients.views.broadcast_board_update")
+    def test_changes_saved(self, mock_broadcast):
+        jane = PatientEntry.objects.create(surname="Jane", age=20)
+        mary = PatientEntry.objects.create(surname="Mary", age=30)
+
+        response = self.normalclient.post(
+            reverse("rp_entrychanges_bulk"),
+            {
+                "changes": [
+                    self.change(jane, "surname", "Janet"),
+                    self.change(jane, "urgency", "1"),
+                    self.change(mary, "location", "Theatre 2"),
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["errors"], "")
+        self.assertEqual(
+            [p["surname"] for p in response.json()["patients"]], ["Janet", "Mary"]
+        )
+        mock_broadcast.assert_called_once_with(jane.board_id)
+
+        jane.refresh_from_db()
+        self.assertEqual((jane.surname, jane.urgency), ("Janet", 1))
+        self.assertEqual(BoardRow.objects.get(id=mary.id).location, "Theatre 2")
+
+    def test_patient_not_found(self):
+        jane = PatientEntry.objects.create(surname="Jane", age=20)
+        missing = PatientEntry(id=0)
+
+        response = self.normalclient.post(
+            reverse("rp_entrychanges_bulk"),
+            {
+                "changes": [
+                    self.change(jane, "surname", "Janet"),
+                    self.change(missing, "surname", "Mary"),
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"], "Patient entry does not exist")
+        jane.refresh_from_db()
+        self.assertEqual(jane.surname, "Jane")
+
+
+class OtherBoardTestCase(AuthenticatedAPITestCase):
+    """
+    Users only see and change the patient entries on their own site's board.
+    """
+
+    def setUp(self):
+        super(OtherBoardTestCase, self).setUp()
+        self.other_board = Board.objects.create(slug="other", name="Other site")
+        self.entry = PatientEntry.objects.create(
+            surname="Jane", age=20, board=self.other_board
+        )
+
+    def change(self, category, value):
+        data = rp_results(patient_id=self.entry.id, new_value=value)
+        data["results"]["change_category"] = {"category": category, "value": "1"}
+        return data
+
+    def complete(self):
+        return rp_results(
+            "Completed",
+            patient_id=self.entry.id,
+            completion_time="2019-05-12 10:22+00:00",
+        )
+
+    def assert_unchanged(self):
+        self.entry.refresh_from_db()
+        self.assertEqual((self.entry.surname, self.entry.version), ("Jane", 0))
+        self.assertIsNone(self.entry.completion_time)
+
+    def test_board_shows_site_name(self):
+        self.client.force_login(self.normaluser)
+        response = self.client.get(reverse("cspatient_view"))
+        self.assertContains(response, Board.get_default().name)
+
+        Profile.objects.filter(user=self.normaluser).update(board=self.other_board)
+        self.assertContains(self.client.get(reverse("cspatient_view")), "Other site")
+
+    def test_patient_page(self):
+        self.client.force_login(self.normaluser)
+        url = reverse("cspatient_patient", kwargs={"patient_id": self.entry.id})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        Profile.objects.filter(user=self.normaluser).update(board=self.other_board)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_patient_exists(self):
+        response = self.normalclient.post(
+            reverse("rp_patientexits"),
+            rp_results(patient_id=self.entry.id),
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_entry_changes(self):
+        response = self.normalclient.post(
+            reverse("rp_entrychanges"), self.change("surname", "Janet"), format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["errors"], "Patient entry does not exist")
+        self.assert_unchanged()
+
+    def test_bulk_entry_changes(self):
+        response = self.normalclient.post(
+            reverse("rp_entrychanges_bulk"),
+            {"changes": [self.change("surname", "Janet")]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assert_unchanged()
+
+    def test_entry_status(self):
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update"), self.complete(), format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assert_unchanged()
+
+    def test_bulk_entry_status(self):
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update_bulk"),
+            {"updates": [self.complete()]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assert_unchanged()
+
+    @patch("cspatients.views.broadcast_board_update")
+    def test_own_board(self, mock_broadcast):
+        Profile.objects.filter(user=self.normaluser).update(board=self.other_board)
+
+        response = self.normalclient.post(
+            reverse("rp_entrychanges"), self.change("surname", "Janet"), format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update"), self.complete(), format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.surname, "Janet")
+        self.assertIsNotNone(self.entry.completion_time)
+
+
+class QueuedWritesTestCase(AuthenticatedAPITestCase):
+    def setUp(self):
+        super(QueuedWritesTestCase, self).setUp()
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            WRITE_QUEUE_PATH=os.path.join(directory.name, "queue.jsonl")
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def post_new_patient(self, surname):
+        return self.normalclient.post(
+            reverse("rp_newpatiententry"),
+            rp_results(surname=surname, decision_time="2019-05-12 12:22+02:00"),
+            format="json",
+        )
+
+    def test_writes_queued_while_database_unavailable(self):
+        with patch("cspatients.views.create_patient_entry") as mock_create:
+            mock_create.side_effect = OperationalError()
+            response = self.post_new_patient("Jane")
+
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(PatientEntry.objects.exists())
+
+        self.client.force_login(self.normaluser)
+        response = self.client.get(reverse("cspatient_view"))
+        self.assertEqual(response.context["pending_writes"], 1)
+
+        # Once the database is back the queued write is saved first
+        response = self.post_new_patient("Mary")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(PatientEntry.objects.order_by("id").values_list("surname", flat=True)),
+            ["Jane", "Mary"],
+        )
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+
+    def test_status_update_queued(self):
+        patient_entry = PatientEntry.objects.create(surname="Jane")
+        data = rp_results("ChangeOrCancel", patient_id=patient_entry.id)
+
+        with patch("cspatients.views.update_entry_status") as mock_update:
+            mock_update.side_effect = OperationalError()
+            response = self.normalclient.post(
+                reverse("rp_entrystatus_update"), data, format="json"
+            )
+        self.assertEqual(response.status_code, 202)
+
+        response = self.normalclient.post(
+            reverse("rp_entrystatus_update"), data, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        patient_entry.refresh_from_db()
+        self.assertTrue(patient_entry.operation_cancelled)
+
+    def database_unavailable(self):
+        return patch(
+            "rest_framework.authentication.TokenAuthentication.authenticate_credentials",
+            side_effect=OperationalError(),
+        )
+
+    def test_queued_with_cached_token_while_database_unavailable(self):
+        # The token is remembered once it has been checked
+        self.assertEqual(self.post_new_patient("Jane").status_code, 201)
+
+        with self.database_unavailable(), patch(
+            "cspatients.views.create_patient_entry", side_effect=OperationalError()
+        ):
+            response = self.post_new_patient("Mary")
+
+        self.assertEqual(response.status_code, 202)
+        with writequeue.locked_queue() as f:
+            [write] = writequeue.read_writes(f)
+        self.assertEqual(write["id"], response.json()["queued"])
+        self.assertEqual(write["user_id"], self.normaluser.pk)
+
+        self.assertEqual(self.post_new_patient("Anne").status_code, 201)
+        self.assertEqual(
+            list(PatientEntry.objects.order_by("id").values_list("surname", flat=True)),
+            ["Jane", "Mary", "Anne"],
+        )
+
+    def test_unchecked_token_rejected_while_database_unavailable(self):
+        with self.database_unavailable():
+            response = self.post_new_patient("Jane")
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(writequeue.get_pending_count(), 0)
+
+    def test_revoked_token_forgotten(self):
+        self.assertEqual(self.post_new_patient("Jane").status_code, 201)
+        self.normaltoken.delete()
+        self.assertEqual(self.post_new_patient("Mary").status_code, 401)
+
+        with self.database_unavailable():
+            response = self.post_new_patient("Anne")
+        self.assertEqual(response.status_code, 503)
+
+    def test_replay_failed_writes(self):
+        with patch("cspatients.views.create_patient_entry") as mock_create:
+            mock_create.side_effect = OperationalError()
+            self.post_new_patient("Jane")
+            mock_create.side_effect = ValueError("Broken")
+            writequeue.replay(apply_queued_write)
+        self.assertEqual(writequeue.get_failed_count(), 1)
+        self.assertFalse(PatientEntry.objects.exists())
+
+        out = StringIO()
+        call_command("replay_failed_writes", stdout=out)
+
+        self.assertEqual(
+            out.getvalue(),
+            "Replayed 1 failed write(s), 0 failed again, 0 still queued\n",
+        )
+        self.assertEqual(PatientEntry.objects.get().surname, "Jane")
+
+
 class WhitelistCheckTestCase(AuthenticatedAPITestCase):
     @patch("cspatients.util.force_bytes")
     @patch("cspatients.util.default_token_generator.make_token")
@@ -730,6 +1310,11 @@ class MultiSelectTestCase(AuthenticatedAPITestCase):
 
 
 class PatientListTestCase(AuthenticatedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        # Board versions start again in each test
+        cache.clear()
+
     def create_patient_entry(
         self, surname, complete=None, urgency=4, operation_cancelled=False
     ):
@@ -777,6 +1362,26 @@ class PatientListTestCase(AuthenticatedAPITestCase):
 
         self.assertEqual(result["list_count"], 4)
 
+    def test_patient_list_in_board_order(self):
+        cold = self.create_patient_entry("Cold")
+        hot = self.create_patient_entry("Hot", urgency=2)
+
+        response = self.normalclient.get(reverse("rp_patient_list"))
+        self.assertEqual(
+            response.json()["patient_list_1"],
+            "1) Hot CS indic1 Orange\n2) Cold CS indic1 Green",
+        )
+
+        cold.urgency = 1
+        cold.save()
+
+        response = self.normalclient.get(reverse("rp_patient_list"))
+        self.assertEqual(
+            response.json()["patient_list_1"],
+            "1) Cold CS indic1 Red\n2) Hot CS indic1 Orange",
+        )
+        self.assertEqual(response.json()["patient_ids"], f"1={cold.id}|2={hot.id}")
+
 
 class PatientSelectTestCase(AuthenticatedAPITestCase):
     def test_patient_select_view(self):
@@ -837,6 +1442,12 @@ class WhatsAppEventListenerTest(APITestCase):
 
         self.assertEqual(response.status_code, 200)
 
+        outbox_message = OutboxMessage.objects.get()
+        self.assertEqual(outbox_message.message_type, OutboxMessage.RAPIDPRO_EVENT)
+
+        # The dispatch is scheduled on commit, which TestCase never does
+        dispatch_rapidpro_events()
+
         rapidpro_call = responses.calls[0]
 
         self.assertEqual(rapidpro_call.request.url, settings.RAPIDPRO_CHANNEL_URL)
@@ -859,6 +1470,15 @@ class WhatsAppEventListenerTest(APITestCase):
         self.client.post(reverse("whatsapp-events"), payload, format="json")
 
         mock_rapidpro_post.assert_not_called()
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_webhook_retry_is_idempotent(self):
+        payload = {"messages": [{"id": "message_id1"}]}
+
+        self.client.post(reverse("whatsapp-events"), payload, format="json")
+        self.client.post(reverse("whatsapp-events"), payload, format="json")
+
+        self.assertEqual(OutboxMessage.objects.count(), 1)
 
 
 class HealthViewTest(APITestCase):
@@ -0,0 +1,103 @@
+import os
+import tempfile
+
+from django.db import OperationalError
+from django.test import TestCase
+from django.test.utils import override_settings
+from prometheus_client import REGISTRY
+
+from cspatients import writequeue
+from cspatients.models import ReplayedWrite
+
+
+class WriteQueueTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings = override_settings(
+            WRITE_QUEUE_PATH=os.path.join(directory.name, "queue.jsonl")
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.applied = []
+
+    def apply(self, write):
+        self.applied.append(write["data"])
+
+    def test_nothing_queued(self):
+        self.assertEqual(writequeue.get_pending_count(), 0)
+        self.assertTrue(writequeue.replay(self.apply))
+        self.assertEqual(self.applied, [])
+
+    def test_replayed_in_order_once(self):
+        writequeue.enqueue("newentry", {"surname": "Jane"}, user_id=1)
+        writequeue.enqueue("newentry", {"surname": "Mary"}, user_id=1)
+        self.assertEqual(writequeue.get_pending_count(), 2)
+
+        self.assertTrue(writequeue.replay(self.apply))
+        self.assertTrue(writequeue.replay(self.apply))
+
+        self.assertEqual(self.applied, [{"surname": "Jane"}, {"surname": "Mary"}])
+        self.assertEqual(writequeue.get_pending_count(), 0)
+        self.assertEqual(ReplayedWrite.objects.count(), 2)
+
+    def test_already_replayed_write_skipped(self):
+        write_id = writequeue.enqueue("newentry", {"surname": "Jane"}, user_id=1)
+        ReplayedWrite.objects.create(id=write_id)
+
+        self.assertTrue(writequeue.replay(self.apply))
+        self.assertEqual(self.applied, [])
+
+    def test_stops_while_database_unavailable(self):
+        writequeue.enqueue("newentry", {"surname": "Jane"}, user_id=1)
+        writequeue.enqueue("newentry", {"surname": "Mary"}, user_id=1)
+
+        def apply(write):
+            if write["data"]["surname"] == "Mary":
+                raise OperationalError()
+            self.apply(write)
+
+        self.assertFalse(writequeue.replay(apply))
+        self.assertEqual(self.applied, [{"surname": "Jane"}])
+        self.assertEqual(writequeue.get_pending_count(), 1)
+
+    def test_failed_write_kept_aside(self):
+        write_id = writequeue.enqueue("unknown", {}, user_id=1)
+        writequeue.enqueue("newentry", {"surname": "Jane"}, user_id=1)
+
+        def apply(write):
+            if write["kind"] == "unknown":
+                raise ValueError("Unknown write")
+            self.apply(write)
+
+        self.assertTrue(writequeue.replay(apply))
+        self.assertEqual(self.applied, [{"surname": "Jane"}])
+        self.assertEqual(writequeue.get_pending_count(), 0)
+        self.assertEqual(writequeue.get_failed_count(), 1)
+
+        with writequeue.locked_queue(path=writequeue.get_failed_path()) as f:
+            [failed] = writequeue.read_writes(f)
+        self.assertEqual(failed["id"], write_id)
+        self.assertTrue(failed["error"].startswith("ValueError("))
+        self.assertIn("Unknown write", failed["error"])
+
+    def test_failed_writes_requeued(self):
+        write_id = writequeue.enqueue("unknown", {}, user_id=1)
+        writequeue.enqueue("newentry", {"surname": "Jane"}, user_id=1)
+
+        def apply(write):
+            if write["kind"] == "unknown":
+                raise ValueError("Unknown write")
+            self.apply(write)
+
+        writequeue.replay(apply)
+        self.assertEqual(REGISTRY.get_sample_value("momkhulu_write_queue_failed"), 1)
+
+        self.assertEqual(writequeue.requeue_failed(), 1)
+        self.assertEqual(writequeue.get_failed_count(), 0)
+        with writequeue.locked_queue() as f:
+            [write] = writequeue.read_writes(f)
+        self.assertEqual(write["id"], write_id)
+        self.assertNotIn("error", write)
+        self.assertEqual(REGISTRY.get_sample_value("momkhulu_write_queue_pending"), 1)
@@ -22,11 +22,21 @@ urlpatterns = [
         views.UpdatePatientEntryView.as_view(),
         name="rp_entrychanges",
     ),
+    path(
+        "api/rpentrychanges/bulk",
+        views.BulkUpdatePatientEntryView.as_view(),
+        name="rp_entrychanges_bulk",
+    ),
     path(
         "api/rpentrystatusupdate",
         views.EntryStatusUpdateView.as_view(),
         name="rp_entrystatus_update",
     ),
+    path(
+        "api/rpentrystatusupdate/bulk",
+        views.BulkEntryStatusUpdateView.as_view(),
+        name="rp_entrystatus_update_bulk",
+    ),
     path(
         "api/rpwhitelistcheck",
         views.WhitelistCheckView.as_view(),
@@ -1,24 +1,79 @@
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
+import hashlib
+import json
+
+from django.conf import settings
 from django.contrib.auth.tokens import default_token_generator
-from django.db.models import Q
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, Q
 from django.template import loader
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
-
-from .models import PatientEntry
+from django.utils.safestring import mark_safe
+
+from . import writequeue
+from .metrics import (
+    board_broadcast_render_duration,
+    board_broadcast_send_duration,
+    board_broadcast_size,
+    board_rows,
+)
+from .models import (
+    ArchivedBaby,
+    ArchivedPatientEntry,
+    Baby,
+    Board,
+    BoardRow,
+    OutboxMessage,
+    PatientEntry,
+)
 from .serializers import PatientEntrySerializer, UpdateEntrySerializer
 
+# The RapidPro results each endpoint needs. Flow results can hold many more.
+RP_RESULT_KEYS = {
+    "patient": ("patient_id",),
+    "entrychanges": ("patient_id", "change_category", "new_value", "version"),
+    "entrystatus": (
+        "patient_id",
+        "version",
+        "option",
+        "foetus",
+        "baby_number",
+        "delivery_time",
+        "apgar_1",
+        "apgar_5",
+        "baby_weight_grams",
+        "nicu",
+        "starvation_hours",
+        "completion_time",
+        "anesthetic_time",
+    ),
+}
+
+
+def get_rp_result_keys(context):
+    if context == "newentry":
+        return [f.name for f in PatientEntry._meta.concrete_fields]
+    return RP_RESULT_KEYS.get(context)
+
 
 def get_rp_dict(data, context=None):
     """
-    Get a label and value dictionary from the request POST
+    Get a label and value dictionary from the request POST. With a context,
+    only the results that context needs are looked up.
     """
+    results = data["results"]
+    keys = get_rp_result_keys(context)
+    if keys is None:
+        items = results.items()
+    else:
+        items = ((key, results[key]) for key in keys if key in results)
+
     all_dict = {}
 
-    for key, item in data["results"].items():
+    for key, item in items:
         """
         All Responses is a category base for responses that are free text
         and not options. If not all All Responses, the label must take
@@ -32,22 +87,291 @@ def get_rp_dict(data, context=None):
     if context == "entrychanges":
         final_dict = {}
         final_dict[all_dict["change_category"]] = all_dict["new_value"]
-        if "patient_id" in all_dict:
-            final_dict["patient_id"] = all_dict["patient_id"]
+        for key in ("patient_id", "version"):
+            if key in all_dict:
+                final_dict[key] = all_dict[key]
         return final_dict
     else:
         return all_dict
 
 
-def get_all_active_patient_entries(search=None, status=None):
-    # At 7am SAST(5am UTC) we hide all completed patients from the previous day
-    last_date = timezone.now().date()
-    if timezone.now().hour < 5:
-        last_date = timezone.now().date() - timezone.timedelta(days=1)
+def get_patient_entry(patient_id):
+    """
+    Gets a patient entry by id, looking in the archive if it isn't in the
+    PatientEntry table any more.
+    """
+    for model in (PatientEntry, ArchivedPatientEntry):
+        try:
+            return model.objects.get(id=patient_id)
+        except model.DoesNotExist:
+            pass
+
+    raise PatientEntry.DoesNotExist
+
+
+def get_patient_entry_version(patient_id, board=None):
+    """
+    The model and last update of a patient entry on the board, or the default
+    board, current or archived, or None if there is no such patient entry.
+    """
+    board = board or get_board()
+    for model in (PatientEntry, ArchivedPatientEntry):
+        updated_at = model.objects.filter(id=patient_id, board=board).values_list(
+            "updated_at", flat=True
+        )
+        for value in updated_at:
+            return model, value
+
+
+def render_patient_details(patient_id, model, updated_at):
+    """
+    The patient details, cached until the patient entry or one of its babies
+    changes.
+    """
+    key = "patient-details:{}:{}".format(patient_id, updated_at.isoformat())
+    details = cache.get(key)
+    if details is None:
+        patiententry = model.objects.prefetch_related("entry_babies").get(id=patient_id)
+        template = loader.get_template("cspatients/patient_details.html")
+        details = template.render({"patiententry": patiententry})
+        cache.set(key, details, settings.PATIENT_DETAILS_CACHE_TIMEOUT)
+    return mark_safe(details)
+
+
+def get_all_patient_entry_values(*fields):
+    """
+    Values for all patient entries, current and archived, for reporting.
+    """
+    if not fields:
+        fields = [f.attname for f in PatientEntry._meta.concrete_fields]
+
+    return PatientEntry.objects.values(*fields).union(
+        ArchivedPatientEntry.objects.values(*fields), all=True
+    )
+
+
+def get_field_values(instance):
+    return {
+        f.attname: getattr(instance, f.attname) for f in instance._meta.concrete_fields
+    }
+
+
+def archive_patient_entries(before, batch_size=500):
+    """
+    Moves the completed and cancelled patient entries that haven't been updated
+    since `before`, and their babies, into the archive tables. Returns the number
+    of entries archived.
+    """
+    archived = 0
+    while True:
+        with transaction.atomic():
+            entries = list(
+                PatientEntry.objects.select_for_update()
+                .filter(
+                    Q(completion_time__isnull=False) | Q(operation_cancelled=True),
+                    updated_at__lt=before,
+                )
+                .order_by("id")[:batch_size]
+            )
+            if not entries:
+                return archived
+
+            ids = [entry.id for entry in entries]
+            ArchivedPatientEntry.objects.bulk_create(
+                ArchivedPatientEntry(**get_field_values(entry)) for entry in entries
+            )
+            ArchivedBaby.objects.bulk_create(
+                ArchivedBaby(**get_field_values(baby))
+                for baby in Baby.objects.filter(patiententry_id__in=ids)
+            )
+            PatientEntry.objects.filter(id__in=ids).delete()
 
-    patiententrys = PatientEntry.objects.filter(operation_cancelled=False).filter(
+        archived += len(entries)
+
+
+def get_board(board_id=None):
+    if board_id is None:
+        return Board.get_default()
+    return Board.objects.get(id=board_id)
+
+
+def get_user_board(user):
+    """
+    The board of the site the user works at.
+    """
+    board = None
+    if user is not None and user.is_authenticated:
+        board = Board.objects.filter(profile__user=user).first()
+    return board or Board.get_default()
+
+
+def get_board_rollover(board=None):
+    """
+    Completed entries are hidden from the board after its daily rollover.
+    Returns the time of the last rollover, as precomputed by the
+    update_board_windows task, unless the task hasn't caught up with it yet.
+    """
+    board = board or get_board()
+    return max(filter(None, (board.visible_from, board.get_last_rollover())))
+
+
+def update_board_windows():
+    """
+    Stores the last rollover of each board, so that the board query compares
+    completion times with a constant. Returns the boards that rolled over.
+    """
+    updated = []
+    for board in Board.objects.all():
+        visible_from = board.get_last_rollover()
+        if board.visible_from != visible_from:
+            board.visible_from = visible_from
+            board.save(update_fields=["visible_from"])
+            updated.append(board)
+
+        delete_board_rows(
+            BoardRow.objects.filter(board=board, completion_time__lt=board.visible_from)
+        )
+    return updated
+
+
+def is_on_board(entry):
+    return not entry.operation_cancelled and (
+        entry.completion_time is None
+        or entry.completion_time >= get_board_rollover(entry.board)
+    )
+
+
+def bump_board_version(board_id):
+    """
+    Moves a board on to its next version, and returns it. Call this inside the
+    transaction that changes the board's rows. The board is locked until that
+    transaction commits, so a change committed later always has a later
+    version.
+    """
+    Board.objects.filter(id=board_id).update(version=F("version") + 1)
+    return Board.objects.values_list("version", flat=True).get(id=board_id)
+
+
+def delete_board_rows(rows):
+    """
+    Deletes the board rows, moving their boards on to a new version.
+    """
+    with transaction.atomic():
+        for board_id in set(rows.values_list("board_id", flat=True)):
+            bump_board_version(board_id)
+        rows.delete()
+
+
+def get_board_row(entry, version):
+    completed = entry.completion_time is not None
+    decision_time = entry.decision_time.astimezone(timezone.utc)
+    return BoardRow(
+        id=entry.id,
+        board_id=entry.board_id,
+        surname=entry.surname,
+        operation=entry.operation,
+        location=entry.location,
+        indication=entry.indication,
+        decision_time=entry.decision_time,
+        clinician=entry.clinician,
+        urgency=entry.urgency,
+        completion_time=entry.completion_time,
+        updated_at=entry.updated_at,
+        version=version,
+        sort_key="{:d}{:d}{:%Y%m%d%H%M%S%f}".format(
+            completed, entry.urgency, decision_time
+        ),
+        rp_list_line="{} {} {} {}".format(
+            entry.surname, entry.operation, entry.indication, entry.get_urgency_color()
+        ),
+    )
+
+
+def update_board_row(entry_id):
+    """
+    Adds, updates or removes the board row of a patient entry that has been
+    saved. The entry is read back, as a saved instance can still hold the
+    unconverted strings it was given.
+    """
+    entry = PatientEntry.objects.filter(id=entry_id).first()
+    if entry is not None and is_on_board(entry):
+        with transaction.atomic():
+            get_board_row(entry, bump_board_version(entry.board_id)).save()
+    else:
+        delete_board_rows(BoardRow.objects.filter(id=entry_id))
+
+
+def update_board_rows(entry_ids):
+    """
+    Adds, updates or removes the board rows of patient entries that were
+    saved without sending signals, for example by bulk_update.
+    """
+    entries = PatientEntry.objects.filter(id__in=entry_ids).select_related("board")
+    with transaction.atomic():
+        versions = {
+            board_id: bump_board_version(board_id)
+            for board_id in {entry.board_id for entry in entries}
+        }
+        BoardRow.objects.filter(id__in=entry_ids).delete()
+        BoardRow.objects.bulk_create(
+            get_board_row(entry, versions[entry.board_id])
+            for entry in entries
+            if is_on_board(entry)
+        )
+
+
+def rebuild_board_rows():
+    """
+    Recreates all the board rows, for patient entries that were changed
+    without sending signals, for example by bulk_create.
+    """
+    with transaction.atomic():
+        BoardRow.objects.all().delete()
+        for board in Board.objects.all():
+            entries = board.patient_entries.filter(operation_cancelled=False).filter(
+                Q(completion_time__isnull=True)
+                | Q(completion_time__gte=get_board_rollover(board))
+            )
+            version = bump_board_version(board.id)
+            BoardRow.objects.bulk_create(
+                get_board_row(entry, version) for entry in entries
+            )
+
+
+def get_board_version(board=None):
+    """
+    A cheap stamp that changes whenever a row on the board is added, changed
+    or removed: the board's version, read from the database as the board may
+    have been loaded a while ago, and its rollover.
+    """
+    board = board or get_board()
+    return {
+        "version": Board.objects.values_list("version", flat=True).get(id=board.id),
+        "rollover": get_board_rollover(board),
+    }
+
+
+def serialise_board_version(version):
+    """
+    The board version as sent to, and sent back by, the board websocket.
+    """
+    return {"version": version["version"], "rollover": version["rollover"].isoformat()}
+
+
+def make_etag(*parts):
+    return hashlib.md5(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def get_all_active_patient_entries(search=None, status=None, board=None):
+    """
+    The board rows, in board order.
+    """
+    board = board or get_board()
+    # Rows completed before the rollover are only here until the
+    # update_board_rollovers task has removed them
+    patiententrys = BoardRow.objects.filter(board=board).filter(
         Q(completion_time__isnull=True)
-        | Q(completion_time__isnull=False, decision_time__gte=last_date)
+        | Q(completion_time__gte=get_board_rollover(board))
     )
 
     if search:
@@ -61,35 +385,204 @@ def get_all_active_patient_entries(search=None, status=None):
                 urgency=status, completion_time__isnull=True
             )
 
-    # oldest most urgent on the top, completed at the bottom
-    return sorted(
-        patiententrys,
-        key=lambda x: (x.completion_time is not None, x.urgency, x.decision_time),
+    return list(patiententrys)
+
+
+def get_rp_patient_list(board):
+    """
+    The ids and list lines of the entries on the board that aren't completed,
+    in board order, for listing in RapidPro flows. Cached until the board
+    changes.
+    """
+    version = get_board_version(board)
+    key = "rp-patient-list:{}:{}".format(
+        board.id, make_etag(version["version"], version["rollover"])
     )
+    rows = cache.get(key)
+    if rows is None:
+        rows = list(
+            BoardRow.objects.filter(board=board, completion_time__isnull=True)
+            .order_by("sort_key")
+            .values_list("id", "rp_list_line")
+        )
+        cache.set(key, rows, settings.BOARD_ROW_CACHE_TIMEOUT)
+    return rows
+
+
+def get_board_row_key(entry):
+    return "board-row:{}:{}".format(entry.id, entry.updated_at.isoformat())
 
 
-def send_consumers_table():
+def render_board_rows(patient_entries):
     """
-        Method to send a rendered templated through to the
-        view channel in the ViewConsumer.
+    The table rows for patient_entries. A row only depends on its entry, so
+    rendered rows are cached by entry and last update, and only the rows that
+    changed since they were last rendered are rendered again.
+    """
+    keys = [get_board_row_key(entry) for entry in patient_entries]
+    rows = cache.get_many(keys)
+
+    template = loader.get_template("cspatients/table_row.html")
+    rendered = {}
+    for key, entry in zip(keys, patient_entries):
+        if key not in rows:
+            rendered[key] = template.render({"patiententry": entry})
+    if rendered:
+        cache.set_many(rendered, settings.BOARD_ROW_CACHE_TIMEOUT)
+        rows.update(rendered)
+
+    return mark_safe("".join(rows[key] for key in keys))
+
+
+def serialise_board_entry(entry):
     """
-    template = loader.get_template("cspatients/table.html")
+    A patient entry as shown on the board, for the board websocket.
+    """
+    decision_time = entry.decision_time
+    if decision_time is not None:
+        decision_time = timezone.localtime(decision_time).strftime("%H:%M")
+
+    return {
+        "id": entry.id,
+        "surname": entry.surname,
+        "operation": entry.operation,
+        "location": entry.location,
+        "indication": entry.indication,
+        "decision_time": decision_time,
+        "clinician": entry.clinician,
+        "urgency": entry.urgency,
+        "completed": entry.completion_time is not None,
+    }
+
+
+def get_board_snapshot(board=None):
+    """
+    All the entries on the board, with the version they were read at.
+    """
+    board = board or get_board()
+    # The version is read first, so a change made while the entries are being
+    # read is sent again to a client resuming from this version
+    version = serialise_board_version(get_board_version(board))
+    return {
+        "type": "snapshot",
+        "version": version,
+        "pending": writequeue.get_pending_count(),
+        "entries": [
+            serialise_board_entry(entry)
+            for entry in get_all_active_patient_entries(board=board)
+        ],
+    }
+
+
+def get_board_update(client_version, board=None):
+    """
+    What a board client that last saw client_version needs to be up to date:
+    None if it is current, a delta of the changed entries and the new order
+    if it saw the board since the last rollover, otherwise a snapshot.
+    """
+    board = board or get_board()
+    version = serialise_board_version(get_board_version(board))
+    if client_version == version:
+        return None
+
+    try:
+        since = int(client_version["version"])
+        resumable = client_version["rollover"] == version["rollover"]
+    except (KeyError, TypeError, ValueError):
+        resumable = False
+    if not resumable:
+        return get_board_snapshot(board)
+
+    patient_entries = get_all_active_patient_entries(board=board)
+    return {
+        "type": "delta",
+        "version": version,
+        "pending": writequeue.get_pending_count(),
+        "entries": [
+            serialise_board_entry(entry)
+            for entry in patient_entries
+            if entry.version > since
+        ],
+        "order": [entry.id for entry in patient_entries],
+    }
+
+
+def dump_board_message(message):
+    return json.dumps(message, separators=(",", ":"))
+
+
+# The board version this process last sent to each board's clients, by board id
+sent_board_versions = {}
+
+
+def send_consumers_table(board_id=None):
+    """
+        Method to send the board entries through to the
+        board's channel group in the ViewConsumer.
+    """
+    if settings.CHANNEL_LAYER_BACKEND == "memory" and settings.PROCESS_ROLE == "worker":
+        # Only the web process can reach its in-memory channel layer. It sends
+        # the board itself once it sees the change, see watch_boards.
+        return
+
+    # Read from the primary, as this runs straight after a commit that the
+    # replica may not have yet
+    with board_broadcast_render_duration.time():
+        board = get_board(board_id)
+        snapshot = get_board_snapshot(board)
+        content = dump_board_message(snapshot)
+
+    board_broadcast_size.observe(len(content.encode()))
+    board_rows.labels(board.slug).set(len(snapshot["entries"]))
+
+    # Only imported by the processes that broadcast, as the channel layer
+    # backend is slow to import
+    from asgiref.sync import async_to_sync
+    from channels.layers import get_channel_layer
+
     channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        "view",
-        {
-            "type": "view.update",
-            "content": template.render(
-                {"patient_entries": get_all_active_patient_entries()}
-            ),
-        },
-    )
+    with board_broadcast_send_duration.time():
+        async_to_sync(channel_layer.group_send)(
+            board.get_group_name(), {"type": "view.update", "content": content}
+        )
+    sent_board_versions[board.id] = snapshot["version"]
+
+
+class ConcurrentUpdateError(Exception):
+    """
+    Raised when a patient entry has been changed since the version a client
+    last saw.
+    """
+
+
+def check_version(patiententry, data):
+    """
+    Clients can send the version of the entry their change is based on. The
+    change is rejected if someone else has changed the entry since.
+    """
+    if data.get("version") not in (None, "") and str(data["version"]) != str(
+        patiententry.version
+    ):
+        raise ConcurrentUpdateError(
+            "Patient entry has been changed by someone else, please try again"
+        )
+
+
+def get_update_fields(entry_data):
+    """
+    The fields to write for a change, so that concurrent changes to other
+    fields of the same entry aren't overwritten.
+    """
+    fields = {f.name for f in PatientEntry._meta.concrete_fields}
+    return sorted(fields.intersection(entry_data)) + ["updated_at", "version"]
 
 
-def save_model_changes(data):
+def save_model_changes(data, board=None):
     """
         The function takes in the request.POST object and saves changes in the
-        PatientEntry model. Returns object and errors
+        PatientEntry model, for an entry on the board or the default board.
+        Returns object and errors. Raises ConcurrentUpdateError if the entry
+        has changed since the version given.
     """
     serializer = UpdateEntrySerializer(data=data)
     if not serializer.is_valid():
@@ -97,26 +590,199 @@ def save_model_changes(data):
 
     entry_data = get_patient_entry_data(data)
 
-    try:
-        patiententry = PatientEntry.objects.get(id=data["patient_id"])
-    except PatientEntry.DoesNotExist:
-        return None, ["Patient entry does not exist"]
+    with transaction.atomic():
+        try:
+            patiententry = PatientEntry.objects.select_for_update().get(
+                id=data["patient_id"], board=board or get_board()
+            )
+        except PatientEntry.DoesNotExist:
+            return None, ["Patient entry does not exist"]
 
-    patiententry.__dict__.update(entry_data)
-    patiententry.save()
+        check_version(patiententry, data)
+        patiententry.__dict__.update(entry_data)
+        patiententry.version += 1
+        patiententry.save(update_fields=get_update_fields(entry_data))
 
     return patiententry, []
 
 
-def save_model(data):
+def get_patient_entries_for_update(patient_ids, board=None):
+    """
+    Locks and returns the patient entries on the board, or the default board,
+    with the given ids, by id as a string. Raises PatientEntry.DoesNotExist if
+    any of them don't exist.
     """
-        Saves model. Returns PatientEntry object.
+    patient_ids = {str(patient_id) for patient_id in patient_ids}
+    entries = {
+        str(entry.id): entry
+        for entry in PatientEntry.objects.select_for_update().filter(
+            id__in=[i for i in patient_ids if can_convert_string_to_int(i)],
+            board=board or get_board(),
+        )
+    }
+    if len(entries) != len(patient_ids):
+        raise PatientEntry.DoesNotExist
+    return entries
+
+
+def save_entries_changes(changes, board=None):
+    """
+    Saves a batch of changes, each in the form taken by save_model_changes, to
+    entries on the board or the default board, in one transaction. Returns the updated entries and errors. Nothing is
+    saved if there are errors, or if any of the entries have changed since the
+    version given.
+    """
+    for data in changes:
+        serializer = UpdateEntrySerializer(data=data)
+        if not serializer.is_valid():
+            return [], get_errors_from_serializer(serializer.errors)
+
+    with transaction.atomic():
+        try:
+            entries = get_patient_entries_for_update(
+                (d["patient_id"] for d in changes), board
+            )
+        except PatientEntry.DoesNotExist:
+            return [], ["Patient entry does not exist"]
+
+        fields = set()
+        for data in changes:
+            entry = entries[str(data["patient_id"])]
+            check_version(entry, data)
+            entry_data = get_patient_entry_data(data)
+            entry.__dict__.update(entry_data)
+            fields.update(get_update_fields(entry_data))
+
+        now = timezone.now()
+        for entry in entries.values():
+            entry.updated_at = now
+            entry.version += 1
+        PatientEntry.objects.bulk_update(entries.values(), fields)
+        entry_ids = [entry.id for entry in entries.values()]
+        update_board_rows(entry_ids)
+
+    # Read back, as the entries can hold the unconverted strings they were given
+    return list(PatientEntry.objects.filter(id__in=entry_ids).order_by("id")), []
+
+
+ENTRY_STATUS_FIELDS = [
+    "foetus",
+    "starvation_hours",
+    "completion_time",
+    "anesthetic_time",
+    "operation_cancelled",
+]
+
+
+def apply_entry_status(patiententry, data):
+    """
+    Applies a status update from RapidPro to a patient entry, without saving
+    it. Returns the fields of the delivered baby, if there is one, and raises
+    ValueError for an unknown option.
+    """
+    if data["option"] == "Delivery":
+        patiententry.foetus = data["foetus"]
+        patiententry.starvation_hours = data.get("starvation_hours")
+
+        if data["baby_number"] == data["foetus"]:
+            patiententry.completion_time = timezone.now()
+
+        baby = {
+            "apgar_1": data.get("apgar_1"),
+            "apgar_5": data.get("apgar_5"),
+            "baby_weight_grams": data.get("baby_weight_grams"),
+            "delivery_time": data["delivery_time"],
+        }
+
+        if "nicu" in data:
+            baby["nicu"] = data["nicu"] == "Yes"
+
+        return baby
+    elif data["option"] == "Completed":
+        patiententry.completion_time = data["completion_time"]
+    elif data["option"] == "NonDelivery":
+        patiententry.anesthetic_time = data["anesthetic_time"]
+        patiententry.completion_time = timezone.now()
+        patiententry.starvation_hours = data.get("starvation_hours")
+    elif data["option"] == "ChangeOrCancel":
+        patiententry.operation_cancelled = True
+    else:
+        raise ValueError("Unknown option {}".format(data["option"]))
+
+
+def save_entry_status_updates(updates, board=None):
+    """
+    Applies a batch of status updates from RapidPro, for one or more patients
+    and babies on the board or the default board, in one transaction. Returns the updated patient entries, and
+    raises ConcurrentUpdateError if any of them have changed since the version
+    given.
+    """
+    with transaction.atomic():
+        entries = get_patient_entries_for_update(
+            (d["patient_id"] for d in updates), board
+        )
+        before = {
+            entry.id: [getattr(entry, field) for field in ENTRY_STATUS_FIELDS]
+            for entry in entries.values()
+        }
+
+        babies = {}
+        for data in updates:
+            entry = entries[str(data["patient_id"])]
+            check_version(entry, data)
+            baby = apply_entry_status(entry, data)
+            if baby is not None:
+                babies.setdefault((entry.id, int(data["baby_number"])), {}).update(baby)
+
+        existing = {
+            (baby.patiententry_id, baby.baby_number): baby
+            for baby in Baby.objects.filter(
+                patiententry_id__in={entry_id for entry_id, _ in babies}
+            )
+        }
+        new, changed, baby_fields = [], [], set()
+        for (entry_id, baby_number), fields in babies.items():
+            baby_fields.update(fields)
+            baby = existing.get((entry_id, baby_number))
+            if baby is None:
+                new.append(
+                    Baby(patiententry_id=entry_id, baby_number=baby_number, **fields)
+                )
+            else:
+                baby.__dict__.update(fields)
+                changed.append(baby)
+        Baby.objects.bulk_create(new)
+        if changed:
+            Baby.objects.bulk_update(changed, baby_fields)
+
+        # Only the fields that changed are written
+        fields = {"updated_at", "version"}
+        now = timezone.now()
+        for entry in entries.values():
+            fields.update(
+                field
+                for field, value in zip(ENTRY_STATUS_FIELDS, before[entry.id])
+                if getattr(entry, field) != value
+            )
+            entry.updated_at = now
+            entry.version += 1
+        PatientEntry.objects.bulk_update(entries.values(), fields)
+        update_board_rows([entry.id for entry in entries.values()])
+
+    return list(entries.values())
+
+
+def save_model(data, board=None):
+    """
+        Saves model on the board, or the default board. Returns PatientEntry
+        object.
     """
     serializer = PatientEntrySerializer(data=data)
     if not serializer.is_valid():
         return None, get_errors_from_serializer(serializer.errors)
 
     entry_data = get_patient_entry_data(data)
+    entry_data["board"] = board or get_board()
 
     return PatientEntry.objects.create(**entry_data), []
 
@@ -142,7 +808,8 @@ def get_patient_entry_data(data):
     patient_entry_fields = [f.name for f in PatientEntry._meta.get_fields()]
 
     for key, value in data.items():
-        if key in patient_entry_fields:
+        # The version is only ever changed when the entry is saved
+        if key in patient_entry_fields and key != "version":
             entry_data[key] = value
 
     if "No Consent" in entry_data.get("surname", ""):
@@ -190,3 +857,98 @@ def build_new_patient_message(patient_data, url):
         "You can now view her entry here: {momkhulu_url}"
     )
     return message_template.format(**patient_data)
+
+
+def build_digest_message(messages):
+    """
+    Combines group messages into a single message, so that a burst of new
+    patients doesn't turn into a burst of WhatsApp messages.
+    """
+    if len(messages) == 1:
+        return messages[0]
+
+    header = f"{len(messages)} patients have been added to the Momkhulu Triage Board."
+    return "\n\n".join([header] + messages)
+
+
+def create_outbox_message(message_type, payload, idempotency_key=None):
+    """
+    Writes a message to the outbox. Call this inside the transaction that makes
+    the change the message is about, so that the message is only sent if the
+    change is committed. A message with an idempotency key is only written once.
+    """
+    if idempotency_key is None:
+        return OutboxMessage.objects.create(
+            message_type=message_type, payload=json.dumps(payload)
+        )
+
+    message, _ = OutboxMessage.objects.get_or_create(
+        idempotency_key=idempotency_key,
+        defaults={"message_type": message_type, "payload": json.dumps(payload)},
+    )
+    return message
+
+
+def claim_outbox_messages(messages, limit=None, in_order=False):
+    """
+    Claims the oldest unclaimed messages for OUTBOX_CLAIM_SECONDS, so that no
+    other dispatcher sends them. The claim is committed before this returns,
+    so no locks are held while the messages are sent. In order, nothing is
+    claimed while the oldest message is claimed by another dispatcher.
+    """
+    now = timezone.now()
+    claim = timezone.timedelta(seconds=settings.OUTBOX_CLAIM_SECONDS)
+    with transaction.atomic():
+        if in_order:
+            oldest = messages.select_for_update().order_by("id").first()
+            if oldest and oldest.claimed_until and oldest.claimed_until >= now:
+                return []
+        claimed = list(
+            messages.select_for_update()
+            .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=now))
+            .order_by("id")[:limit]
+        )
+        OutboxMessage.objects.filter(id__in=[m.id for m in claimed]).update(
+            claimed_until=now + claim
+        )
+    for message in claimed:
+        message.claimed_until = now + claim
+    return claimed
+
+
+def renew_outbox_claim(messages):
+    """
+    Extends the claim on messages for another OUTBOX_CLAIM_SECONDS, so that a
+    dispatcher sending a batch keeps it for as long as it takes. Returns False,
+    renewing nothing, if the claim on any of them has expired and been taken by
+    another dispatcher.
+    """
+    claimed_until = timezone.now() + timezone.timedelta(
+        seconds=settings.OUTBOX_CLAIM_SECONDS
+    )
+    with transaction.atomic():
+        held = OutboxMessage.objects.select_for_update().filter(
+            id__in=[m.id for m in messages],
+            claimed_until__in={m.claimed_until for m in messages},
+        )
+        if len(held) != len(messages):
+            return False
+        OutboxMessage.objects.filter(id__in=[m.id for m in held]).update(
+            claimed_until=claimed_until
+        )
+    for message in messages:
+        message.claimed_until = claimed_until
+    return True
+
+
+def release_outbox_messages(messages, **kwargs):
+    """
+    Gives up the claim on messages, updating them with `kwargs`.
+    """
+    OutboxMessage.objects.filter(id__in=[m.id for m in messages]).update(
+        claimed_until=None, **kwargs
+    )
+
+
+def get_payload_digest(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
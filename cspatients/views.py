@@ -3,22 +3,73 @@ from os import environ
 import requests
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
 from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 from django.template import loader
-from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from cspatients import util
+from cspatients import util, writequeue
 
-from .models import Baby, PatientEntry, Profile
-from .tasks import post_patient_update, send_rapidpro_event, send_wa_group_message
+from .metrics import rapidpro_results_duration, rapidpro_serialise_duration
+from .models import OutboxMessage, PatientEntry, Profile
+from .tasks import (
+    broadcast_board_update,
+    dispatch_rapidpro_events,
+    send_wa_group_digest,
+)
+
+
+def get_board(request):
+    if not hasattr(request, "board"):
+        request.board = util.get_user_board(request.user)
+    return request.board
+
+
+def get_board_version(request):
+    if not hasattr(request, "board_version"):
+        request.board_version = util.get_board_version(get_board(request))
+    return request.board_version
+
+
+def board_etag(request):
+    version = get_board_version(request)
+    return util.make_etag(
+        version["version"],
+        version["rollover"],
+        writequeue.get_pending_count(),
+        request.user.pk,
+        request.GET.urlencode(),
+        settings.ETAG_SALT,
+    )
+
+
+def get_patient_version(request, patient_id):
+    if not hasattr(request, "patient_version"):
+        request.patient_version = util.get_patient_entry_version(
+            patient_id, get_board(request)
+        )
+    return request.patient_version
+
+
+def patient_etag(request, patient_id):
+    version = get_patient_version(request, patient_id)
+    if version is not None:
+        return util.make_etag(
+            patient_id, version[1], request.user.pk, settings.ETAG_SALT
+        )
 
 
 @login_required()
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=board_etag)
 def view(request):
     template = loader.get_template("cspatients/view.html")
     search = None
@@ -30,7 +81,12 @@ def view(request):
         status = request.GET["status"]
 
     context = {
-        "patient_entries": util.get_all_active_patient_entries(search, status),
+        "board": get_board(request),
+        "board_version": util.serialise_board_version(get_board_version(request)),
+        "board_rows": util.render_board_rows(
+            util.get_all_active_patient_entries(search, status, get_board(request))
+        ),
+        "pending_writes": writequeue.get_pending_count(),
         "search": search or "",
         "status": status or "0",
         "user": request.user,
@@ -39,17 +95,20 @@ def view(request):
 
 
 @login_required()
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=patient_etag)
 def patient(request, patient_id):
     template = loader.get_template("cspatients/patient.html")
     context = {"user": request.user}
     status_code = status.HTTP_200_OK
 
+    version = get_patient_version(request, patient_id)
     try:
-        patiententry = PatientEntry.objects.prefetch_related("entry_babies").get(
-            id=patient_id
-        )
-        context["patiententry"] = patiententry
-    except PatientEntry.DoesNotExist:
+        if version is None:
+            raise PatientEntry.DoesNotExist
+        context["patient_details"] = util.render_patient_details(patient_id, *version)
+    except ObjectDoesNotExist:
+        # Also if the entry was archived since its version was looked up
         status_code = status.HTTP_404_NOT_FOUND
 
     return HttpResponse(template.render(context), status=status_code)
@@ -60,10 +119,10 @@ def form(request):
     errors = []
     status_code = status.HTTP_200_OK
     if request.method == "POST":
-        entry, errors = util.save_model(request.POST)
+        entry, errors = util.save_model(request.POST, get_board(request))
         if entry:
             status_code = status.HTTP_201_CREATED
-            post_patient_update.delay()
+            broadcast_board_update(entry.board_id)
         else:
             status_code = status.HTTP_400_BAD_REQUEST
     return render(
@@ -75,23 +134,93 @@ def form(request):
 
 
 # API VIEWS
+def endpoint_timer(histogram, request):
+    """
+    Times the block in the histogram, labelled with the request's endpoint.
+    """
+    return histogram.labels(request.resolver_match.url_name).time()
+
+
+def create_patient_entry(data, board, board_url):
+    """
+    Saves a new patient entry from RapidPro, and queues the message to its
+    board's WhatsApp group. Returns the entry, its serialised data and errors.
+    """
+    patient_data = {}
+    with transaction.atomic():
+        patient_entry, errors = util.save_model(data, board)
+        if patient_entry:
+            patient_entry.refresh_from_db()
+            with rapidpro_serialise_duration.labels("rp_newpatiententry").time():
+                patient_data = util.serialise_patient_entry(patient_entry)
+
+            message = util.build_new_patient_message(patient_data, board_url)
+
+            util.create_outbox_message(
+                OutboxMessage.WA_GROUP,
+                {"body": message, "group_id": board.get_wa_group_id()},
+                idempotency_key=f"new-patient-{patient_entry.id}",
+            )
+            # Sent straight away, unless the group messages are being throttled
+            transaction.on_commit(send_wa_group_digest.delay)
+
+    if patient_entry:
+        broadcast_board_update(patient_entry.board_id)
+
+    return patient_entry, patient_data, errors
+
+
+def update_entry_status(updates, board):
+    patient_entries = util.save_entry_status_updates(updates, board)
+    for board_id in {entry.board_id for entry in patient_entries}:
+        broadcast_board_update(board_id)
+    return patient_entries
+
+
+def apply_queued_write(write):
+    """
+    Applies a write that was queued while the database was unavailable, as the
+    user that sent it.
+    """
+    user = User.objects.get(id=write["user_id"])
+    board = util.get_user_board(user)
+    if write["kind"] == "newentry":
+        create_patient_entry(write["data"], board, write["board_url"])
+    elif write["kind"] == "entrystatus":
+        update_entry_status(write["data"], board)
+    else:
+        raise ValueError("Unknown write {}".format(write["kind"]))
+
+
+def queue_write(request, kind, data):
+    """
+    Queues a write while the database is unavailable, or until the writes
+    queued before it have been saved, and tells RapidPro it was accepted.
+    """
+    write_id = writequeue.enqueue(
+        kind, data, user_id=request.user.pk, board_url=request.build_absolute_uri("/")
+    )
+    return JsonResponse(
+        {"queued": write_id, "errors": ""}, status=status.HTTP_202_ACCEPTED
+    )
+
+
 class NewPatientEntryView(APIView):
     def post(self, request):
-        patient_data = {}
         status_code = status.HTTP_201_CREATED
 
-        patient_entry, errors = util.save_model(util.get_rp_dict(request.data))
-        if patient_entry:
-            patient_entry.refresh_from_db()
-            patient_data = util.serialise_patient_entry(patient_entry)
-
-            message = util.build_new_patient_message(
-                patient_data, request.build_absolute_uri("/")
+        with endpoint_timer(rapidpro_results_duration, request):
+            data = util.get_rp_dict(request.data, context="newentry")
+        try:
+            if not writequeue.replay(apply_queued_write):
+                return queue_write(request, "newentry", data)
+            patient_entry, patient_data, errors = create_patient_entry(
+                data, util.get_user_board(request.user), request.build_absolute_uri("/")
             )
+        except writequeue.DATABASE_UNAVAILABLE:
+            return queue_write(request, "newentry", data)
 
-            send_wa_group_message.delay(message)
-            post_patient_update.delay()
-        else:
+        if not patient_entry:
             status_code = status.HTTP_400_BAD_REQUEST
 
         patient_data["errors"] = ", ".join(errors)
@@ -105,28 +234,47 @@ class CheckPatientExistsView(APIView):
         return_status = status.HTTP_200_OK
 
         try:
-            patient_id = util.get_rp_dict(request.data)["patient_id"]
-            patient_entry = PatientEntry.objects.get(id=patient_id)
+            with endpoint_timer(rapidpro_results_duration, request):
+                data = util.get_rp_dict(request.data, context="patient")
+            patient_entry = PatientEntry.objects.get(
+                id=data["patient_id"], board=util.get_user_board(request.user)
+            )
 
-            patient_data = util.serialise_patient_entry(patient_entry)
+            with endpoint_timer(rapidpro_serialise_duration, request):
+                patient_data = util.serialise_patient_entry(patient_entry)
         except PatientEntry.DoesNotExist:
             return_status = status.HTTP_404_NOT_FOUND
 
         return JsonResponse(patient_data, status=return_status)
 
 
+def conflict_response(error):
+    """
+    Tells RapidPro that the entry changed under it, so that the flow can fetch
+    the entry again and retry.
+    """
+    return JsonResponse({"errors": str(error)}, status=status.HTTP_409_CONFLICT)
+
+
 class UpdatePatientEntryView(APIView):
     def post(self, request):
         patient_data = {}
         status_code = status.HTTP_200_OK
 
-        changes_dict = util.get_rp_dict(request.data, context="entrychanges")
-        patient_entry, errors = util.save_model_changes(changes_dict)
+        with endpoint_timer(rapidpro_results_duration, request):
+            changes_dict = util.get_rp_dict(request.data, context="entrychanges")
+        try:
+            patient_entry, errors = util.save_model_changes(
+                changes_dict, util.get_user_board(request.user)
+            )
+        except util.ConcurrentUpdateError as e:
+            return conflict_response(e)
         if patient_entry:
             patient_entry.refresh_from_db()
-            patient_data = util.serialise_patient_entry(patient_entry)
+            with endpoint_timer(rapidpro_serialise_duration, request):
+                patient_data = util.serialise_patient_entry(patient_entry)
 
-            post_patient_update.delay()
+            broadcast_board_update(patient_entry.board_id)
         else:
             status_code = status.HTTP_400_BAD_REQUEST
 
@@ -135,52 +283,87 @@ class UpdatePatientEntryView(APIView):
         return JsonResponse(patient_data, status=status_code)
 
 
+class BulkUpdatePatientEntryView(APIView):
+    """
+    Applies several entry changes, for one or more patients, at once.
+    """
+
+    def post(self, request):
+        try:
+            with endpoint_timer(rapidpro_results_duration, request):
+                changes = [
+                    util.get_rp_dict(data, context="entrychanges")
+                    for data in request.data["changes"]
+                ]
+        except (KeyError, TypeError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            patient_entries, errors = util.save_entries_changes(
+                changes, util.get_user_board(request.user)
+            )
+        except util.ConcurrentUpdateError as e:
+            return conflict_response(e)
+        for board_id in {entry.board_id for entry in patient_entries}:
+            broadcast_board_update(board_id)
+
+        with endpoint_timer(rapidpro_serialise_duration, request):
+            patients = [util.serialise_patient_entry(e) for e in patient_entries]
+
+        return JsonResponse(
+            {"patients": patients, "errors": ", ".join(errors)},
+            status=status.HTTP_400_BAD_REQUEST if errors else status.HTTP_200_OK,
+        )
+
+
 class EntryStatusUpdateView(APIView):
     permission_classes = (IsAuthenticated,)
 
     def post(self, request):
-        data = util.get_rp_dict(request.data)
+        with endpoint_timer(rapidpro_results_duration, request):
+            updates = [util.get_rp_dict(request.data, context="entrystatus")]
         try:
-            patiententry = PatientEntry.objects.get(id=data["patient_id"])
-
-            if data["option"] == "Delivery":
-                patiententry.foetus = data["foetus"]
-                patiententry.starvation_hours = data.get("starvation_hours")
-
-                if data["baby_number"] == data["foetus"]:
-                    patiententry.completion_time = timezone.now()
-
-                default_data = {
-                    "apgar_1": data.get("apgar_1"),
-                    "apgar_5": data.get("apgar_5"),
-                    "baby_weight_grams": data.get("baby_weight_grams"),
-                    "delivery_time": data["delivery_time"],
-                }
-
-                if "nicu" in data:
-                    default_data["nicu"] = data["nicu"] == "Yes"
-
-                _, _ = Baby.objects.update_or_create(
-                    patiententry=patiententry,
-                    baby_number=data["baby_number"],
-                    defaults=default_data,
-                )
-
-            elif data["option"] == "Completed":
-                patiententry.completion_time = data["completion_time"]
-            elif data["option"] == "NonDelivery":
-                patiententry.anesthetic_time = data["anesthetic_time"]
-                patiententry.completion_time = timezone.now()
-                patiententry.starvation_hours = data.get("starvation_hours")
-            elif data["option"] == "ChangeOrCancel":
-                patiententry.operation_cancelled = True
-            else:
-                return Response(status=status.HTTP_400_BAD_REQUEST)
-
-            patiententry.save()
-            post_patient_update.delay()
+            if not writequeue.replay(apply_queued_write):
+                return queue_write(request, "entrystatus", updates)
+            update_entry_status(updates, util.get_user_board(request.user))
+        except writequeue.DATABASE_UNAVAILABLE:
+            return queue_write(request, "entrystatus", updates)
+        except util.ConcurrentUpdateError as e:
+            return conflict_response(e)
         except PatientEntry.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(status=status.HTTP_200_OK)
+
+
+class BulkEntryStatusUpdateView(APIView):
+    """
+    Applies several status updates, for example one for each baby of twins or
+    triplets, at once.
+    """
+
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request):
+        try:
+            with endpoint_timer(rapidpro_results_duration, request):
+                updates = [
+                    util.get_rp_dict(data, context="entrystatus")
+                    for data in request.data["updates"]
+                ]
+            if not writequeue.replay(apply_queued_write):
+                return queue_write(request, "entrystatus", updates)
+            update_entry_status(updates, util.get_user_board(request.user))
+        except writequeue.DATABASE_UNAVAILABLE:
+            return queue_write(request, "entrystatus", updates)
+        except util.ConcurrentUpdateError as e:
+            return conflict_response(e)
+        except PatientEntry.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        except (KeyError, TypeError, ValueError):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
 
         return Response(status=status.HTTP_200_OK)
 
@@ -240,17 +423,13 @@ class ActivePatientListView(APIView):
     permission_classes = (IsAuthenticated,)
 
     def get(self, request):
-        entries = PatientEntry.objects.filter(
-            completion_time__isnull=True, operation_cancelled=False
-        )
+        rows = util.get_rp_patient_list(util.get_user_board(request.user))
 
         ids = []
         patient_data = []
-        for count, entry in enumerate(entries, start=1):
-            patient_data.append(
-                f"{count}) {entry.surname} {entry.operation} {entry.indication} {entry.get_urgency_color()}"
-            )
-            ids.append(f"{count}={entry.id}")
+        for count, (entry_id, line) in enumerate(rows, start=1):
+            patient_data.append(f"{count}) {line}")
+            ids.append(f"{count}={entry_id}")
 
         data = {"patient_ids": "|".join(ids)}
 
@@ -298,7 +477,13 @@ class WhatsAppEventListener(APIView):
         if len(payload["messages"]) == 0 and len(payload["events"]) == 0:
             return Response(status=status.HTTP_200_OK)
 
-        send_rapidpro_event.delay(payload)
+        with transaction.atomic():
+            util.create_outbox_message(
+                OutboxMessage.RAPIDPRO_EVENT,
+                payload,
+                idempotency_key=util.get_payload_digest(payload),
+            )
+            transaction.on_commit(dispatch_rapidpro_events.delay)
 
         return Response(status=status.HTTP_200_OK)
 
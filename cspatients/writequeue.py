@@ -0,0 +1,155 @@
+import fcntl
+import json
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError, transaction
+from django.utils import timezone
+
+from .metrics import write_queue_failed, write_queue_pending
+from .models import ReplayedWrite
+
+logger = logging.getLogger(__name__)
+
+# What a write fails with when it can't reach the database
+DATABASE_UNAVAILABLE = (InterfaceError, OperationalError)
+
+
+def get_failed_path():
+    """
+    The file that writes which failed when they were replayed are kept in, next
+    to the queue.
+    """
+    root, ext = os.path.splitext(settings.WRITE_QUEUE_PATH)
+    return "{}.failed{}".format(root, ext)
+
+
+@contextmanager
+def locked_queue(lock=fcntl.LOCK_EX, path=None):
+    """
+    The queue file, locked against the other threads and processes on this
+    node.
+    """
+    with open(path or settings.WRITE_QUEUE_PATH, "a+") as f:
+        fcntl.flock(f, lock)
+        try:
+            f.seek(0)
+            yield f
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def read_writes(f):
+    return [json.loads(line) for line in f if line.strip()]
+
+
+def write_writes(f, writes):
+    f.seek(0)
+    f.truncate()
+    for write in writes:
+        f.write(json.dumps(write) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def append_write(write, path=None):
+    with locked_queue(path=path) as f:
+        f.seek(0, os.SEEK_END)
+        f.write(json.dumps(write) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def enqueue(kind, data, **kwargs):
+    """
+    Appends a write to the queue, and returns its id. The write is on disk by
+    the time this returns.
+    """
+    write = dict(
+        kwargs,
+        id=uuid.uuid4().hex,
+        kind=kind,
+        data=data,
+        queued_at=timezone.now().isoformat(),
+    )
+    append_write(write)
+    return write["id"]
+
+
+def get_pending_count(path=None):
+    path = path or settings.WRITE_QUEUE_PATH
+    try:
+        if os.path.getsize(path) == 0:
+            return 0
+    except OSError:
+        return 0
+
+    with locked_queue(fcntl.LOCK_SH, path) as f:
+        return len(read_writes(f))
+
+
+def get_failed_count():
+    return get_pending_count(get_failed_path())
+
+
+def requeue_failed():
+    """
+    Moves the writes that failed when they were replayed back onto the end of
+    the queue, for example once the cause was fixed, and returns how many were
+    moved.
+    """
+    with locked_queue() as f, locked_queue(path=get_failed_path()) as failed:
+        writes = read_writes(failed)
+        f.seek(0, os.SEEK_END)
+        for write in writes:
+            write.pop("error", None)
+            f.write(json.dumps(write) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+        write_writes(failed, [])
+    return len(writes)
+
+
+def replay(apply):
+    """
+    Applies the queued writes, in the order they were queued, with `apply`.
+    Each write is recorded as replayed in the same transaction, so it is never
+    applied twice. Stops if the database is still unavailable. A write that
+    fails for any other reason is moved to the failed writes file, so that it
+    doesn't block the writes behind it. Returns whether the queue is now empty,
+    so that new writes can go straight to the database without overtaking
+    queued ones.
+    """
+    if get_pending_count() == 0:
+        return True
+
+    with locked_queue() as f:
+        writes = read_writes(f)
+        done = 0
+        try:
+            for write in writes:
+                try:
+                    with transaction.atomic():
+                        _, created = ReplayedWrite.objects.get_or_create(id=write["id"])
+                        if created:
+                            apply(write)
+                except DATABASE_UNAVAILABLE:
+                    raise
+                except Exception as e:
+                    logger.exception("Queued write %s failed", write["id"])
+                    append_write(dict(write, error=repr(e)), get_failed_path())
+                done += 1
+        except DATABASE_UNAVAILABLE:
+            pass
+        finally:
+            if done:
+                write_writes(f, writes[done:])
+
+    return done == len(writes)
+
+
+write_queue_pending.set_function(get_pending_count)
+write_queue_failed.set_function(get_failed_count)
@@ -10,6 +10,7 @@ fi
 
 # Looks like a Celery command, let's run that with Celery's entrypoint script
 if [ "$1" = 'celery' ]; then
+  export PROCESS_ROLE="${PROCESS_ROLE:-worker}"
   set -- celery-entrypoint.sh "$@"
 fi
 
@@ -24,8 +25,23 @@ if [ "$1" = 'gunicorn' ] || [ "$1" = 'daphne' ]; then
   # Ultimately, the user shouldn't really be using a local DB and it's difficult
   # to offer support for all the cases in which a local DB might be created --
   # but here we do the minimum.
+  # Only migrate if there are unapplied migrations, which skips migrate's
+  # post-migrate checks on most container starts. The plan is read on its own,
+  # so that a failure, for example while the database is still starting, is
+  # retried and then stops the container rather than skipping migrations.
   if [ -z "$SKIP_MIGRATIONS" ]; then
-    su-exec django django-admin migrate --noinput
+    ATTEMPTS=0
+    until PLAN="$(su-exec django django-admin showmigrations --plan)"; do
+      ATTEMPTS=$((ATTEMPTS + 1))
+      if [ "$ATTEMPTS" -ge "${MIGRATION_CHECK_ATTEMPTS:-5}" ]; then
+        echo "Could not check for unapplied migrations" >&2
+        exit 1
+      fi
+      sleep 2
+    done
+    if echo "$PLAN" | grep -q '^\[ \]'; then
+      su-exec django django-admin migrate --noinput
+    fi
   fi
 
   if [ -n "$SUPERUSER_PASSWORD" ]; then
@@ -46,12 +62,12 @@ if not User.objects.filter(username='admin').exists():
 
   if [ -n "$CELERY_WORKER" ]; then
     ensure_celery_app
-    celery-entrypoint.sh worker --pool=solo --pidfile worker.pid &
+    PROCESS_ROLE=worker celery-entrypoint.sh worker --pool=solo --pidfile worker.pid &
   fi
 
   if [ -n "$CELERY_BEAT" ]; then
     ensure_celery_app
-    celery-entrypoint.sh beat --pidfile beat.pid &
+    PROCESS_ROLE=worker celery-entrypoint.sh beat --pidfile beat.pid &
   fi
 
   # Set some sensible Gunicorn  and daphne options, needed for things to work with Nginx
@@ -66,7 +82,11 @@ if not User.objects.filter(username='admin').exists():
         ${GUNICORN_ACCESS_LOGS:+--access-logfile -}
   fi
   if [ "$1" = 'daphne' ]; then
-    set -- su-exec django "$@" \
+    # The threads of the ASGI server share a pool of database connections
+    export DATABASE_CONNECTION_MODE="${DATABASE_CONNECTION_MODE:-pooled}"
+    # Run daphne with websocket compression enabled
+    shift
+    set -- su-exec django python -m momkhulu.server "$@" \
         -u /var/run/gunicorn/gunicorn.sock
   fi
 
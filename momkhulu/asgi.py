@@ -7,7 +7,13 @@ import os
 
 import django
 from channels.routing import get_default_application
+from django.conf import settings
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "momkhulu.settings.production")
 django.setup()
 application = get_default_application()
+
+if settings.CHANNEL_LAYER_BACKEND == "memory":
+    from cspatients.tasks import start_board_watcher
+
+    start_board_watcher()
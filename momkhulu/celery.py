@@ -3,7 +3,11 @@ from __future__ import absolute_import
 import os
 
 from celery import Celery
+from celery.concurrency import get_implementation
+from celery.concurrency.prefork import TaskPool as PreforkPool
+from celery.signals import worker_init, worker_process_init
 from django.conf import settings
+from django_prometheus.exports import SetupPrometheusEndpointOnPortRange
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "momkhulu.settings.production")
@@ -19,3 +23,28 @@ app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
 @app.task(bind=True)
 def debug_task(self):
     print("Request: {0!r}".format(self.request))
+
+
+def start_metrics_server():
+    """
+    Serves the metrics of this process on the first free port of
+    WORKER_METRICS_PORTS, as the web process's /metrics endpoint can't see them.
+    """
+    if settings.WORKER_METRICS_PORTS:
+        first, _, last = settings.WORKER_METRICS_PORTS.partition("-")
+        SetupPrometheusEndpointOnPortRange(
+            range(int(first), int(last or first) + 1), settings.WORKER_METRICS_ADDRESS
+        )
+
+
+@worker_init.connect
+def export_worker_metrics(sender, **kwargs):
+    # The prefork pool runs tasks in its child processes, which each export
+    # their own metrics
+    if get_implementation(sender.pool_cls) is not PreforkPool:
+        start_metrics_server()
+
+
+@worker_process_init.connect
+def export_pool_process_metrics(**kwargs):
+    start_metrics_server()
@@ -0,0 +1,42 @@
+"""
+Runs daphne with permessage-deflate enabled for websockets, which the daphne
+command line doesn't have an option for. Takes the same arguments as daphne.
+
+    $ python -m momkhulu.server momkhulu.asgi:application
+"""
+
+# Installs the asyncio reactor, so has to be imported before anything else
+# that uses Twisted
+from daphne.server import Server  # isort:skip
+
+from autobahn.websocket.compress import (
+    PerMessageDeflateOffer,
+    PerMessageDeflateOfferAccept,
+)
+from daphne.cli import CommandLineInterface
+from twisted.internet import reactor
+
+
+def accept_deflate(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer)
+
+
+class CompressingServer(Server):
+    def run(self):
+        # The websocket factory is created in run, so set the option once the
+        # reactor has started, before any connections are accepted
+        reactor.callWhenRunning(self.enable_compression)
+        super().run()
+
+    def enable_compression(self):
+        self.ws_factory.setProtocolOptions(perMessageCompressionAccept=accept_deflate)
+
+
+class CompressingCommandLineInterface(CommandLineInterface):
+    server_class = CompressingServer
+
+
+if __name__ == "__main__":
+    CompressingCommandLineInterface.entrypoint()
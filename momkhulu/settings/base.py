@@ -1,7 +1,11 @@
 import os
+import tempfile
+from datetime import timedelta
 
 import djcelery
 import environ
+from celery.schedules import crontab
+from django.core.exceptions import ImproperlyConfigured
 from kombu import Exchange, Queue
 
 root = environ.Path(__file__) - 3
@@ -31,16 +35,35 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django_prometheus.middleware.PrometheusBeforeMiddleware",
+    "cspatients.db.ReplicaMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "cspatients.profiling.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "django_prometheus.middleware.PrometheusAfterMiddleware",
 ]
 
+# "web" for the ASGI and WSGI servers, "worker" for Celery workers and beat. A
+# worker handles no requests, so it starts without the middleware and the apps
+# that only serve requests. The tasks still use the channel layer and DRF's
+# serializers, which don't need their apps, and the auth, sessions and DRF
+# token models, which stay so that deletes cascade to them.
+PROCESS_ROLE = env.str("PROCESS_ROLE", "web")
+WEB_ONLY_APPS = [
+    "channels",
+    "django.contrib.admin",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+    "django_prometheus",
+]
+if PROCESS_ROLE == "worker":
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in WEB_ONLY_APPS]
+    MIDDLEWARE = []
+
 ROOT_URLCONF = "momkhulu.urls"
 
 LOGIN_URL = "/accounts/login"
@@ -76,16 +99,82 @@ REDIS_URL = env.str(
         env.int("CHANNEL_LAYERS_PORT", 6379),
     ),
 )
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {"hosts": [REDIS_URL]},
+# "redis" shares the channel layer between processes and nodes. "memory" keeps it
+# inside the Daphne process, for single node deployments that serve everything
+# from one Daphne process and broadcast the board from there. Workers can't reach
+# it, so the Daphne process checks every BOARD_WATCH_SECONDS for boards they
+# changed, and sends them.
+CHANNEL_LAYER_BACKEND = env.str("CHANNEL_LAYER_BACKEND", "redis")
+BOARD_WATCH_SECONDS = env.float("BOARD_WATCH_SECONDS", 2)
+if CHANNEL_LAYER_BACKEND == "memory":
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [REDIS_URL]},
+        }
     }
-}
+
+# "celery" broadcasts board updates from a worker, "direct" from a thread pool in
+# the process that made the change, once it commits. An in-memory channel layer
+# is only reachable directly.
+BOARD_BROADCAST = env.str(
+    "BOARD_BROADCAST", "direct" if CHANNEL_LAYER_BACKEND == "memory" else "celery"
+)
+BOARD_BROADCAST_THREADS = env.int("BOARD_BROADCAST_THREADS", 2)
 
 # Database
 DATABASES = {"default": env.db(default="postgres://postgres@localhost:5432/momkhulu")}
 
+# Read only views read from the replica if one is configured, except for
+# clients that wrote in the last REPLICA_STICKY_SECONDS
+REPLICA_DATABASE = None
+if env.str("REPLICA_DATABASE_URL", ""):
+    REPLICA_DATABASE = "replica"
+    DATABASES[REPLICA_DATABASE] = env.db("REPLICA_DATABASE_URL")
+    DATABASES[REPLICA_DATABASE]["TEST"] = {"MIRROR": "default"}
+
+# "persistent" keeps each process's database connections open between requests
+# and tasks. "pooled" shares a pool of connections between the threads of a
+# process, which suits the ASGI server. A thread waits up to
+# DATABASE_POOL_TIMEOUT seconds for a pooled connection when all are in use.
+DATABASE_CONNECTION_MODE = env.str("DATABASE_CONNECTION_MODE", "persistent")
+DATABASE_HEALTH_CHECKS = env.bool("DATABASE_HEALTH_CHECKS", True)
+for database in DATABASES.values():
+    if DATABASE_CONNECTION_MODE == "pooled" and "postgresql" in database["ENGINE"]:
+        database["ENGINE"] = "cspatients.backends.postgresql_pool"
+        database["CONN_MAX_AGE"] = 0
+        database["POOL_MAX_SIZE"] = env.int("DATABASE_POOL_MAX_SIZE", 20)
+        database["POOL_TIMEOUT"] = env.int("DATABASE_POOL_TIMEOUT", 10)
+    elif DATABASE_CONNECTION_MODE == "persistent":
+        database["CONN_MAX_AGE"] = env.int("DATABASE_CONN_MAX_AGE", 300)
+
+DATABASE_ROUTERS = ["cspatients.db.ReplicaRouter"]
+REPLICA_STICKY_SECONDS = env.int("REPLICA_STICKY_SECONDS", 30)
+REPLICA_READ_URL_NAMES = [
+    "root",
+    "cspatient_view",
+    "cspatient_patient",
+    "rp_patientexits",
+    "rp_patient_list",
+]
+
+# Cache, by default large enough to hold a rendered row for each patient on the
+# board
+CACHES = {"default": env.cache("CACHE_URL", default="locmemcache://?max_entries=5000")}
+
+# API clients that wrote recently are remembered in the cache, so with a replica
+# the cache must be shared by every process that serves requests
+LOCAL_CACHE_BACKENDS = [
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+]
+if REPLICA_DATABASE and CACHES["default"]["BACKEND"] in LOCAL_CACHE_BACKENDS:
+    raise ImproperlyConfigured(
+        "REPLICA_DATABASE_URL needs CACHE_URL to be a cache shared by all processes"
+    )
+
 # Password validation
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -121,7 +210,7 @@ STATIC_ROOT = os.path.join(BASE_DIR, "staticfiles")
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework.authentication.BasicAuthentication",
-        "rest_framework.authentication.TokenAuthentication",
+        "cspatients.authentication.TokenAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
 }
@@ -141,8 +230,32 @@ CELERY_ALWAYS_EAGER = False
 CELERY_IMPORTS = ("cspatients.tasks",)
 
 CELERY_CREATE_MISSING_QUEUES = True
+
+# djcelery closes the database connections around every task unless told to
+# reuse them
+if DATABASE_CONNECTION_MODE == "persistent":
+    CELERY_DB_REUSE_MAX = env.int("CELERY_DB_REUSE_MAX", 1000)
 CELERY_ROUTES = {"celery.backend_cleanup": {"queue": "mediumpriority"}}
 
+CELERYBEAT_SCHEDULE = {
+    "dispatch-outbox": {
+        "task": "cspatients.tasks.dispatch_outbox",
+        "schedule": timedelta(minutes=1),
+    },
+    "update-board-rollovers": {
+        "task": "cspatients.tasks.update_board_rollovers",
+        "schedule": crontab(minute=0),
+    },
+    "archive-old-patient-entries": {
+        "task": "cspatients.tasks.archive_old_patient_entries",
+        "schedule": crontab(hour=0, minute=30),
+    },
+    "replay-queued-writes": {
+        "task": "cspatients.tasks.replay_queued_writes",
+        "schedule": timedelta(minutes=1),
+    },
+}
+
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_ACCEPT_CONTENT = ["json"]
@@ -159,5 +272,64 @@ RAPIDPRO_CHANNEL_URL = env.str("RAPIDPRO_CHANNEL_URL", "REPLACEME")
 
 TURN_TOKEN = env.str("TURN_TOKEN", "REPLACEME")
 TURN_URL = env.str("TURN_URL", "REPLACEME")
+TURN_GROUP_MESSAGES_PER_MINUTE = env.int("TURN_GROUP_MESSAGES_PER_MINUTE", 6)
+TURN_GROUP_MESSAGE_BURST = env.int("TURN_GROUP_MESSAGE_BURST", 3)
+
+OUTBOX_BATCH_SIZE = env.int("OUTBOX_BATCH_SIZE", 50)
+# A dispatcher has this long to send each outbox message it claims, before
+# another dispatcher may send it. The claim on a batch is renewed as each of its
+# messages is sent.
+OUTBOX_CLAIM_SECONDS = env.int("OUTBOX_CLAIM_SECONDS", 60)
+# Seconds to wait for Turn and RapidPro to accept and answer each request
+OUTBOUND_REQUEST_TIMEOUT = env.float("OUTBOUND_REQUEST_TIMEOUT", 5)
+
+# Completed and cancelled entries are archived this many days after their last update
+ARCHIVE_AFTER_DAYS = env.int("ARCHIVE_AFTER_DAYS", 30)
+
+# The board shown to users
+DEFAULT_BOARD = env.str("DEFAULT_BOARD", "default")
+
+# Rendered board rows are cached until their patient entry changes, or this
+# many seconds
+BOARD_ROW_CACHE_TIMEOUT = env.int("BOARD_ROW_CACHE_TIMEOUT", 60 * 60 * 24)
+
+# Rendered patient details are cached until the patient entry or one of its
+# babies changes, or this many seconds
+PATIENT_DETAILS_CACHE_TIMEOUT = env.int("PATIENT_DETAILS_CACHE_TIMEOUT", 60 * 60)
+
+# Part of the ETag of each page, so that a deploy invalidates cached pages
+ETAG_SALT = env.str("ETAG_SALT", env.str("MARATHON_APP_VERSION", ""))
 
 PROMETHEUS_EXPORT_MIGRATIONS = env.bool("PROMETHEUS_EXPORT_MIGRATIONS", False)
+
+# Celery workers serve their metrics, such as the WhatsApp group message queue
+# depth, for Prometheus to scrape on the first free port in the
+# WORKER_METRICS_PORTS range, for example "9101-9108", one port for each process
+# that runs tasks. Worker metrics aren't exported if it isn't set.
+WORKER_METRICS_PORTS = env.str("WORKER_METRICS_PORTS", "")
+WORKER_METRICS_ADDRESS = env.str("WORKER_METRICS_ADDRESS", "")
+
+# RapidPro writes that fail while the database is unavailable are queued in
+# the WRITE_QUEUE_PATH file, and replayed before the next write or by the
+# replay_queued_writes task, whichever comes first. Writes that fail when they
+# are replayed are kept in a ".failed" file next to it, until they are replayed
+# with the replay_failed_writes command. The path must be on a persistent volume
+# shared by the web and worker processes, so it is required in production.
+WRITE_QUEUE_PATH = env.str(
+    "WRITE_QUEUE_PATH",
+    os.path.join(tempfile.gettempdir(), "momkhulu-write-queue.jsonl"),
+)
+
+# API tokens are remembered in the cache for this many seconds after they were
+# last checked, so that writes can be queued without the database. Set
+# CACHE_URL to a shared cache so that every process can check them.
+TOKEN_CACHE_TIMEOUT = env.int("TOKEN_CACHE_TIMEOUT", 60 * 60 * 24 * 7)
+
+# When REQUEST_PROFILING is on, requests with the X-Momkhulu-Profile header are
+# profiled if the header is signed, see cspatients.profiling.get_profile_header,
+# or the user is staff.
+# The newest PROFILING_KEEP profiles are kept for the admin.
+REQUEST_PROFILING = env.bool("REQUEST_PROFILING", False)
+PROFILING_SIGNATURE_MAX_AGE = env.int("PROFILING_SIGNATURE_MAX_AGE", 60 * 60)
+PROFILING_KEEP = env.int("PROFILING_KEEP", 50)
+PROFILING_TOP_N = env.int("PROFILING_TOP_N", 30)
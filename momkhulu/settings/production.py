@@ -2,6 +2,7 @@ from .base import *  # noqa
 from .base import env
 
 SECRET_KEY = env("SECRET_KEY")
+WRITE_QUEUE_PATH = env.str("WRITE_QUEUE_PATH")
 ALLOWED_HOSTS = env.str("ALLOWED_HOSTS", "").split(",")
 
 # Configure Sentry Logging